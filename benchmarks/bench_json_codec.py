@@ -0,0 +1,162 @@
+'''
+Per-batch CPU cost of serializing the $batch requests and parsing the $batch responses.
+
+Compares the previous stdlib json handling (the requests serialized by `json.dumps`, the whole response decoded
+by `json.loads` and the status matched by an if/elif chain) with the codec using the standard json module
+and orjson, when installed. A batch holds 20 created items with the given number of text fields, the response
+echoes all their fields as SharePoint does.
+
+Example:
+    python benchmarks/bench_json_codec.py --columns 10 100 --width 20
+'''
+import argparse
+import json
+import os
+import sys
+import timeit
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+from ms_graph import codec, exceptions  # noqa: E402
+from ms_graph.batch import encode_create_item_request, parse_batch_response, with_request_id  # noqa: E402
+from ms_graph.client import Client  # noqa: E402
+
+BATCH_SIZE = 20
+# statuses of the failed sub-responses, matched by the whole chain in the worst case
+STATUSES = (404, 429, 503, 509)
+
+
+def build_fields(column_count, width, row):
+    return {f'field_{i}': f'{row:0{width}d}ěšč'[:width] for i in range(column_count)}
+
+
+def build_response(rows):
+    return json.dumps({'responses': [
+        {'id': str(i), 'status': 201, 'headers': {'Content-Type': 'application/json'},
+         'body': {'@odata.etag': f'"{i},1"', 'id': str(1000 + i), 'createdDateTime': '2024-01-01T00:00:00Z',
+                  'fields': {'@odata.etag': f'"{i},1"', 'id': str(1000 + i), **fields}}}
+        for i, fields in enumerate(rows)]}, ensure_ascii=False).encode('utf-8')
+
+
+def legacy_encode(rows):
+    requests = [{'id': str(i), 'url': '/sites/site/lists/list/items', 'method': 'POST',
+                 'headers': {'Content-Type': 'application/json'}, 'body': {'fields': fields}}
+                for i, fields in enumerate(rows)]
+    return json.dumps({'requests': requests}).encode('utf-8')
+
+
+def codec_encode(rows):
+    return Client._encode_batch([with_request_id(str(i), encode_create_item_request('site', 'list', fields))
+                                 for i, fields in enumerate(rows)])
+
+
+def legacy_status_error(status_code):
+    # the previous chain, shortened to the benchmarked statuses in their original positions
+    if status_code in (200, 201, 202):
+        return None
+    elif status_code == 204:
+        return None
+    elif status_code == 400:
+        return exceptions.BadRequest
+    elif status_code == 401:
+        return exceptions.Unauthorized
+    elif status_code == 403:
+        return exceptions.Forbidden
+    elif status_code == 404:
+        return exceptions.NotFound
+    elif status_code == 405:
+        return exceptions.MethodNotAllowed
+    elif status_code == 406:
+        return exceptions.NotAcceptable
+    elif status_code == 409:
+        return exceptions.Conflict
+    elif status_code == 410:
+        return exceptions.Gone
+    elif status_code == 411:
+        return exceptions.LengthRequired
+    elif status_code == 412:
+        return exceptions.PreconditionFailed
+    elif status_code == 413:
+        return exceptions.RequestEntityTooLarge
+    elif status_code == 415:
+        return exceptions.UnsupportedMediaType
+    elif status_code == 416:
+        return exceptions.RequestedRangeNotSatisfiable
+    elif status_code == 422:
+        return exceptions.UnprocessableEntity
+    elif status_code == 429:
+        return exceptions.TooManyRequests
+    elif status_code == 500:
+        return exceptions.InternalServerError
+    elif status_code == 501:
+        return exceptions.NotImplemented
+    elif status_code == 503:
+        return exceptions.ServiceUnavailable
+    elif status_code == 504:
+        return exceptions.GatewayTimeout
+    elif status_code == 507:
+        return exceptions.InsufficientStorage
+    elif status_code == 509:
+        return exceptions.BandwidthLimitExceeded
+    return exceptions.UnknownError
+
+
+def table_status_error(status_code):
+    if status_code in (200, 201, 202, 204):
+        return None
+    return exceptions.STATUS_ERRORS.get(status_code, exceptions.UnknownError)
+
+
+def measure(stmt, number, repeat):
+    """
+    :return: best time per call in microseconds
+    """
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number * 1e6
+
+
+def use_backend(name):
+    """
+    Switches the codec functions used by the client and the batch helpers.
+    """
+    if name == 'orjson':
+        codec.dumps, codec.loads = codec._orjson_dumps, codec.orjson.loads
+    else:
+        codec.dumps, codec.loads = codec._json_dumps, json.loads
+
+
+def run(args):
+    backends = ['json'] + (['orjson'] if codec.orjson else [])
+    print(f"{'columns':>7} {'batch KB':>8}  {'implementation':<14} {'encode us':>10} {'parse us':>10}")
+    for column_count in args.columns:
+        rows = [build_fields(column_count, args.width, r) for r in range(BATCH_SIZE)]
+        response = build_response(rows)
+        size = len(response) / 1024
+        legacy_encode_us = measure(lambda: legacy_encode(rows), args.number, args.repeat)
+        legacy_parse_us = measure(lambda: json.loads(response), args.number, args.repeat)
+        print(f'{column_count:>7} {size:>8.1f}  {"legacy":<14} {legacy_encode_us:>10.1f} {legacy_parse_us:>10.1f}')
+        for backend in backends:
+            use_backend(backend)
+            encode_us = measure(lambda: codec_encode(rows), args.number, args.repeat)
+            parse_us = measure(lambda: parse_batch_response(response), args.number, args.repeat)
+            print(f'{column_count:>7} {size:>8.1f}  {"codec " + backend:<14} {encode_us:>10.1f} {parse_us:>10.1f}',
+                  flush=True)
+        use_backend(codec.BACKEND)
+
+    number = args.number * 100
+    legacy = measure(lambda: [legacy_status_error(s) for s in STATUSES], number, args.repeat) / len(STATUSES)
+    table = measure(lambda: [table_status_error(s) for s in STATUSES], number, args.repeat) / len(STATUSES)
+    print(f'\nstatus -> error: chain {legacy * 1000:.0f} ns, table {table * 1000:.0f} ns per failed response')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--columns', type=int, nargs='+', default=[10, 100], help='number of fields of an item')
+    parser.add_argument('--width', type=int, default=20, help='characters of each field value')
+    parser.add_argument('--number', type=int, default=200, help='batches per measurement')
+    parser.add_argument('--repeat', type=int, default=5)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())
@@ -0,0 +1,371 @@
+'''
+Local stand-in of the Microsoft Graph API used by the benchmarks.
+
+Supports the endpoints used by the component: token refresh, site and list lookup, list columns, paged list items,
+item create / update / delete and $batch. Latency, throttling (429 / 503 with Retry-After) and token expiration
+(401) can be injected.
+
+'''
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+SITE_ID = 'mock.sharepoint.com,site-1,web-1'
+API_PREFIX = '/v1.0'
+MAX_PAGE_SIZE = 5000
+DEFAULT_PAGE_SIZE = 200
+
+
+class MockList:
+
+    def __init__(self, list_id, name, columns):
+        self.id = list_id
+        self.name = name
+        # the url name is kept when the list is renamed
+        self.url_name = name.replace('-', '')
+        self.columns = columns
+        self.items = dict()
+        self.version = 1
+        self.modified = datetime.now(timezone.utc)
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def to_dict(self, with_columns=False):
+        res = {'id': self.id,
+               'name': self.url_name,
+               'displayName': self.name,
+               'eTag': f'"{self.id},{self.version}"',
+               'lastModifiedDateTime': self.modified.isoformat().replace('+00:00', 'Z')}
+        if with_columns:
+            res['columns'] = self.columns
+        return res
+
+    def create_item(self, fields, keep_fields):
+        with self._lock:
+            item_id = str(self._next_id)
+            self._next_id += 1
+            self.items[item_id] = dict(fields) if keep_fields else None
+            self._touch()
+        return item_id
+
+    def update_item(self, item_id, fields, keep_fields):
+        with self._lock:
+            if item_id not in self.items:
+                return False
+            if keep_fields:
+                self.items[item_id].update(fields)
+            self._touch()
+        return True
+
+    def delete_item(self, item_id):
+        with self._lock:
+            if self.items.pop(item_id, False) is False:
+                return False
+            self._touch()
+        return True
+
+    def _touch(self):
+        self.version += 1
+        self.modified = datetime.now(timezone.utc)
+
+
+class MockGraphServer:
+    """
+    Threaded HTTP server emulating the Graph API in memory.
+
+    :param latency: seconds added to each HTTP request
+    :param item_latency: seconds added to each batch sub-request
+    :param throttle_rate: probability of a request being throttled as a whole
+    :param batch_throttle_rate: probability of a batch sub-request being throttled
+    :param retry_after: Retry-After value of the throttled responses in seconds
+    :param token_lifetime: number of seconds the issued tokens are accepted
+    :param reported_lifetime: expires_in sent to the client, defaults to the token lifetime.
+                              Set higher than the lifetime to make the client run into 401 responses.
+    :param keep_fields: store the item fields, otherwise only the item ids are kept to save memory
+    """
+
+    def __init__(self, latency=0.0, item_latency=0.0, throttle_rate=0.0, batch_throttle_rate=0.0, retry_after=1,
+                 token_lifetime=3600, reported_lifetime=None, keep_fields=False, seed=None):
+        self.latency = latency
+        self.item_latency = item_latency
+        self.throttle_rate = throttle_rate
+        self.batch_throttle_rate = batch_throttle_rate
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.reported_lifetime = reported_lifetime or token_lifetime
+        self.keep_fields = keep_fields
+        self.lists = dict()
+        self._next_list_id = 0
+        self.stats = Counter()
+        self._tokens = dict()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_url(self):
+        return self.url + API_PREFIX + '/'
+
+    @property
+    def token_url(self):
+        return self.url + '/token'
+
+    def start(self, host='127.0.0.1', port=0):
+        handler = type('Handler', (_GraphRequestHandler,), {'graph': self})
+        self._httpd = ThreadingHTTPServer((host, port), handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def create_list(self, name, columns=None):
+        with self._lock:
+            self._next_list_id += 1
+            list_id = f'list-{self._next_list_id}'
+        columns = [{'name': 'Title', 'displayName': 'Title', 'required': True, 'text': {}}] + list(columns or [])
+        self.lists[list_id] = MockList(list_id, name, columns)
+        return self.lists[list_id]
+
+    def add_items(self, list_id, count, fields=None):
+        lst = self.lists[list_id]
+        for _ in range(count):
+            lst.create_item(fields or {}, self.keep_fields)
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+
+    def count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    # ---------------------------------------------------------------- auth & fault injection
+
+    def issue_token(self):
+        token = f'token-{self._random.getrandbits(64):x}'
+        with self._lock:
+            self._tokens[token] = time.monotonic() + self.token_lifetime
+        return {'token_type': 'Bearer', 'access_token': token, 'refresh_token': 'refresh',
+                'expires_in': self.reported_lifetime}
+
+    def is_authorized(self, header):
+        token = (header or '')[len('Bearer '):]
+        expires = self._tokens.get(token)
+        return expires is not None and time.monotonic() < expires
+
+    def throttle(self, rate):
+        if rate and self._random.random() < rate:
+            return self._random.choice((429, 503))
+        return None
+
+    # ---------------------------------------------------------------- routing
+
+    def handle(self, method, path, query, body):
+        """
+        :return: status, body, headers
+        """
+        parts = [p for p in path[len(API_PREFIX):].split('/') if p]
+        if parts == ['$batch']:
+            return self._handle_batch(body)
+
+        if len(parts) >= 2 and parts[0] == 'sites' and ':' in parts[1]:
+            return 200, {'id': SITE_ID, 'name': 'bench'}, {}
+        if len(parts) < 3 or parts[0] != 'sites' or parts[2] != 'lists':
+            return _error(404, 'itemNotFound', f'Unknown resource {path}')
+
+        if len(parts) == 3:
+            if method == 'POST':
+                lst = self.create_list(body['displayName'], body.get('columns'))
+                return 201, lst.to_dict(), {}
+            return self._find_lists(query)
+
+        lst = self.lists.get(parts[3]) or self._get_list_by_title(parts[3])
+        if not lst:
+            return _error(404, 'itemNotFound', 'The list does not exist.')
+        if len(parts) == 4 and method == 'DELETE':
+            del self.lists[lst.id]
+            return 204, None, {}
+        if len(parts) == 4 and method == 'PATCH':
+            lst.name = body.get('displayName', lst.name)
+            return 200, lst.to_dict(), {}
+        if len(parts) == 4:
+            expand = query.get('expand', query.get('$expand', ['']))[0]
+            res = lst.to_dict(with_columns=expand.startswith('columns'))
+            if query.get('$select'):
+                selected = query['$select'][0].split(',')
+                res = {k: v for k, v in res.items() if k in selected or k == 'columns'}
+            return 200, res, {}
+        if parts[4] != 'items':
+            return _error(404, 'itemNotFound', f'Unknown resource {path}')
+        return self._handle_items(lst, method, parts[5:], query, body, path)
+
+    def _find_lists(self, query):
+        lists = [lst.to_dict() for lst in self.lists.values()]
+        filter_expr = query.get('$filter', [None])[0]
+        if filter_expr:
+            prop, _, value = filter_expr.split(' ', 2)
+            value = value.strip("'").replace("''", "'")
+            lists = [lst for lst in lists if lst.get(prop) == value]
+        return 200, {'value': lists}, {}
+
+    def _get_list_by_title(self, title):
+        return next((lst for lst in self.lists.values() if lst.name == title), None)
+
+    def _handle_items(self, lst, method, rest, query, body, path):
+        if not rest:
+            if method == 'POST':
+                item_id = lst.create_item(body.get('fields', {}), self.keep_fields)
+                return 201, {'id': item_id, 'fields': body.get('fields', {})}, {}
+            return self._list_items(lst, query, path)
+
+        item_id = rest[0]
+        if method == 'DELETE':
+            if not lst.delete_item(item_id):
+                return _error(404, 'itemNotFound', 'The item does not exist.')
+            return 204, None, {}
+        if method == 'PATCH':
+            if not lst.update_item(item_id, body or {}, self.keep_fields):
+                return _error(404, 'itemNotFound', 'The item does not exist.')
+            return 200, body, {}
+        if item_id not in lst.items:
+            return _error(404, 'itemNotFound', 'The item does not exist.')
+        return 200, {'id': item_id, 'fields': lst.items[item_id] or {}}, {}
+
+    def _list_items(self, lst, query, path):
+        page_size = min(int(query.get('$top', [DEFAULT_PAGE_SIZE])[0]), MAX_PAGE_SIZE)
+        # the skip token is the last returned id, so the paging is not affected by the concurrent deletes
+        last_id = int(query.get('$skiptoken', ['0'])[0])
+        expand = query.get('$expand', query.get('expand', [None]))[0]
+        # ordered by the numeric id as SharePoint does
+        # the items are created with increasing ids, so the keys are sorted
+        keys = list(lst.items)
+        lo, hi = 0, len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if int(keys[mid]) <= last_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        ids = keys[lo:lo + page_size]
+        if expand:
+            value = [{'id': i, 'fields': {'id': i, **(lst.items.get(i) or {})}} for i in ids]
+        else:
+            value = [{'id': i} for i in ids]
+        res = {'value': value}
+        if lo + page_size < len(keys):
+            next_query = {k: v[0] for k, v in query.items() if k != '$skiptoken'}
+            next_query['$skiptoken'] = ids[-1]
+            res['@odata.nextLink'] = self.url + path + '?' + '&'.join(f'{k}={quote(str(v))}'
+                                                                      for k, v in next_query.items())
+        return 200, res, {}
+
+    def _handle_batch(self, body):
+        requests = body.get('requests', [])
+        if len(requests) > 20:
+            return _error(400, 'invalidRequest', 'The batch contains more than 20 requests.')
+        self.count('batch_requests')
+        self.count('batch_items', len(requests))
+        responses = []
+        for rq in requests:
+            if self.item_latency:
+                time.sleep(self.item_latency)
+            status = self.throttle(self.batch_throttle_rate)
+            if status:
+                self.count(f'status_{status}')
+                responses.append({'id': rq['id'], 'status': status,
+                                  'headers': {'Retry-After': str(self.retry_after)},
+                                  'body': {'error': {'code': 'activityLimitReached', 'message': 'Throttled'}}})
+                continue
+            url = urlsplit(rq['url'])
+            status, res_body, headers = self.handle(rq['method'], API_PREFIX + url.path, parse_qs(url.query),
+                                                    rq.get('body'))
+            self.count(f'status_{status}')
+            responses.append({'id': rq['id'], 'status': status, 'headers': headers, 'body': res_body})
+        # the order of the responses is not guaranteed
+        self._random.shuffle(responses)
+        return 200, {'responses': responses}, {}
+
+
+class _GraphRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send the headers and the body in one segment, avoids the delayed ACK stalls on keep-alive connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    graph: MockGraphServer = None
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        graph = self.graph
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+        url = urlsplit(self.path)
+        graph.count('requests')
+        graph.count('bytes_received', length)
+        if graph.latency:
+            time.sleep(graph.latency)
+
+        if url.path == '/token':
+            return self._send(200, graph.issue_token())
+        if not graph.is_authorized(self.headers.get('Authorization')):
+            graph.count('status_401')
+            return self._send(*_error(401, 'InvalidAuthenticationToken', 'Access token has expired.'))
+        throttled = graph.throttle(graph.throttle_rate)
+        if throttled:
+            graph.count(f'status_{throttled}')
+            return self._send(*_error(throttled, 'activityLimitReached', 'Throttled',
+                                      {'Retry-After': str(graph.retry_after)}))
+
+        body = json.loads(raw_body) if raw_body and 'json' in (self.headers.get('Content-Type') or '') else None
+        status, res_body, headers = graph.handle(method, url.path, parse_qs(url.query), body)
+        self._send(status, res_body, headers)
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', 'application/json' if body is not None else 'text/plain')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.graph.count('bytes_sent', len(payload))
+
+
+def _error(status, code, message, headers=None):
+    return status, {'error': {'code': code, 'message': message}}, headers or {}
@@ -0,0 +1,259 @@
+'''
+Throughput benchmarks of the component against the local Graph API stand-in.
+
+Each scenario runs in a fresh process, so the peak memory is not affected by the previous runs or by the mock server.
+
+Example:
+    python benchmarks/run_benchmarks.py --rows 1000 10000 100000 1000000 --latency 0.02 --batch-throttle-rate 0.01
+
+'''
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+SRC_DIR = os.path.join(BENCHMARKS_DIR, '..', 'src')
+sys.path.append(SRC_DIR)
+sys.path.append(BENCHMARKS_DIR)
+
+from mock_graph import MockGraphServer, SITE_ID  # noqa: E402
+
+SCENARIOS = ('write', 'delete', 'purge', 'run', 'recreate', 'staging', 'reuse')
+LIST_NAME = 'Benchmark'
+TABLE_NAME = 'benchmark.csv'
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ------------------------------------------------------------------ input data
+
+def build_columns(column_count):
+    return ['Title', 'amount'] + [f'col_{i}' for i in range(column_count)]
+
+
+def build_list_columns(column_count):
+    return ([{'name': 'amount', 'displayName': 'amount', 'required': False, 'number': {}}]
+            + [{'name': f'col_{i}', 'displayName': f'col_{i}', 'required': False, 'text': {}}
+               for i in range(column_count)])
+
+
+def write_data_dir(data_dir, rows, column_count, width, parameters):
+    """
+    Creates the Keboola data folder with the configuration and a synthetic input table.
+    """
+    for d in ('in/tables', 'in/files', 'out/tables', 'out/files'):
+        os.makedirs(os.path.join(data_dir, d), exist_ok=True)
+    header = build_columns(column_count)
+    table_path = os.path.join(data_dir, 'in', 'tables', TABLE_NAME)
+    with open(table_path, 'w', encoding='utf-8', newline='') as out_file:
+        writer = csv.writer(out_file, lineterminator='\n')
+        writer.writerow(header)
+        value = 'x' * width
+        for i in range(rows):
+            writer.writerow([f'row {i}', i * 1.5] + [value] * column_count)
+    with open(table_path + '.manifest', 'w') as out_file:
+        json.dump({'id': 'in.c-benchmark.benchmark', 'columns': header}, out_file)
+
+    config = {'storage': {'input': {'tables': [{'source': 'in.c-benchmark.benchmark', 'destination': TABLE_NAME}]},
+                          'output': {'tables': [], 'files': []}},
+              'parameters': {'base_host_name': 'mock.sharepoint.com', 'site_url_rel_path': '/sites/benchmark',
+                             'list_name': LIST_NAME, **parameters},
+              'authorization': {'oauth_api': {'credentials': {'#data': json.dumps({'refresh_token': 'refresh'}),
+                                                              'appKey': 'app', '#appSecret': 'secret'}}}}
+    with open(os.path.join(data_dir, 'config.json'), 'w') as out_file:
+        json.dump(config, out_file)
+
+
+# ------------------------------------------------------------------ scenarios, executed in the worker process
+
+def _client_class(api_url, token_url, latencies):
+    from ms_graph.client import Client
+
+    class BenchmarkClient(Client):
+        BASE_URL = api_url
+        OAUTH_LOGIN_URL = token_url
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._session.hooks['response'].append(
+                lambda r, *a, **kw: latencies.append(r.elapsed.total_seconds()))
+
+    return BenchmarkClient
+
+
+def run_scenario(scenario, data_dir, api_url, token_url, list_id, concurrency):
+    """
+    :return: dict with the elapsed time, client side latency percentiles and the peak memory of the process
+    """
+    sys.path.append(SRC_DIR)
+    latencies = []
+    client_class = _client_class(api_url, token_url, latencies)
+    baseline_memory = peak_memory_mb()
+    # start of the measured part, the setup requests are excluded
+    marks = {'start': time.monotonic()}
+    error = None
+    try:
+        failed = _run(scenario, data_dir, client_class, marks, latencies, list_id, concurrency)
+    except (Exception, SystemExit) as e:
+        # the client exceptions can't be passed to the parent process
+        error = repr(e)
+        failed = []
+    elapsed = time.monotonic() - marks['start']
+
+    return {'elapsed': elapsed,
+            'failed': len(failed),
+            'error': error,
+            'p50_ms': _to_ms(percentile(latencies, 0.5)),
+            'p99_ms': _to_ms(percentile(latencies, 0.99)),
+            'baseline_memory_mb': baseline_memory,
+            'peak_memory_mb': peak_memory_mb()}
+
+
+def _run(scenario, data_dir, client_class, marks, latencies, list_id, concurrency):
+    """
+    :return: list of failed items
+    """
+    import component
+    from column_plan import ColumnPlan
+    from ingestion import TableReader
+    from ms_graph.purge import ListPurger
+
+    client_patch = mock.patch.object(component, 'Client', client_class)
+    with mock.patch.dict(os.environ, {'KBC_DATADIR': data_dir}), client_patch:
+        if scenario in ('delete', 'purge'):
+            client = client_class(refresh_token='refresh', client_secret='secret', client_id='app',
+                                  scope=component.OAUTH_APP_SCOPE, max_concurrency=concurrency)
+            if scenario == 'delete':
+                item_ids = [i for page in client.get_list_item_ids(SITE_ID, list_id) for i in page]
+                _start_measurement(marks, latencies)
+                return client.delete_list_items(SITE_ID, list_id, item_ids)
+            _start_measurement(marks, latencies)
+            return ListPurger(client, max_in_flight=concurrency).purge(SITE_ID, list_id).failed
+        elif scenario == 'write':
+            comp = component.Component()
+            table = TableReader(comp.configuration.get_input_tables()[0])
+            list_columns = comp.client.get_site_list_columns(SITE_ID, list_id, expand_par='columns')
+            plan = ColumnPlan(table.header, list_columns, [])
+            _start_measurement(marks, latencies)
+            comp.write_table(SITE_ID, list_id, table, plan)
+        else:
+            comp = component.Component()
+            if scenario != 'run':
+                # full run with another replace strategy
+                comp.cfg_params[component.KEY_REPLACE_STRATEGY] = scenario
+            _start_measurement(marks, latencies)
+            comp.run()
+        return []
+
+
+def _start_measurement(marks, latencies):
+    latencies.clear()
+    marks['start'] = time.monotonic()
+
+
+def _to_ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+# ------------------------------------------------------------------ harness
+
+def run_benchmarks(args):
+    server = MockGraphServer(latency=args.latency, item_latency=args.item_latency,
+                             throttle_rate=args.throttle_rate, batch_throttle_rate=args.batch_throttle_rate,
+                             retry_after=args.retry_after, token_lifetime=args.token_lifetime,
+                             reported_lifetime=args.reported_lifetime, seed=args.seed)
+    results = []
+    parameters = {'write_concurrency': args.concurrency, 'delete_concurrency': args.concurrency,
+                  'parse_workers': args.parse_workers, 'metadata_cache_ttl': 0}
+    ctx = multiprocessing.get_context('spawn')
+    with server, tempfile.TemporaryDirectory() as data_dir:
+        for rows in args.rows:
+            write_data_dir(data_dir, rows, args.columns, args.width, parameters)
+            for scenario in args.scenarios:
+                server.lists.clear()
+                lst = server.create_list(LIST_NAME, build_list_columns(args.columns))
+                if scenario != 'write':
+                    server.add_items(lst.id, rows)
+                server.reset_stats()
+
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                    res = executor.submit(run_scenario, scenario, data_dir, server.api_url, server.token_url,
+                                          lst.id, args.concurrency).result()
+
+                stats = server.stats
+                # the list is replaced in the recreate and staging scenarios
+                lst = next(lst for lst in server.lists.values() if lst.name == LIST_NAME)
+                res.update({'scenario': scenario,
+                            'rows': rows,
+                            'rows_per_s': round(rows / res['elapsed'], 1),
+                            'requests': stats['requests'],
+                            'requests_per_s': round(stats['requests'] / res['elapsed'], 1),
+                            'batch_items': stats['batch_items'],
+                            'throttled': stats['status_429'] + stats['status_503'],
+                            'unauthorized': stats['status_401'],
+                            'bytes_sent': stats['bytes_received'],
+                            'bytes_received': stats['bytes_sent'],
+                            'items_left': len(lst.items)})
+                results.append(res)
+                print_result(res)
+    return results
+
+
+def print_result(res):
+    print(f"{res['scenario']:<8} {res['rows']:>8} rows  {res['elapsed']:8.2f}s  {res['rows_per_s']:>9} rows/s  "
+          f"{res['requests_per_s']:>7} req/s  p50 {res['p50_ms']} ms  p99 {res['p99_ms']} ms  "
+          f"peak {res['peak_memory_mb']:.0f} MB  throttled {res['throttled']}  401 {res['unauthorized']}  "
+          f"failed {res['failed']}" + (f"  error {res['error']}" if res['error'] else ''), flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='input table sizes, e.g. 1000 10000 100000 1000000')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--columns', type=int, default=10, help='number of text columns of the input table')
+    parser.add_argument('--width', type=int, default=20, help='length of the text values')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent batches')
+    parser.add_argument('--parse-workers', type=int, default=1, help='processes parsing the input table')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each HTTP request')
+    parser.add_argument('--item-latency', type=float, default=0.0, help='seconds added to each batch item')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='probability of a throttled request')
+    parser.add_argument('--batch-throttle-rate', type=float, default=0.0,
+                        help='probability of a throttled batch item')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of the throttled responses')
+    parser.add_argument('--token-lifetime', type=int, default=3600, help='seconds the access tokens are valid')
+    parser.add_argument('--reported-lifetime', type=int, default=None,
+                        help='token expires_in reported to the client, set above the lifetime to cause 401s')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', help='path of the JSON file with the results')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    all_results = run_benchmarks(arguments)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump(all_results, f, indent=2)
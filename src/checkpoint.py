@@ -0,0 +1,137 @@
+'''
+Checkpoint of the full load write, allowing a failed write to be resumed by the next run.
+
+'''
+import hashlib
+
+# bytes of each table file included in the fingerprint
+FINGERPRINT_BYTES = 64 * 1024
+# number of the id ranges collected before they are merged
+MERGE_THRESHOLD = 1024
+
+
+def get_table_fingerprint(table):
+    """
+    Identifies the input table content by the header, the file sizes and the beginning of each file.
+
+    :param table: TableReader
+    :return: hex digest
+    """
+    digest = hashlib.sha1('\0'.join(table.header).encode('utf-8'))
+    for path in table.files:
+        with open(path, 'rb') as in_file:
+            digest.update(str(in_file.seek(0, 2)).encode())
+            in_file.seek(0)
+            digest.update(in_file.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def merge_ranges(ranges):
+    """
+    :param ranges: [first, last] ranges of integer ids
+    :return: sorted list of non-overlapping ranges, adjacent ranges merged
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def encode_runs(row_items):
+    """
+    :param row_items: row -> item id
+    :return: [first row, last row, first item id] runs of the consecutive rows with consecutive item ids
+    """
+    runs = []
+    for row, item_id in sorted(row_items.items()):
+        last = runs[-1] if runs else None
+        if last and row == last[1] + 1 and item_id == last[2] + row - last[0]:
+            last[1] = row
+        else:
+            runs.append([row, row, item_id])
+    return runs
+
+
+def decode_runs(runs):
+    """
+    :param runs: runs returned by `encode_runs`
+    :return: row -> item id
+    """
+    return {row: first_id + row - first for first, last, first_id in runs for row in range(first, last + 1)}
+
+
+class WriteCheckpoint:
+    """
+    Tracks the rows committed by a write. The batches complete out of order, so the checkpoint offset is the number
+    of leading rows that are all committed. The ids of the items created for those rows are kept as ranges, because
+    the ids are assigned sequentially. The rows committed after the offset are kept with their item ids as well,
+    the resumed write keeps their items and does not write them again.
+    """
+
+    def __init__(self, signature, offset=0, committed=None, ahead=None):
+        """
+
+        :param signature: identifies the list and the input table the checkpoint belongs to
+        :param offset: number of leading rows committed
+        :param committed: [first, last] ranges of the item ids created for the rows before the offset
+        :param ahead: runs of the rows committed after the offset, see `encode_runs`
+        """
+        self.signature = signature
+        self.offset = offset
+        self._committed = [list(r) for r in committed or []]
+        # row -> item id of the rows committed after the offset
+        self._ahead = decode_runs(ahead or [])
+        self._merge_threshold = MERGE_THRESHOLD
+
+    def on_committed(self, row, item_id):
+        """
+        Registers the item created for the row.
+        """
+        self._ahead[row] = int(item_id)
+        while self.offset in self._ahead:
+            item_id = self._ahead.pop(self.offset)
+            last = self._committed[-1] if self._committed else None
+            if last and item_id == last[1] + 1:
+                last[1] = item_id
+            else:
+                self._committed.append([item_id, item_id])
+            self.offset += 1
+        if len(self._committed) > self._merge_threshold:
+            # the concurrent batches interleave the ids
+            self._committed = merge_ranges(self._committed)
+            self._merge_threshold = max(MERGE_THRESHOLD, 2 * len(self._committed))
+
+    @property
+    def committed_ids(self):
+        """
+        Ids of the items created for the rows before the offset.
+        """
+        return {i for first, last in self._committed for i in range(first, last + 1)}
+
+    @property
+    def ahead(self):
+        """
+        Row -> item id of the rows committed after the offset.
+        """
+        return dict(self._ahead)
+
+    def discard(self, rows):
+        """
+        Forgets the rows committed after the offset, so that they are written again.
+        """
+        for row in rows:
+            self._ahead.pop(row, None)
+
+    def to_dict(self):
+        self._committed = merge_ranges(self._committed)
+        return {'signature': self.signature,
+                'offset': self.offset,
+                'committed': self._committed,
+                'ahead': encode_runs(self._ahead)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['signature'], data['offset'], data['committed'], data.get('ahead'))
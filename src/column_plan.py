@@ -0,0 +1,187 @@
+'''
+Mapping of the input table columns to the list fields.
+
+'''
+import math
+import re
+from datetime import datetime, timezone
+from operator import itemgetter
+
+TITLE_FIELD = 'Title'
+
+_TRUE_VALUES = ('true', '1', 'yes', 'y')
+_FALSE_VALUES = ('false', '0', 'no', 'n')
+_DATETIME_SPACE = re.compile(r'^(\d{4}-\d{2}-\d{2}) (\d{2}:\d{2})')
+
+
+def to_number(value):
+    if value == '':
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        # let the API report the invalid value
+        return value
+    if not math.isfinite(number):
+        # nan and inf are not valid JSON, only the item with the value is rejected
+        return value
+    return int(number) if number.is_integer() and abs(number) < 2 ** 53 else number
+
+
+def to_boolean(value):
+    lower = value.lower()
+    if lower in _TRUE_VALUES:
+        return True
+    elif lower in _FALSE_VALUES:
+        return False
+    elif value == '':
+        return None
+    return value
+
+
+def to_datetime(value):
+    if value == '':
+        return None
+    # ISO 8601 expects T separator
+    return _DATETIME_SPACE.sub(r'\1T\2', value, count=1)
+
+
+# list column type facet -> converter
+CONVERTERS = {'number': to_number,
+              'currency': to_number,
+              'boolean': to_boolean,
+              'dateTime': to_datetime}
+
+
+def normalize_number(value):
+    """
+    :return: the number as float, so that e.g. 1 and 1.0 compare equal, the value as is if it is not a number
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def normalize_datetime(value):
+    """
+    :return: the date time in UTC in the format returned by the API, e.g. 2020-01-31T10:00:00Z.
+             Values without a time zone are taken as UTC. The value as is if it can't be parsed.
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        return value
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# list column type facet -> normalizer of the values compared with the values read from the list
+NORMALIZERS = {'number': normalize_number,
+               'currency': normalize_number,
+               'dateTime': normalize_datetime}
+
+
+def get_column_type(column):
+    """
+    :param column: list column definition
+    :return: name of the column type facet, e.g. text, number
+    """
+    for facet in CONVERTERS:
+        if facet in column:
+            return facet
+    return 'text'
+
+
+# column types cleared by setting the field to null
+CLEARABLE_TYPES = ('boolean', 'choice', 'currency', 'dateTime', 'number', 'text')
+
+
+def get_cleared_fields(list_columns, written_fields):
+    """
+    Lists the list fields the written records don't set, so that the values left on the reused items are cleared.
+    Read only, calculated, hidden and required columns are skipped, as well as the lookup, person and other complex
+    columns that can't be cleared by a null value.
+
+    :param list_columns: list column definitions
+    :param written_fields: field names set by the records
+    :return: list of field names
+    """
+    written = set(written_fields)
+    return [c['name'] for c in list_columns
+            if c['name'] not in written and not c.get('readOnly') and not c.get('hidden') and not c.get('required')
+            and 'calculated' not in c and any(t in c for t in CLEARABLE_TYPES)]
+
+
+class ColumnPlan:
+    """
+    Precompiled mapping of the table row to the list item fields. Holds the indexes of the written columns,
+    their field names and the converters to the list column types, so each row is converted in a single pass.
+    """
+
+    def __init__(self, header, list_columns, nonexistent_cols, title_col_name=None):
+        """
+
+        :param header: input table columns
+        :param list_columns: list column definitions
+        :param nonexistent_cols: table columns that do not exist in the list and are dropped
+        :param title_col_name: name of the table column mapped to the Title field
+        """
+        self._args = (header, list_columns, nonexistent_cols, title_col_name)
+        column_types = {c['name']: get_column_type(c) for c in list_columns}
+        self.indexes = []
+        self.field_names = []
+        # field name -> list column type
+        self.field_types = dict()
+        self._converters = []
+        self._field_names_by_column = dict()
+        for i, col in enumerate(header):
+            if col == title_col_name:
+                field_name = TITLE_FIELD
+            elif col in nonexistent_cols:
+                continue
+            else:
+                field_name = col
+            converter = CONVERTERS.get(column_types.get(field_name))
+            if converter:
+                self._converters.append((len(self.indexes), converter))
+            self.indexes.append(i)
+            self.field_names.append(field_name)
+            self.field_types[field_name] = column_types.get(field_name, 'text')
+            self._field_names_by_column[col] = field_name
+
+        if not self.indexes:
+            raise ValueError('None of the source table columns exists in the destination list.')
+        if len(self.indexes) == 1:
+            index = self.indexes[0]
+            self._getter = lambda row: (row[index],)
+        else:
+            self._getter = itemgetter(*self.indexes)
+
+    def __reduce__(self):
+        # the getter is not picklable, the plan is compiled again, e.g. in a worker process
+        return ColumnPlan, self._args
+
+    def get_field_name(self, column):
+        """
+        :param column: input table column name
+        :return: name of the list field the column is written to or None if dropped
+        """
+        return self._field_names_by_column.get(column)
+
+    def to_fields(self, row):
+        """
+        Converts the table row into the list item fields.
+
+        :param row: list of row values
+        :return: dictionary {field name: value}
+        """
+        values = self._getter(row)
+        if self._converters:
+            values = list(values)
+            for pos, converter in self._converters:
+                values[pos] = converter(values[pos])
+        return dict(zip(self.field_names, values))
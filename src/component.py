@@ -3,16 +3,33 @@ Template Component main class.
 
 '''
 
-import csv
 import json
 import logging
+import os
+import re
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from itertools import islice
 
 from kbc.env_handler import KBCEnvHandler
 
+from checkpoint import WriteCheckpoint, get_table_fingerprint
+from column_plan import ColumnPlan, get_cleared_fields
+from extraction import ListExtractor, get_column_mapping
+from ingestion import TableReader
+from metadata_cache import MetadataCache
+from ms_graph.batch import BatchDispatcher, get_failure_details, get_request_id
 from ms_graph.client import Client
-from ms_graph.dataobjects import get_col_def_name, get_col_definition, TextColumn, SharepointList, ColumnDefinition
-from ms_graph.exceptions import BaseError
+from ms_graph.dataobjects import get_col_def_name, get_col_definition, TextColumn, SharepointList, ColumnDefinition, \
+    get_list_definition
+from ms_graph.exceptions import BaseError, NotFound
+from ms_graph.purge import ListPurger
+from parallel_ingestion import ParallelRequestEncoder
+from result import ListDataResultWriter, ListResultWriter, LIST_ID, SITE_ID, RES_TABLE_NAME
+from row_state import decode_row_map, encode_row_map
+from sync import IncrementalSync, InPlaceReplace
 
 # global constants'
 KEY_LIST_DESC = 'list_description'
@@ -26,10 +43,53 @@ KEY_LIST_NAME = 'list_name'
 KEY_CREATE_NEW = 'create_new'
 KEY_TITLE_COL = 'title_column'
 KEY_SRC_NAME = 'name'
+KEY_WRITE_CONCURRENCY = 'write_concurrency'
+KEY_DELETE_CONCURRENCY = 'delete_concurrency'
+KEY_LOAD_TYPE = 'load_type'
+KEY_PRIMARY_KEY = 'primary_key'
+KEY_USE_STATE = 'use_state'
+KEY_METADATA_TTL = 'metadata_cache_ttl'
+KEY_OPENMETRICS = 'openmetrics_report'
+KEY_MODE = 'mode'
+KEY_EXTRACT_COLUMNS = 'extract_columns'
+KEY_EXTRACT_METADATA = 'extract_list_metadata'
+KEY_DELTA_EXTRACT = 'delta_extract'
+KEY_TABLES = 'tables'
+KEY_TABLE = 'table'
+KEY_TABLE_CONCURRENCY = 'table_concurrency'
+KEY_REPLACE_STRATEGY = 'replace_strategy'
+KEY_PARSE_WORKERS = 'parse_workers'
+
+FAILURE_REPORT_NAME = 'failed_records.json'
+METRICS_REPORT_NAME = 'run_metrics.json'
+OPENMETRICS_REPORT_NAME = 'run_metrics.txt'
+
+# state keys
+KEY_STATE_ROWS = 'row_state'
+KEY_STATE_METADATA = 'metadata'
+KEY_STATE_DELTA = 'delta'
+KEY_STATE_CHECKPOINTS = 'write_checkpoints'
+
+LOAD_TYPE_FULL = 'full'
+LOAD_TYPE_INCREMENTAL = 'incremental'
+
+REPLACE_PURGE = 'purge'
+REPLACE_RECREATE = 'recreate'
+REPLACE_STAGING = 'staging'
+REPLACE_REUSE = 'reuse'
+
+MODE_WRITE = 'write'
+MODE_EXTRACT = 'extract'
+
+DEFAULT_WRITE_CONCURRENCY = 4
+DEFAULT_DELETE_CONCURRENCY = 8
+DEFAULT_TABLE_CONCURRENCY = 4
+# minutes, the cached columns may miss the columns added within the TTL, so the cache is opt-in
+DEFAULT_METADATA_TTL = 0
 
 # #### Keep for debug
 KEY_DEBUG = 'debug'
-MANDATORY_PARS = [KEY_BASE_HOST, KEY_LIST_NAME, KEY_SITE_REL_PATH]
+MANDATORY_PARS = [KEY_BASE_HOST, KEY_SITE_REL_PATH]
 MANDATORY_IMAGE_PARS = []
 
 
@@ -56,8 +116,20 @@ class Component(KBCEnvHandler):
         if not token:
             raise Exception('Missing access token in authorization data!')
 
+        # requests of the concurrent batches share one rate controller
+        max_concurrency = max(int(self.cfg_params.get(KEY_WRITE_CONCURRENCY) or DEFAULT_WRITE_CONCURRENCY),
+                              int(self.cfg_params.get(KEY_DELETE_CONCURRENCY) or DEFAULT_DELETE_CONCURRENCY))
         self.client = Client(refresh_token=token, client_id=self.get_authorization()['appKey'],
-                             client_secret=self.get_authorization()['#appSecret'], scope=OAUTH_APP_SCOPE)
+                             client_secret=self.get_authorization()['#appSecret'], scope=OAUTH_APP_SCOPE,
+                             max_concurrency=max_concurrency)
+
+        self._state = self.get_state_file() or {}
+        self._state[KEY_STATE_ROWS] = self._state.get(KEY_STATE_ROWS) or {}
+        self._state[KEY_STATE_CHECKPOINTS] = self._state.get(KEY_STATE_CHECKPOINTS) or {}
+        ttl = self.cfg_params.get(KEY_METADATA_TTL)
+        ttl = DEFAULT_METADATA_TTL if ttl is None else int(ttl)
+        self._metadata_cache = MetadataCache(self._state.get(KEY_STATE_METADATA), ttl=ttl * 60)
+        self._background_tasks = []
 
     def run(self):
         '''
@@ -67,119 +139,627 @@ class Component(KBCEnvHandler):
 
         try:
 
-            in_tables = self.configuration.get_input_tables()
-
-            if len(in_tables) == 0:
-                logging.error('There is no table specified on the input mapping! You must provide one input table!')
-                exit(1)
-
-            in_table = in_tables[0]
-
-            site = self.client.get_site_by_relative_url(params[KEY_BASE_HOST], params[KEY_SITE_REL_PATH])
-            if not site.get('id'):
-                raise RuntimeError(
-                    f'No site with given url: '
-                    f'{"/".join([params[KEY_BASE_HOST], params[KEY_SITE_REL_PATH]])} found.')
-
-            # get existing list
-            sh_list = self.client.get_site_list_by_name(site['id'], params[KEY_LIST_NAME])
-
-            table_pars = params.get(KEY_CREATE_NEW, {})
-            title_col_mapping = table_pars[0][KEY_TITLE_COL] if table_pars else None
-
-            if table_pars and not sh_list:
-                # create new list
-                table_pars = table_pars[0]
-                list_dsc = table_pars.get(KEY_LIST_DESC, '')
-                title_col_mapping = table_pars[KEY_TITLE_COL]
-                sh_list = self._create_new_list(site['id'], params[KEY_LIST_NAME], list_dsc, table_pars,
-                                                in_table)
-            else:
-                if not sh_list:
-                    raise RuntimeError(
-                        f'No list named "{params[KEY_LIST_NAME]}" found on site : '
-                        f'{"/".join([params[KEY_BASE_HOST], params[KEY_SITE_REL_PATH]])} .')
-                elif params.get(KEY_CREATE_NEW, {}):
-                    logging.warning(f'The list "{params[KEY_LIST_NAME]}" already exists. The "new list" '
-                                    f'configuration will be ignored and the existing list updated.')
-
-            logging.info('Getting list details...')
-            list_columns = self.client.get_site_list_columns(site['id'], sh_list['id'],
-                                                             expand_par='columns')
-
-            non_existent_cols = self.validate_table_cols(list_columns, in_table, title_col_mapping)
-            if non_existent_cols:
-                logging.warning(
-                    f'Some columns: {non_existent_cols} were not found in the destination list. They will be ignored!')
-
-            # emtpy the list first
-            logging.warning('Removing all existing items..')
-            self._empty_list(site['id'], sh_list)
-
-            logging.info('Writing table items.')
-            self.write_table(site['id'], sh_list['id'], in_table, non_existent_cols,
-                             title_col_mapping)
-
+            if params.get(KEY_MODE, MODE_WRITE) == MODE_EXTRACT:
+                self._run_extract()
+                logging.info('Extraction finished!')
+                return
+
+            jobs = self._get_write_jobs()
+            try:
+                if len(jobs) == 1:
+                    self._write_list(*jobs[0])
+                else:
+                    self._write_lists(jobs)
+            finally:
+                self._write_state()
             logging.info('Export finished!')
 
         except BaseError as ex:
             logging.exception(ex)
             exit(1)
+        finally:
+            self._wait_for_background_tasks()
+            self._write_metrics()
+
+    def _get_write_jobs(self):
+        """
+        Pairs the input tables with the destination lists.
+
+        :return: list of (parameters, table) tuples. The parameters of each table mapping are the configuration
+        parameters overridden by the mapping.
+        """
+        params = self.cfg_params
+        in_tables = self.configuration.get_input_tables()
+
+        if len(in_tables) == 0:
+            logging.error('There is no table specified on the input mapping! You must provide one input table!')
+            exit(1)
 
-    def _empty_list(self, site_id, sh_lst):
-        for fl in self.client.get_site_list_fields(site_id, sh_lst['id'], expand='fields'):
-            f = self.client.delete_list_items(site_id, sh_lst['id'], [f['id'] for f in fl])
-            if f:
-                raise RuntimeError(f"Some records couldn't be deleted: {f}.")
-
-    def write_table(self, site_id, list_id, in_table, nonexistent_cols, title_col):
-        with open(in_table['full_path'], mode='r',
-                  encoding='utf-8') as in_file:
-            reader = csv.DictReader(in_file, lineterminator='\n')
-
-            batch = []
-            failed = []
-            batch_index = 0
-            for ri, line in enumerate(reader):
-                if title_col:
-                    # creating new list, have col mapping
-                    line['Title'] = line.pop(title_col[KEY_SRC_NAME])
-                    if title_col[KEY_SRC_NAME] in nonexistent_cols:
-                        nonexistent_cols.remove(title_col[KEY_SRC_NAME])
-
-                self._cleanup_record_fields(line, nonexistent_cols)
-                br = self.client.build_create_list_item_batch_request(batch_index, site_id, list_id, line)
-                batch.append(br)
-                batch_index += 1
-                if batch_index >= BATCH_LIMIT:
-                    batch_index = 0
-                    f = self.client.make_batch_request(batch, 'Create items')
-                    f = self._retry_failed_write(site_id, list_id, batch, f)
-                    failed.extend(f)
-                    batch.clear()
-            # last batch
-            if batch:
-                f = self.client.make_batch_request(batch, 'Create items')
-                failed.extend(f)
+        mappings = params.get(KEY_TABLES)
+        if not mappings:
+            if not params.get(KEY_LIST_NAME):
+                raise ValueError('The list name must be specified.')
+            return [(params, TableReader(in_tables[0]))]
+
+        tables_by_name = dict()
+        for t in in_tables:
+            tables_by_name.setdefault(t.get('source'), t)
+            tables_by_name[t.get('destination')] = t
+        # the new list definition belongs to the single list configuration
+        defaults = {k: v for k, v in params.items() if k not in (KEY_TABLES, KEY_CREATE_NEW)}
+        jobs = []
+        for mapping in mappings:
+            in_table = tables_by_name.get(mapping.get(KEY_TABLE))
+            if not in_table:
+                raise ValueError(f'The table "{mapping.get(KEY_TABLE)}" is not specified on the input mapping.')
+            if not mapping.get(KEY_LIST_NAME):
+                raise ValueError(f'The list name of the table "{mapping[KEY_TABLE]}" must be specified.')
+            overrides = {k: v for k, v in mapping.items() if v not in (None, '')}
+            jobs.append(({**defaults, **overrides}, TableReader(in_table)))
+        return jobs
+
+    def _write_lists(self, jobs):
+        """
+        Writes several tables into their lists concurrently. The tables are started from the smallest one, so the small
+        tables are not held up by the large ones. All requests share the client connection pool and rate controller.
+        """
+        concurrency = int(self.cfg_params.get(KEY_TABLE_CONCURRENCY) or DEFAULT_TABLE_CONCURRENCY)
+        names = []
+        for job_params, table in jobs:
+            name = self._get_result_name(job_params[KEY_LIST_NAME])
+            names.append(name if name not in names else f'{name}_{len(names)}')
+
+        failed = []
+        order = sorted(range(len(jobs)), key=lambda i: jobs[i][1].size)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(self._write_list, *jobs[i], name=names[i]): names[i] for i in order}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                    logging.info(f'[{name}] Table written.')
+                except Exception as e:
+                    logging.exception(f'[{name}] Writing the table failed: {e}')
+                    failed.append(name)
 
         if failed:
-            raise RuntimeError(f'Write finished with error. Some records failed: {failed}')
+            raise RuntimeError(f'{len(failed)} of {len(jobs)} tables failed: {failed}.')
+
+    def _write_list(self, params, table, name=None):
+        """
+        Writes the table into the list specified by the parameters.
+
+        :param name: name of the table mapping when several tables are written, used to distinguish the phases,
+        logs and failure reports
+        """
+        metrics = self.client.metrics
+        phase_prefix = f'{name}/' if name else ''
+        label = f'[{name}] ' if name else ''
+        report_name = f'failed_records_{name}.json' if name else FAILURE_REPORT_NAME
+
+        table_pars = params.get(KEY_CREATE_NEW, {})
+        title_col_mapping = table_pars[0][KEY_TITLE_COL] if table_pars else None
+
+        cache_key = MetadataCache.build_key(params[KEY_BASE_HOST], params[KEY_SITE_REL_PATH], params[KEY_LIST_NAME])
+        with metrics.phase(phase_prefix + 'metadata'):
+            site, sh_list, list_columns = self._get_list_metadata(params, cache_key, table, table_pars)
+
+        try:
+            with metrics.phase(phase_prefix + 'validation'):
+                non_existent_cols = self.validate_table_cols(list_columns, table, title_col_mapping)
+                if non_existent_cols:
+                    logging.warning(f'{label}Some columns: {non_existent_cols} were not found in the destination '
+                                    f'list. They will be ignored!')
+
+                title_src = title_col_mapping[KEY_SRC_NAME] if title_col_mapping else None
+                plan = ColumnPlan(table.header, list_columns, non_existent_cols, title_src)
+
+            incremental = params.get(KEY_LOAD_TYPE, LOAD_TYPE_FULL) == LOAD_TYPE_INCREMENTAL
+            replace_strategy = params.get(KEY_REPLACE_STRATEGY, REPLACE_PURGE)
+            staged = False
+            if not incremental and replace_strategy == REPLACE_STAGING:
+                staged = self._write_staged(site, sh_list, table, plan, cache_key, label, phase_prefix, report_name)
+
+            if incremental:
+                logging.info(f'{label}Synchronizing changed items.')
+                with metrics.phase(phase_prefix + 'sync'):
+                    self.sync_table(site['id'], sh_list['id'], table, plan, params.get(KEY_PRIMARY_KEY),
+                                    use_state=params.get(KEY_USE_STATE, False), report_name=report_name)
+            elif replace_strategy == REPLACE_REUSE:
+                # the items written by a failed write are reused, no checkpoint is needed
+                self._state[KEY_STATE_CHECKPOINTS].pop(sh_list['id'], None)
+                logging.info(f'{label}Writing table items onto the existing items.')
+                with metrics.phase(phase_prefix + 'write'):
+                    self.replace_table(site['id'], sh_list['id'], table, plan, list_columns,
+                                       report_name=report_name)
+            elif not staged:
+                signature = {'site_id': site['id'], 'list_id': sh_list['id'], 'columns': plan.field_names,
+                             'table': get_table_fingerprint(table)}
+                with metrics.phase(phase_prefix + 'purge'):
+                    checkpoint = self._resume_checkpoint(site['id'], sh_list['id'], signature, label)
+                    if checkpoint:
+                        logging.info(f'{label}Resuming the failed write from row {checkpoint.offset}.')
+                    else:
+                        recreated = None
+                        if replace_strategy == REPLACE_RECREATE:
+                            recreated = self._recreate_list(site, sh_list, cache_key, label)
+                        if recreated:
+                            sh_list = recreated
+                            signature['list_id'] = sh_list['id']
+                        else:
+                            # emtpy the list first
+                            logging.warning(f'{label}Removing all existing items..')
+                            self._empty_list(site['id'], sh_list, report_name=report_name)
+                        checkpoint = WriteCheckpoint(signature)
+
+                logging.info(f'{label}Writing table items.')
+                with metrics.phase(phase_prefix + 'write'):
+                    self.write_table(site['id'], sh_list['id'], table, plan, report_name=report_name,
+                                     checkpoint=checkpoint)
+        except Exception:
+            # the cached metadata may be outdated, resolve it again in the next run
+            self._metadata_cache.invalidate(cache_key)
+            raise
+
+    def _run_extract(self):
+        params = self.cfg_params
+        if not params.get(KEY_LIST_NAME):
+            raise ValueError('The list name must be specified.')
+        metrics = self.client.metrics
+        cache_key = MetadataCache.build_key(params[KEY_BASE_HOST], params[KEY_SITE_REL_PATH], params[KEY_LIST_NAME])
+        with metrics.phase('metadata'):
+            site, sh_list, list_columns = self._get_list_metadata(params, cache_key, None, None)
+
+        try:
+            column_mapping = get_column_mapping(list_columns, params.get(KEY_EXTRACT_COLUMNS),
+                                                deleted_flag=bool(params.get(KEY_DELTA_EXTRACT)))
+            logging.info(f'Extracting list items, columns: {[c["displayName"] for c in column_mapping]}.')
+            with metrics.phase('extract'):
+                self.extract_list(site['id'], sh_list, column_mapping)
+        except Exception:
+            self._metadata_cache.invalidate(cache_key)
+            self._write_state()
+            raise
+
+        self._write_state()
+
+    def extract_list(self, site_id, sh_list, column_mapping):
+        """
+        Streams the list items into the output table and optionally writes the list metadata. Creates the manifests.
+        """
+        delta = bool(self.cfg_params.get(KEY_DELTA_EXTRACT))
+        signature = {'site_id': site_id, 'list_id': sh_list['id'], 'columns': [c['name'] for c in column_mapping]}
+        delta_link = self._load_delta_link(signature) if delta else None
+
+        result_name = self._get_result_name(self.cfg_params[KEY_LIST_NAME])
+        writer = ListDataResultWriter(self.tables_out_path, column_mapping, result_name)
+        extractor = ListExtractor(self.client, site_id, sh_list['id'], column_mapping,
+                                  page_size=self.client.ITEM_PAGE_SIZE, delta=delta, delta_link=delta_link)
+        count = extractor.extract(writer, user_values={LIST_ID: sh_list['id']})
+        writer.close()
+        results = writer.collect_results()
+        changes = ' changed' if extractor.incremental else ''
+        logging.info(f'Extracted {count}{changes} items into the {writer.table_def.name} table.')
+
+        if self.cfg_params.get(KEY_EXTRACT_METADATA):
+            metadata_writer = ListResultWriter(self.tables_out_path)
+            metadata_writer.write(dict(sh_list),
+                                  user_values={SITE_ID: site_id, RES_TABLE_NAME: writer.table_def.name})
+            metadata_writer.close()
+            results.extend(metadata_writer.collect_results())
+
+        # the changes are merged into the existing table, the full result replaces it
+        self.create_manifests(results, incremental=extractor.incremental)
+        if delta:
+            self._state[KEY_STATE_DELTA] = {'signature': signature, 'delta_link': extractor.delta_link}
+
+    @staticmethod
+    def _get_result_name(list_name):
+        return re.sub(r'\W+', '_', list_name).strip('_') or 'list'
+
+    def _load_delta_link(self, signature):
+        delta_state = self._state.get(KEY_STATE_DELTA)
+        if not delta_state or not delta_state.get('delta_link'):
+            logging.info('No delta link stored from the previous run, all list items will be read.')
+            return None
+        if delta_state.get('signature') != signature:
+            logging.info('The list or the extracted columns changed since the previous run, '
+                         'all list items will be read.')
+            return None
+        return delta_state['delta_link']
+
+    def _write_metrics(self):
+        """
+        Writes the run metrics summary into the output files, optionally in the OpenMetrics format as well.
+        """
+        metrics = self.client.metrics
+        phases = ', '.join(f'{k} {v:.1f}s' for k, v in metrics.phases.items())
+        logging.info(f'Run phases: {phases or "none"}. Sent {metrics.batch_sizes.count} batches, '
+                     f'{sum(metrics.requests.values())} requests, throttled {metrics.throttle_events} times.')
+        with open(os.path.join(self.files_out_path, METRICS_REPORT_NAME), 'w') as out_file:
+            json.dump(metrics.to_dict(), out_file, indent=2)
+        if self.cfg_params.get(KEY_OPENMETRICS):
+            with open(os.path.join(self.files_out_path, OPENMETRICS_REPORT_NAME), 'w') as out_file:
+                out_file.write(metrics.to_openmetrics())
+
+    def _get_list_metadata(self, params, cache_key, table, table_pars):
+        """
+        Resolves the site, the list and its columns. Uses the cached metadata when possible, the expired cache entries
+        are revalidated by the list eTag.
+
+        :return: site, list, list columns
+        """
+        entry = self._metadata_cache.get(cache_key)
+        if not entry:
+            entry = self._revalidate_metadata(cache_key)
+        if entry:
+            logging.info('Using cached list details.')
+            if table_pars:
+                logging.warning(f'The list "{params[KEY_LIST_NAME]}" already exists. The "new list" '
+                                f'configuration will be ignored and the existing list updated.')
+            return entry['site'], entry['list'], entry['columns']
+
+        site, sh_list = self._resolve_list(params, table, table_pars)
+        logging.info('Getting list details...')
+        list_columns = self.client.get_site_list_columns(site['id'], sh_list['id'], expand_par='columns')
+        self._metadata_cache.put(cache_key, site, sh_list, list_columns)
+        return site, sh_list, list_columns
+
+    def _revalidate_metadata(self, cache_key):
+        entry = self._metadata_cache.get_expired(cache_key)
+        if not entry:
+            return None
+        site_id, list_id = entry['site']['id'], entry['list']['id']
+        try:
+            current = self.client.get_site_list(site_id, list_id, select=['id', 'eTag'])
+        except NotFound:
+            self._metadata_cache.invalidate(cache_key)
+            return None
+        if current.get('eTag') != entry['list'].get('eTag'):
+            logging.info('The list changed since the metadata were cached, getting list details...')
+            entry['columns'] = self.client.get_site_list_columns(site_id, list_id, expand_par='columns')
+        self._metadata_cache.touch(cache_key, current.get('eTag'))
+        return entry
+
+    def _resolve_list(self, params, table, table_pars):
+        site = self.client.get_site_by_relative_url(params[KEY_BASE_HOST], params[KEY_SITE_REL_PATH])
+        if not site.get('id'):
+            raise RuntimeError(
+                f'No site with given url: '
+                f'{"/".join([params[KEY_BASE_HOST], params[KEY_SITE_REL_PATH]])} found.')
+
+        # get existing list
+        sh_list = self.client.get_site_list_by_name(site['id'], params[KEY_LIST_NAME])
+
+        if table_pars and not sh_list:
+            # create new list
+            table_pars = table_pars[0]
+            list_dsc = table_pars.get(KEY_LIST_DESC, '')
+            sh_list = self._create_new_list(site['id'], params[KEY_LIST_NAME], list_dsc, table_pars,
+                                            table)
+        else:
+            if not sh_list:
+                raise RuntimeError(
+                    f'No list named "{params[KEY_LIST_NAME]}" found on site : '
+                    f'{"/".join([params[KEY_BASE_HOST], params[KEY_SITE_REL_PATH]])} .')
+            elif table_pars:
+                logging.warning(f'The list "{params[KEY_LIST_NAME]}" already exists. The "new list" '
+                                f'configuration will be ignored and the existing list updated.')
+        return site, sh_list
+
+    def _write_state(self):
+        self.write_state_file({**self._state, KEY_STATE_METADATA: self._metadata_cache.to_dict()})
+
+    def _empty_list(self, site_id, sh_lst, report_name=FAILURE_REPORT_NAME):
+        concurrency = self.cfg_params.get(KEY_DELETE_CONCURRENCY) or DEFAULT_DELETE_CONCURRENCY
+        purger = ListPurger(self.client, max_in_flight=int(concurrency), batch_limit=BATCH_LIMIT)
+        res = purger.purge(site_id, sh_lst['id'])
+        if res.failed:
+            self._write_failure_report(res.failed, report_name)
+            raise RuntimeError(f"{len(res.failed)} records couldn't be deleted, first failures: {res.failed[:10]}.")
+
+    def write_table(self, site_id, list_id, table, plan: ColumnPlan, report_name=FAILURE_REPORT_NAME,
+                    checkpoint: WriteCheckpoint = None):
+        """
+        Creates the list items from the table rows.
+
+        :param checkpoint: the write starts at the checkpoint offset and the created items are registered in it.
+        When the write fails, the checkpoint is stored in the state so that the next run can resume it.
+        """
+        concurrency = self.cfg_params.get(KEY_WRITE_CONCURRENCY) or DEFAULT_WRITE_CONCURRENCY
+        dispatcher = BatchDispatcher(self.client, max_in_flight=int(concurrency), batch_limit=BATCH_LIMIT)
+
+        start = checkpoint.offset if checkpoint else 0
+        requests = self._build_create_requests(site_id, list_id, table, plan, start)
+        if checkpoint and checkpoint.ahead:
+            # the rows committed out of order by the failed write are not written again
+            written = checkpoint.ahead
+            requests = (rq for rq in requests if int(get_request_id(rq)) not in written)
+        failed = []
+        try:
+            for batch, responses in dispatcher.dispatch_requests(requests, 'Create items',
+                                                                 all_responses=checkpoint is not None):
+                # request ids are the input row indexes
+                for r in responses:
+                    if r['status'] >= 300:
+                        failed.append({'row': int(r['id']), **get_failure_details(r)})
+                    elif checkpoint:
+                        checkpoint.on_committed(int(r['id']), r['body']['id'])
+        except Exception:
+            self._save_checkpoint(list_id, checkpoint)
+            raise
 
-    def _retry_failed_write(self, site_id, list_id, batch, failed):
         if failed:
-            logging.info(f'Some ({len(failed)}) requests failed, retrying.')
-        failed_idx = []
-        for fid, f in enumerate(failed):
-            self.client.create_list_item(site_id, list_id, batch[int(f['id'])]['body']['fields'])
-            failed_idx.append(fid)
-        return [f for i, f in enumerate(failed) if i not in failed_idx]
-
-    def validate_table_cols(self, list_columns, in_table, title_col_mapping=None):
-        src_cols = list()
-        with open(in_table['full_path'], mode='r',
-                  encoding='utf-8') as in_file:
-            reader = csv.DictReader(in_file, lineterminator='\n')
-            src_cols = reader.fieldnames
+            self._save_checkpoint(list_id, checkpoint)
+            failed.sort(key=lambda r: r['row'])
+            self._write_failure_report(failed, report_name)
+            raise RuntimeError(f'Write finished with error. {len(failed)} records failed, '
+                               f'first failures: {failed[:10]}')
+        self._state[KEY_STATE_CHECKPOINTS].pop(list_id, None)
+
+    def replace_table(self, site_id, list_id, table, plan: ColumnPlan, list_columns,
+                      report_name=FAILURE_REPORT_NAME):
+        """
+        Replaces all list items by the table rows, writing the rows onto the existing items. The list fields
+        not written by the table are cleared on the reused items.
+        """
+        concurrency = self.cfg_params.get(KEY_WRITE_CONCURRENCY) or DEFAULT_WRITE_CONCURRENCY
+        replace = InPlaceReplace(self.client, site_id, list_id, get_cleared_fields(list_columns, plan.field_names),
+                                 max_in_flight=int(concurrency), batch_limit=BATCH_LIMIT)
+        res = replace.replace(map(plan.to_fields, table.rows()))
+
+        if res.failed:
+            self._write_failure_report(res.failed, report_name)
+            raise RuntimeError(f'Write finished with error. {len(res.failed)} records failed, '
+                               f'first failures: {res.failed[:10]}')
+
+    def _write_staged(self, site, sh_list, table, plan, cache_key, label='', phase_prefix='',
+                      report_name=FAILURE_REPORT_NAME):
+        """
+        Writes the table into a new staging list with the same settings and columns as the list and swaps the lists
+        by their display names once all items are written, so the list is never seen partially written.
+        The replaced list is deleted in background.
+
+        :return: False if the lists can't be swapped, nothing is written in that case
+        """
+        metrics = self.client.metrics
+        site_id = site['id']
+        current = self.client.get_site_list(site_id, sh_list['id'], expand='columns')
+        try:
+            definition = get_list_definition(current, self.client.SYSTEM_LIST_COLUMNS)
+        except ValueError as e:
+            logging.warning(f"{label}The staging list can't be created, the items will be replaced in place. {e}")
+            return False
+
+        name = current['displayName']
+        suffix = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+        definition['displayName'] = f'{name}_staging_{suffix}'
+        with metrics.phase(phase_prefix + 'staging'):
+            staging = self.client.create_list(site_id, definition)
+            try:
+                # make sure the lists can be renamed before writing
+                self.client.update_list(site_id, staging['id'], {'displayName': definition['displayName']})
+            except BaseError as e:
+                logging.warning(f"{label}The lists can't be renamed, the items will be replaced in place. {e}")
+                self._delete_list_in_background(site_id, staging['id'], label)
+                return False
+
+        try:
+            logging.info(f'{label}Writing table items into the staging list {definition["displayName"]}.')
+            with metrics.phase(phase_prefix + 'write'):
+                self.write_table(site_id, staging['id'], table, plan, report_name=report_name)
+            with metrics.phase(phase_prefix + 'swap'):
+                staging = self._swap_lists(site_id, current, staging, f'{name}_old_{suffix}')
+        except Exception:
+            self._delete_list_in_background(site_id, staging['id'], label)
+            raise
+
+        logging.info(f'{label}The staging list replaced the list {name}, the previous list is being deleted.')
+        self._delete_list_in_background(site_id, current['id'], label)
+        list_columns = self.client.get_site_list_columns(site_id, staging['id'], expand_par='columns')
+        self._metadata_cache.put(cache_key, site, staging, list_columns)
+        return True
+
+    def _swap_lists(self, site_id, sh_list, staging, old_name):
+        """
+        Renames the list to the old name and the staging list to the list name.
+
+        :return: the renamed staging list
+        """
+        name = sh_list['displayName']
+        self.client.update_list(site_id, sh_list['id'], {'displayName': old_name})
+        try:
+            return self.client.update_list(site_id, staging['id'], {'displayName': name})
+        except Exception:
+            self.client.update_list(site_id, sh_list['id'], {'displayName': name})
+            raise
+
+    def _delete_list_in_background(self, site_id, list_id, label=''):
+        def delete():
+            try:
+                self.client.delete_list(site_id, list_id)
+            except Exception as e:
+                logging.warning(f"{label}The list {list_id} couldn't be deleted: {e}")
+
+        task = threading.Thread(target=delete, name='delete-list', daemon=True)
+        task.start()
+        self._background_tasks.append(task)
+
+    def _wait_for_background_tasks(self):
+        while self._background_tasks:
+            self._background_tasks.pop().join()
+
+    def _recreate_list(self, site, sh_list, cache_key, label=''):
+        """
+        Replaces the list by a new empty list with the same settings and columns. The new list is created under
+        a temporary name and checked first, then the lists are swapped by their display names, so the list is deleted
+        only once the new list took its place. The replaced list is deleted in background.
+
+        :return: the new list, None if the list can't be recreated
+        """
+        site_id = site['id']
+        current = self.client.get_site_list(site_id, sh_list['id'], expand='columns')
+        try:
+            definition = get_list_definition(current, self.client.SYSTEM_LIST_COLUMNS)
+        except ValueError as e:
+            logging.warning(f"{label}The list can't be recreated, the items will be removed instead. {e}")
+            return None
+
+        name = current['displayName']
+        suffix = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+        definition['displayName'] = f'{name}_recreated_{suffix}'
+        logging.warning(f'{label}Recreating the list..')
+        try:
+            new_list = self.client.create_list(site_id, definition)
+        except BaseError as e:
+            logging.warning(f"{label}The list can't be recreated, the items will be removed instead. {e}")
+            return None
+
+        try:
+            list_columns = self.client.get_site_list_columns(site_id, new_list['id'], expand_par='columns')
+            created = {c['name'] for c in list_columns}
+            missing = [c['name'] for c in definition['columns'] if c['name'] not in created]
+            if missing:
+                raise ValueError(f'The columns {missing} were not created.')
+            new_list = self._swap_lists(site_id, current, new_list, f'{name}_old_{suffix}')
+        except (BaseError, ValueError) as e:
+            logging.warning(f"{label}The list can't be recreated, the items will be removed instead. {e}")
+            self._delete_list_in_background(site_id, new_list['id'], label)
+            return None
+
+        logging.info(f'{label}The list {name} was recreated, the previous list is being deleted.')
+        self._delete_list_in_background(site_id, current['id'], label)
+        self._metadata_cache.put(cache_key, site, new_list, list_columns)
+        return new_list
+
+    def _save_checkpoint(self, list_id, checkpoint):
+        if checkpoint and (checkpoint.offset or checkpoint.ahead):
+            logging.info(f'{checkpoint.offset + len(checkpoint.ahead)} rows were written, '
+                         f'the next run will resume the write.')
+            self._state[KEY_STATE_CHECKPOINTS][list_id] = checkpoint.to_dict()
+        else:
+            self._state[KEY_STATE_CHECKPOINTS].pop(list_id, None)
+
+    def _resume_checkpoint(self, site_id, list_id, signature, label=''):
+        """
+        Loads the checkpoint of the failed write and verifies it against the list. All items committed before
+        the checkpoint offset must exist. The items of the rows committed after the offset are kept, the rows
+        of the missing ones are written again. The other items are removed, so the resumed write never duplicates
+        items.
+
+        :return: WriteCheckpoint or None if the write must start over
+        """
+        stored = self._state[KEY_STATE_CHECKPOINTS].pop(list_id, None)
+        if not stored:
+            return None
+        if stored.get('signature') != signature:
+            logging.info(f'{label}The table or the list changed since the failed write, the write will start over.')
+            return None
+
+        checkpoint = WriteCheckpoint.from_dict(stored)
+        committed = checkpoint.committed_ids
+        ahead = {item_id: row for row, item_id in checkpoint.ahead.items()}
+        found = 0
+        other = []
+        for page in self.client.get_list_item_ids(site_id, list_id):
+            for item_id in page:
+                if int(item_id) in committed:
+                    found += 1
+                elif ahead.pop(int(item_id), None) is None:
+                    other.append(item_id)
+        if found != checkpoint.offset or len(committed) != checkpoint.offset:
+            logging.warning(f'{label}{checkpoint.offset - found} items written by the failed run are missing, '
+                            f'the write will start over.')
+            return None
+        checkpoint.discard(ahead.values())
+
+        if other:
+            logging.info(f'{label}Removing {len(other)} items not covered by the checkpoint.')
+            failed = self.client.delete_list_items(site_id, list_id, other)
+            if failed:
+                logging.warning(f"{label}{len(failed)} items couldn't be deleted, the write will start over.")
+                return None
+        return checkpoint
+
+    def sync_table(self, site_id, list_id, table, plan: ColumnPlan, primary_key, use_state=False,
+                   report_name=FAILURE_REPORT_NAME):
+        if not primary_key:
+            raise ValueError('The primary key column must be specified for the incremental load.')
+        if primary_key not in table.header:
+            raise ValueError(f'Specified primary key column "{primary_key}" is missing in the source table.')
+
+        # fields of the written records
+        columns = plan.field_names
+        key_field = plan.get_field_name(primary_key)
+        if not key_field:
+            raise ValueError(f'Specified primary key column "{primary_key}" is missing in the destination list.')
+
+        signature = {'site_id': site_id, 'list_id': list_id, 'key_field': key_field, 'columns': sorted(columns)}
+        existing = self._load_row_state(site_id, list_id, signature) if use_state else None
+
+        concurrency = self.cfg_params.get(KEY_WRITE_CONCURRENCY) or DEFAULT_WRITE_CONCURRENCY
+        sync = IncrementalSync(self.client, site_id, list_id, key_field, columns, max_in_flight=int(concurrency),
+                               batch_limit=BATCH_LIMIT, column_types=plan.field_types)
+        res = sync.sync(map(plan.to_fields, table.rows()), existing=existing)
+
+        if res.failed:
+            # the list state is unknown, force reading the list in the next run
+            self._state[KEY_STATE_ROWS].pop(list_id, None)
+            self._write_failure_report(res.failed, report_name)
+            raise RuntimeError(f'Sync finished with error. {len(res.failed)} records failed, '
+                               f'first failures: {res.failed[:10]}')
+
+        if use_state:
+            self._save_row_state(site_id, list_id, signature, res.row_map)
+
+    def _load_row_state(self, site_id, list_id, signature):
+        row_state = self._state[KEY_STATE_ROWS].get(list_id)
+        if not row_state:
+            logging.info('No items stored from the previous run, the list items will be read.')
+            return None
+        if row_state.get('signature') != signature:
+            logging.info('The list or the table columns changed since the previous run, the list items will be read.')
+            return None
+        sh_list = self.client.get_site_list(site_id, list_id)
+        if row_state.get('list_modified') != sh_list.get('lastModifiedDateTime'):
+            logging.info('The list was modified since the previous run, the list items will be read.')
+            return None
+        return decode_row_map(row_state['rows'])
+
+    def _save_row_state(self, site_id, list_id, signature, row_map):
+        sh_list = self.client.get_site_list(site_id, list_id)
+        self._state[KEY_STATE_ROWS][list_id] = {'signature': signature,
+                                                'list_modified': sh_list.get('lastModifiedDateTime'),
+                                                'rows': encode_row_map(row_map)}
+
+    def _build_create_requests(self, site_id, list_id, table, plan, start=0):
+        workers = int(self.cfg_params.get(KEY_PARSE_WORKERS) or 1)
+        if workers > 1:
+            encoder = ParallelRequestEncoder(table, plan, site_id, list_id, workers)
+            ranges = encoder.get_ranges()
+            if ranges is not None:
+                return encoder.requests(ranges, start)
+            logging.info('The input table is compressed, it will be parsed in a single process.')
+        return self._encode_create_requests(site_id, list_id, table, plan, start)
+
+    def _encode_create_requests(self, site_id, list_id, table, plan, start=0):
+        rows = islice(table.rows(), start, None)
+        for ri, line in enumerate(map(plan.to_fields, rows), start):
+            yield self.client.encode_create_list_item_batch_request(str(ri), site_id, list_id, line)
+
+    def _write_failure_report(self, failed, report_name=FAILURE_REPORT_NAME):
+        """
+        Writes all failed records with the error details into the output files.
+        """
+        report_path = os.path.join(self.files_out_path, report_name)
+        with open(report_path, 'w', encoding='utf-8') as out_file:
+            json.dump(failed, out_file, indent=2)
+        permanent = len([f for f in failed if not f.get('transient')])
+        logging.warning(f'{len(failed)} records failed ({permanent} permanent, {len(failed) - permanent} transient '
+                        f'errors). Failure details were written to {report_name}.')
+
+    def validate_table_cols(self, list_columns, table, title_col_mapping=None):
+        src_cols = list(table.header)
 
         dst_cols = [c['name'] for c in list_columns]
         required_dst_cols = [c['name'] for c in list_columns if c['required']]
@@ -196,15 +776,11 @@ class Component(KBCEnvHandler):
 
         return nonexisting_cols
 
-    def _cleanup_record_fields(self, line, nonexistent_cols):
-        for c in nonexistent_cols:
-            line.pop(c)
-
-    def _create_new_list(self, site_id, list_name, list_desc, table_pars, in_table):
+    def _create_new_list(self, site_id, list_name, list_desc, table_pars, table):
         title_col = table_pars[KEY_TITLE_COL]
         column_pars = table_pars[KEY_COLUMN_SETUP]
 
-        default_cols = self.validate_table_cols(column_pars, in_table, title_col)
+        default_cols = self.validate_table_cols(column_pars, table, title_col)
         # validate title col
         if title_col[KEY_SRC_NAME] not in default_cols:
             raise ValueError(f'Specified title column "{title_col[KEY_SRC_NAME]}" is missing in the source table.')
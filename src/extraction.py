@@ -0,0 +1,128 @@
+'''
+Streaming extraction of the list items into the output tables.
+
+'''
+import logging
+
+from ms_graph.exceptions import Gone
+from ms_graph.paging import prefetch
+
+ID_COLUMN = {'name': 'id', 'displayName': 'id'}
+# flag of the items deleted since the previous delta query
+DELETED_COLUMN = {'name': 'is_deleted', 'displayName': 'is_deleted'}
+
+
+def get_column_mapping(list_columns, columns=None, deleted_flag=False):
+    """
+    Builds the mapping of the list column names to the output column names. The item id is always included.
+
+    :param list_columns: list columns as returned by the API
+    :param columns: names or display names of the columns to extract, all columns if not specified
+    :param deleted_flag: add the column flagging the deleted items
+    :return: list of dicts with `name` and `displayName` keys
+    """
+    selected = list_columns
+    if columns:
+        by_name = {}
+        for c in list_columns:
+            by_name.setdefault(c['displayName'], c)
+            by_name[c['name']] = c
+        missing = [c for c in columns if c not in by_name]
+        if missing:
+            raise ValueError(f'Some columns: {missing} were not found in the list.')
+        selected = [by_name[c] for c in columns]
+
+    mapping = [dict(ID_COLUMN)]
+    seen = {ID_COLUMN['name']}
+    for c in selected:
+        if c['name'] not in seen:
+            seen.add(c['name'])
+            mapping.append({'name': c['name'], 'displayName': c['displayName']})
+    if deleted_flag:
+        mapping.append(dict(DELETED_COLUMN))
+    return mapping
+
+
+class ListExtractor:
+    """
+    Streams the list items page by page into a result writer, keeping only the current and the prefetched pages
+    in memory. Only the mapped fields are requested.
+
+    In the delta mode the items are read by the delta query. With the delta link of the previous run only the items
+    changed since then are read and the deleted items are flagged, `incremental` is set in that case. When the delta
+    link expired, all items are read again. `delta_link` holds the link for the next run once all pages are read.
+    """
+
+    def __init__(self, client, site_id, list_id, column_mapping, page_size=1000, prefetch_pages=2, delta=False,
+                 delta_link=None):
+        self.client = client
+        self.site_id = site_id
+        self.list_id = list_id
+        self.column_mapping = column_mapping
+        self.page_size = page_size
+        self.prefetch_pages = prefetch_pages
+        self.delta = delta
+        self.delta_link = delta_link
+        self.incremental = False
+        self._field_names = [c['name'] for c in column_mapping
+                             if c['name'] not in (ID_COLUMN['name'], DELETED_COLUMN['name'])]
+
+    def pages(self):
+        """
+        :return: generator of row lists, one per result page. Rows are dicts keyed by the list column names.
+        """
+        names = self._field_names
+        id_name, deleted_name = ID_COLUMN['name'], DELETED_COLUMN['name']
+        for page in (self._get_delta_pages() if self.delta else self._get_pages()):
+            rows = []
+            for item in page:
+                if 'deleted' in item:
+                    rows.append({id_name: item['id'], deleted_name: 1})
+                    continue
+                fields = item.get('fields', {})
+                row = {n: fields[n] for n in names if n in fields}
+                row[id_name] = item['id']
+                if self.delta:
+                    row[deleted_name] = 0
+                rows.append(row)
+            yield rows
+
+    def _get_pages(self):
+        return self._prefetch(self.client.get_list_items(self.site_id, self.list_id, field_names=self._field_names,
+                                                         page_size=self.page_size))
+
+    def _get_delta_pages(self):
+        previous_link = self.delta_link
+        self.incremental = bool(previous_link)
+        started = False
+        try:
+            for page, delta_link in self._prefetch(self.client.get_list_items_delta(
+                    self.site_id, self.list_id, field_names=self._field_names, delta_link=previous_link)):
+                started = True
+                if delta_link:
+                    self.delta_link = delta_link
+                yield page
+        except Gone:
+            if started or not previous_link:
+                raise
+            logging.warning('The stored delta link expired, all list items will be read.')
+            self.delta_link = None
+            yield from self._get_delta_pages()
+
+    def _prefetch(self, pages):
+        return prefetch(pages, self.prefetch_pages) if self.prefetch_pages else pages
+
+    def extract(self, writer, user_values=None):
+        """
+        Writes all list items using the writer.
+
+        :param writer: ListDataResultWriter
+        :param user_values: values of the writer's user columns, e.g. the list id
+        :return: number of extracted items
+        """
+        count = 0
+        for rows in self.pages():
+            for row in rows:
+                writer.write(row, user_values=user_values)
+            count += len(rows)
+        return count
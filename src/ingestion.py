@@ -0,0 +1,175 @@
+'''
+Streaming reader of the input tables.
+
+'''
+import csv
+import gzip
+import io
+import json
+import mmap
+import os
+
+GZIP_MAGIC = b'\x1f\x8b'
+# approximate size of the byte ranges parsed independently
+RANGE_SIZE = 4 * 1024 * 1024
+
+
+def find_record_end(buffer, record_start, position, quote):
+    """
+    Finds the end of the CSV record containing the position. A line break ends the record only when
+    the enclosure characters since the record start are paired, the escaped enclosures are doubled.
+
+    :param buffer: bytes or mmap
+    :param record_start: offset of a record start at or before the position
+    :param position: offset within the record
+    :param quote: encoded enclosure character
+    :return: offset following the record line break, or the buffer size
+    """
+    # mmap has no count, the slices are copied
+    enclosed = buffer[record_start:position].count(quote) % 2
+    while True:
+        line_end = buffer.find(b'\n', position)
+        if line_end == -1:
+            return len(buffer)
+        enclosed = (enclosed + buffer[position:line_end].count(quote)) % 2
+        if not enclosed:
+            return line_end + 1
+        position = line_end + 1
+
+
+def split_records(buffer, start, range_size, quote):
+    """
+    Splits the buffer into ranges of whole CSV records.
+
+    :param start: offset of the first record
+    :param range_size: approximate size of a range in bytes
+    :return: list of (start, end) offsets
+    """
+    ranges = []
+    size = len(buffer)
+    while start < size:
+        end = size if start + range_size >= size else find_record_end(buffer, start, start + range_size, quote)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+class TableReader:
+    """
+    Streams rows of a Keboola input table as tuples without loading the table into memory.
+
+    Supports plain and gzip compressed files and sliced tables - a directory of slices without header, where
+    the columns are specified in the table manifest.
+    """
+
+    def __init__(self, in_table):
+        self.path = in_table['full_path']
+        self.manifest = self._load_manifest(self.path)
+        self.delimiter = self.manifest.get('delimiter') or ','
+        self.enclosure = self.manifest.get('enclosure') or '"'
+        self.sliced = os.path.isdir(self.path)
+        self._header = None
+
+    @property
+    def header(self):
+        if self._header is None:
+            if self.sliced:
+                self._header = list(self.manifest.get('columns', []))
+            else:
+                with self._open(self.path) as in_file:
+                    self._header = next(self._csv_reader(in_file), [])
+            if not self._header:
+                raise ValueError(f'The input table {os.path.basename(self.path)} has no columns.')
+        return self._header
+
+    @property
+    def files(self):
+        if not self.sliced:
+            return [self.path]
+        return [os.path.join(self.path, f) for f in sorted(os.listdir(self.path))
+                if not f.startswith('.') and os.path.isfile(os.path.join(self.path, f))]
+
+    @property
+    def size(self):
+        """
+        Size of the table files in bytes.
+        """
+        return sum(os.path.getsize(f) for f in self.files)
+
+    def byte_ranges(self, range_size=RANGE_SIZE):
+        """
+        Splits the table files into byte ranges of whole records that can be parsed independently by `read_range`.
+        The files are memory mapped, so only the scanned pages are read.
+
+        :param range_size: approximate size of a range in bytes
+        :return: list of (file path, start, end) tuples in the row order, None if the table is compressed
+        """
+        if any(self._is_compressed(f) for f in self.files):
+            return None
+        quote = self.enclosure.encode('utf-8')
+        ranges = []
+        for file_path in self.files:
+            if not os.path.getsize(file_path):
+                continue
+            with open(file_path, 'rb') as in_file, mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                start = 0 if self.sliced else find_record_end(buffer, 0, 0, quote)
+                ranges.extend((file_path, s, e) for s, e in split_records(buffer, start, range_size, quote))
+        return ranges
+
+    def read_range(self, file_path, start, end):
+        """
+        Parses the rows in the byte range returned by `byte_ranges`, the same way as `rows`.
+
+        :return: list of row value lists
+        """
+        with open(file_path, 'rb') as in_file, mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            data = buffer[start:end].decode('utf-8')
+        return list(self._complete_rows(self._csv_reader(io.StringIO(data, newline=''))))
+
+    def rows(self):
+        """
+        Streams the table rows.
+
+        :return: generator of row value lists in the `header` column order
+        """
+        has_header = not self.sliced
+        for file_path in self.files:
+            with self._open(file_path) as in_file:
+                reader = self._csv_reader(in_file)
+                if has_header:
+                    next(reader, None)
+                yield from self._complete_rows(reader)
+
+    def _complete_rows(self, reader):
+        """
+        Skips the blank lines and pads the rows shorter than the header with empty values.
+        """
+        width = len(self.header)
+        for row in reader:
+            if len(row) < width:
+                if not row:
+                    continue
+                row += [''] * (width - len(row))
+            yield row
+
+    def _csv_reader(self, in_file):
+        return csv.reader(in_file, delimiter=self.delimiter, quotechar=self.enclosure, lineterminator='\n')
+
+    @staticmethod
+    def _is_compressed(path):
+        with open(path, 'rb') as f:
+            return f.read(2) == GZIP_MAGIC
+
+    @classmethod
+    def _open(cls, path):
+        if cls._is_compressed(path):
+            return gzip.open(path, mode='rt', encoding='utf-8', newline='')
+        return open(path, mode='r', encoding='utf-8', newline='')
+
+    @staticmethod
+    def _load_manifest(path):
+        manifest_path = path + '.manifest'
+        if not os.path.isfile(manifest_path):
+            return {}
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
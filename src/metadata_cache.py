@@ -0,0 +1,72 @@
+'''
+Cache of the resolved site, list and list columns metadata kept in the component state.
+
+'''
+import time
+
+
+class MetadataCache:
+    """
+    Metadata entries keyed by the host, site path and list name. An entry is used without any request within the TTL,
+    an expired entry has to be revalidated by the list eTag before it is used again.
+    """
+
+    def __init__(self, entries: dict = None, ttl=3600, clock=time.time):
+        """
+
+        :param entries: cached entries, e.g. loaded from the state
+        :param ttl: number of seconds the entries are used without revalidation, 0 disables the cache
+        :param clock: time source
+        """
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = dict(entries or {})
+
+    @staticmethod
+    def build_key(host, site_path, list_name):
+        return '/'.join([host, site_path.strip('/'), list_name])
+
+    def get(self, key):
+        """
+        :return: fresh entry dict with `site`, `list` and `columns` keys or None
+        """
+        entry = self._entries.get(key)
+        if not self.ttl or not entry or self._clock() - entry['cached_at'] >= self.ttl:
+            return None
+        return entry
+
+    def get_expired(self, key):
+        """
+        :return: expired entry to be revalidated or None
+        """
+        entry = self._entries.get(key)
+        if not self.ttl or not entry or self.get(key):
+            return None
+        return entry
+
+    def put(self, key, site, sh_list, columns):
+        if not self.ttl:
+            return
+        self._entries[key] = {'site': {'id': site['id']},
+                              'list': {k: sh_list.get(k) for k in ('id', 'name', 'displayName', 'eTag')},
+                              'columns': columns,
+                              'cached_at': self._clock()}
+
+    def touch(self, key, etag=None):
+        """
+        Marks a revalidated entry fresh again.
+        """
+        entry = self._entries[key]
+        entry['cached_at'] = self._clock()
+        if etag:
+            entry['list']['eTag'] = etag
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def to_dict(self):
+        """
+        :return: entries to be stored, the entries expired long ago are dropped
+        """
+        now = self._clock()
+        return {k: e for k, e in self._entries.items() if now - e['cached_at'] < 10 * self.ttl}
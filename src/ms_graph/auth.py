@@ -0,0 +1,68 @@
+import logging
+import threading
+import time
+
+# lifetime of the access tokens when not specified in the token response
+DEFAULT_EXPIRES_IN = 3600
+
+
+class TokenManager:
+    """
+    Keeps the access token valid for the concurrent requests.
+
+    The token is refreshed proactively shortly before it expires. Refreshes are single-flight: concurrent callers
+    wait for one refresh and share its result, and a rejected token is refreshed only once no matter how many
+    requests were rejected with it.
+    """
+
+    def __init__(self, fetch_token, refresh_margin=300.0, clock=time.monotonic):
+        """
+
+        :param fetch_token: callable returning the token response dict with `access_token` and `expires_in` keys
+        :param refresh_margin: number of seconds before the expiration the token is refreshed
+        :param clock: monotonic time source
+        """
+        self._fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._token = None
+        self._refresh_at = 0.0
+
+    @property
+    def token(self):
+        return self._token
+
+    def get_token(self):
+        """
+        :return: valid access token, refreshed if it is about to expire
+        """
+        token = self._token
+        if token is not None and self._clock() < self._refresh_at:
+            return token
+        with self._lock:
+            # another caller may have refreshed the token in the meantime
+            if self._token is None or self._clock() >= self._refresh_at:
+                self._refresh()
+            return self._token
+
+    def refresh(self, stale_token=None):
+        """
+        Refreshes the token, e.g. when it was rejected.
+
+        :param stale_token: the rejected token. Nothing is refreshed when the current token is already different.
+        :return: new access token
+        """
+        with self._lock:
+            if stale_token is None or stale_token == self._token:
+                self._refresh()
+            return self._token
+
+    def _refresh(self):
+        logging.debug('Refreshing the access token.')
+        response = self._fetch_token()
+        expires_in = float(response.get('expires_in') or DEFAULT_EXPIRES_IN)
+        # refresh short living tokens in the middle of their lifetime
+        margin = min(self.refresh_margin, expires_in / 2)
+        self._token = response['access_token']
+        self._refresh_at = self._clock() + expires_in - margin
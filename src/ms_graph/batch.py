@@ -0,0 +1,397 @@
+import heapq
+import itertools
+import logging
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List
+
+from ms_graph import codec, exceptions
+from ms_graph.throttling import THROTTLE_STATUSES
+
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504, 507, 509)
+# code of the sub-requests of a failed batch that may have been applied
+OUTCOME_UNKNOWN = 'outcomeUnknown'
+# error -> HTTP status of the whole batch response
+ERROR_STATUSES = {error: status for status, error in exceptions.STATUS_ERRORS.items()}
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+# batch sub-request already serialized into JSON bytes
+EncodedBatchRequest = namedtuple('EncodedBatchRequest', ['id', 'payload'])
+# sub-response body members used by the callers, the created items echo all their fields
+SUB_RESPONSE_BODY_MEMBERS = ('id', 'error')
+
+
+def get_request_id(request):
+    """
+    :param request: batch sub-request dictionary or EncodedBatchRequest
+    :return: sub-request id
+    """
+    if isinstance(request, EncodedBatchRequest):
+        return request.id
+    return str(request['id'])
+
+
+def is_idempotent(request):
+    """
+    :param request: batch sub-request dictionary or EncodedBatchRequest, the encoded sub-requests create items
+    :return: True if the sub-request can be safely sent again
+    """
+    if isinstance(request, EncodedBatchRequest):
+        return False
+    return request.get('method', 'GET') != 'POST'
+
+
+def get_request_size(request):
+    """
+    :param request: batch sub-request dictionary or EncodedBatchRequest
+    :return: size of the serialized sub-request in bytes
+    """
+    if isinstance(request, EncodedBatchRequest):
+        return len(request.payload)
+    return len(codec.dumps(request))
+
+
+def encode_create_item_request(site_id, list_id, fields):
+    """
+    Serializes the create item batch sub-request without its id, so that the sub-requests can be serialized
+    before their ids are known, e.g. in another process. The id is added by `with_request_id`.
+
+    :param fields: Dictionary with fields. {key: value}
+    :return: JSON bytes of the sub-request members following the id
+    """
+    return _get_create_item_prefix(site_id, list_id) + codec.dumps(fields) + b'}}'
+
+
+@lru_cache(maxsize=64)
+def _get_create_item_prefix(site_id, list_id):
+    endpoint = f'/sites/{site_id}/lists/{list_id}/items'
+    return (b'"url":' + codec.dumps(endpoint) + b',"method":"POST","headers":{"Content-Type":"application/json"},'
+            b'"body":{"fields":')
+
+
+def with_request_id(rq_id, encoded):
+    """
+    :param rq_id: sub-request id
+    :param encoded: sub-request serialized by `encode_create_item_request`
+    :return: EncodedBatchRequest
+    """
+    return EncodedBatchRequest(rq_id, b'{"id":' + codec.dumps(rq_id) + b',' + encoded)
+
+
+def parse_batch_response(content):
+    """
+    Decodes the $batch response body. Only the members used by the callers are kept in the sub-responses:
+    the id, status, Retry-After header, error and the id of the created item. The fields echoed by the created
+    and updated items are dropped right away, so the sub-responses held until the whole batch is processed
+    stay small.
+
+    :param content: JSON bytes
+    :return: dict with the `responses` list, other bodies, e.g. an error, are returned as they are
+    """
+    data = codec.loads(content)
+    responses = data.get('responses') if isinstance(data, dict) else None
+    if responses is None:
+        return data
+    data['responses'] = [_slim_sub_response(r) for r in responses]
+    return data
+
+
+def _slim_sub_response(response):
+    slim = {'id': response.get('id'), 'status': response.get('status')}
+    retry_after = (response.get('headers') or {}).get('Retry-After')
+    if retry_after is not None:
+        slim['headers'] = {'Retry-After': retry_after}
+    body = response.get('body')
+    if isinstance(body, dict):
+        slim['body'] = {k: body[k] for k in SUB_RESPONSE_BODY_MEMBERS if k in body}
+    elif body is not None:
+        slim['body'] = body
+    return slim
+
+
+class BatchPacker:
+    """
+    Packs the sub-requests into batches limited by the number of requests and the serialized size.
+
+    The target batch size follows the observed throughput, so a batch takes about `target_latency` seconds
+    to process. A batch rejected as too large lowers the size ceiling. A request larger than the target size
+    is sent in a batch of its own.
+    """
+
+    def __init__(self, max_items=20, max_bytes=MAX_BATCH_BYTES, min_bytes=64 * 1024, target_latency=5.0,
+                 smoothing=0.3):
+        self.max_items = max_items
+        self.min_bytes = min_bytes
+        self.target_latency = target_latency
+        self.smoothing = smoothing
+        self.ceiling = max_bytes
+        self.target_bytes = max(min_bytes, max_bytes // 4)
+        self._throughput = None
+
+    def pack(self, requests):
+        """
+        :param requests: iterable of batch sub-requests
+        :return: generator of batches. The target size is re-read for each batch, so the feedback
+                 of the already sent batches applies to the following ones.
+        """
+        batch = []
+        batch_size = 0
+        for rq in requests:
+            size = get_request_size(rq)
+            if batch and (len(batch) >= self.max_items or batch_size + size > self.target_bytes):
+                yield batch
+                batch = []
+                batch_size = 0
+            batch.append(rq)
+            batch_size += size
+        # last batch
+        if batch:
+            yield batch
+
+    def observe(self, batch_size, latency):
+        """
+        Adjusts the target size by the throughput of a processed batch.
+        """
+        if latency <= 0:
+            return
+        throughput = batch_size / latency
+        if self._throughput is None:
+            self._throughput = throughput
+        else:
+            self._throughput += self.smoothing * (throughput - self._throughput)
+        self.target_bytes = int(min(self.ceiling, max(self.min_bytes, self._throughput * self.target_latency)))
+
+    def on_too_large(self, batch_size):
+        """
+        Lowers the size ceiling below the size of a rejected batch.
+        """
+        self.ceiling = max(self.min_bytes, min(self.ceiling, batch_size // 2))
+        self.target_bytes = min(self.target_bytes, self.ceiling)
+        logging.warning(f'Batch of {batch_size} bytes was rejected, limiting batches to {self.ceiling} bytes.')
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Retry strategy of the failed batch sub-requests. Only the transient failures (throttling, server errors)
+    are retried, other 4xx failures are permanent.
+    """
+    max_attempts: int = 5
+    backoff_base: float = 1.0
+    max_backoff: float = 60.0
+    # number of retried sub-requests allowed per dispatched request on top of the min_budget
+    budget_ratio: float = 0.2
+    min_budget: int = 100
+
+    @staticmethod
+    def is_transient(status):
+        return status in TRANSIENT_STATUSES
+
+    def backoff(self, attempt):
+        return min(self.max_backoff, self.backoff_base * 2 ** (attempt - 1))
+
+
+def get_failure_details(response):
+    """
+    Extracts the error details from the failed batch sub-response.
+
+    :param response: batch sub-response
+    :return: dict with status, error code, message, number of attempts and whether the failure was transient
+    """
+    body = response.get('body')
+    error = body.get('error', {}) if isinstance(body, dict) else {'message': body}
+    if isinstance(error, str):
+        error = {'message': error}
+    return {'status': response['status'],
+            'code': error.get('code'),
+            'message': error.get('message'),
+            'attempts': response.get('attempts', 1),
+            'transient': RetryPolicy.is_transient(response['status'])}
+
+
+class BatchDispatcher:
+    """
+    Sends $batch requests concurrently, keeping at most `max_in_flight` batches on the wire.
+
+    Sub-requests that fail with a transient error are collected from all the batches, re-batched and sent again
+    after a backoff, until they succeed, run out of attempts or the retry budget of the dispatch is spent.
+    Each sub-request gets exactly one final response, so the sub-request ids must be unique within the dispatch.
+    Throttling is handled by the client, which re-sends the throttled sub-requests once its rate controller allows
+    it and delays the requests of all the in-flight batches meanwhile, so they are not retried here again.
+    A batch rejected as too large is split in halves and sent again. When a batch fails as a whole with a transient
+    error, e.g. a gateway timeout, it may have been applied in part. Its idempotent sub-requests are retried as if
+    they failed on their own, the others, e.g. creating items, get a final response with the `outcomeUnknown` code,
+    so they never create the same item twice.
+    """
+
+    def __init__(self, client, max_in_flight=4, batch_limit=20, retry_policy: RetryPolicy = None,
+                 packer: BatchPacker = None):
+        if max_in_flight < 1:
+            raise ValueError(f'The number of concurrent batches must be at least 1, got {max_in_flight}.')
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.batch_limit = batch_limit
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.packer = packer or BatchPacker(max_items=batch_limit)
+        # RunMetrics of the client if it collects any
+        self.metrics = getattr(client, 'metrics', None)
+
+    def dispatch_requests(self, requests, r_type='', all_responses=False):
+        """
+        Packs the sub-requests into batches by the packer and sends them concurrently. See `dispatch`.
+
+        :param requests: iterable of batch sub-requests with unique ids
+        """
+        return self.dispatch(self.packer.pack(requests), r_type, all_responses)
+
+    def dispatch(self, batches: Iterable[List[dict]], r_type='', all_responses=False):
+        """
+        Sends batches concurrently.
+
+        :param batches: iterable of batch request lists, each at most `batch_limit` requests long.
+                        Sub-request ids must be unique across all batches.
+        :param r_type: request type description used in error messages
+        :param all_responses: yield all final sub-responses instead of the failed ones only
+        :return: generator of (sent_batch, final_responses) tuples. Sent batches are the original batches in
+                 the submission order, interleaved with the batches of retried sub-requests.
+                 Failed final responses have the number of attempts in the `attempts` key.
+        """
+        source = iter(batches)
+        source_exhausted = False
+        # halves of the batches rejected as too large
+        split = deque()
+        pending = deque()
+        # heap of (not_before, sequence, request), the sequence keeps the order of the requests due at the same time
+        retry_queue = []
+        sequence = itertools.count()
+        attempts = dict()
+        sent = 0
+        retried = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            while True:
+                while len(pending) < self.max_in_flight:
+                    batch = split.popleft() if split else self._next_retry_batch(retry_queue,
+                                                                                 flush=source_exhausted)
+                    if batch is None and not source_exhausted:
+                        batch = next(source, None)
+                        source_exhausted = batch is None
+                        sent += len(batch) if batch else 0
+                    if batch is None:
+                        break
+                    pending.append((batch, executor.submit(self._send, batch, r_type, all_responses)))
+
+                if not pending:
+                    if not retry_queue:
+                        break
+                    # only the retries waiting for backoff are left
+                    time.sleep(max(0.0, retry_queue[0][0] - time.monotonic()))
+                    continue
+
+                batch, future = pending.popleft()
+                batch_size = sum(get_request_size(rq) for rq in batch)
+                # final responses of the sub-requests that must not be retried
+                unknown = []
+                try:
+                    responses, latency = future.result()
+                    self.packer.observe(batch_size, latency)
+                except exceptions.RequestEntityTooLarge as e:
+                    # the batch was rejected before any of its sub-requests was applied
+                    self.packer.on_too_large(batch_size)
+                    if len(batch) > 1:
+                        self._record_retries('split', len(batch))
+                        middle = len(batch) // 2
+                        split.extend((batch[:middle], batch[middle:]))
+                        continue
+                    responses = [{'id': get_request_id(batch[0]), 'status': 413, 'body': e.error_obj}]
+                except exceptions.BaseError as e:
+                    status = ERROR_STATUSES.get(type(e))
+                    if not self.retry_policy.is_transient(status):
+                        raise
+                    if isinstance(e, exceptions.GatewayTimeout):
+                        # smaller batches are processed faster
+                        self.packer.on_too_large(batch_size)
+                    failures = [(is_idempotent(rq), self._get_batch_failure(rq, status, e.error_obj)) for rq in batch]
+                    responses = [r for idempotent, r in failures if idempotent]
+                    unknown = [r for idempotent, r in failures if not idempotent]
+                requests_by_id = None
+                final = [self._finalize(r, attempts.pop(str(r['id']), 1)) for r in unknown]
+                for r in responses:
+                    rq_id = str(r['id'])
+                    attempt = attempts.pop(rq_id, 1)
+                    if r['status'] < 300 or not self.retry_policy.is_transient(r['status']):
+                        final.append(self._finalize(r, attempt))
+                    elif r['status'] in THROTTLE_STATUSES:
+                        # the client already ran out of its retries
+                        final.append(self._finalize(r, attempt))
+                    elif attempt >= self.retry_policy.max_attempts:
+                        final.append(self._finalize(r, attempt))
+                    elif retried >= self.retry_policy.min_budget + self.retry_policy.budget_ratio * sent:
+                        logging.warning(f'The retry budget is spent, request {rq_id} will not be retried.')
+                        final.append(self._finalize(r, attempt))
+                    else:
+                        retried += 1
+                        self._record_retries('transient')
+                        attempts[rq_id] = attempt + 1
+                        requests_by_id = requests_by_id or {get_request_id(rq): rq for rq in batch}
+                        heapq.heappush(retry_queue, (time.monotonic() + self.retry_policy.backoff(attempt),
+                                                     next(sequence), requests_by_id[rq_id]))
+                yield batch, final
+
+        if retried:
+            logging.info(f'{retried} failed requests were retried.')
+
+    def _record_retries(self, reason, count=1):
+        if self.metrics:
+            self.metrics.record_retries(reason, count)
+
+    def _send(self, batch, r_type, all_responses):
+        start = time.monotonic()
+        responses = self.client.make_batch_request(batch, r_type, all_responses)
+        return responses, time.monotonic() - start
+
+    def _next_retry_batch(self, retry_queue, flush=False):
+        """
+        Builds a batch of the retried requests once there is enough of them with the backoff elapsed,
+        or from any of them when flushing. The requests are taken in the order of their backoff end.
+        """
+        now = time.monotonic()
+        ready = []
+        ready_size = 0
+        full = False
+        while retry_queue and retry_queue[0][0] <= now:
+            ready_size += get_request_size(retry_queue[0][2])
+            if len(ready) >= self.batch_limit or (ready and ready_size > self.packer.target_bytes):
+                full = True
+                break
+            ready.append(heapq.heappop(retry_queue))
+        full = full or len(ready) >= self.batch_limit
+        if ready and (full or flush):
+            return [rq for not_before, seq, rq in ready]
+        for entry in ready:
+            heapq.heappush(retry_queue, entry)
+        return None
+
+    @staticmethod
+    def _get_batch_failure(request, status, error_obj):
+        """
+        Builds the sub-response of the request in a batch failed as a whole.
+        """
+        rq_id = get_request_id(request)
+        if is_idempotent(request):
+            # retried as if it failed on its own
+            return {'id': rq_id, 'status': status, 'body': error_obj}
+        message = error_obj.get('error', {}).get('message')
+        return {'id': rq_id, 'status': status,
+                'body': {'error': {'code': OUTCOME_UNKNOWN,
+                                   'message': f'The batch failed with status {status} and may have been applied, '
+                                              f'the request is not sent again. {message}'}}}
+
+    @staticmethod
+    def _finalize(response, attempts):
+        if response['status'] >= 300:
+            response['attempts'] = attempts
+        return response
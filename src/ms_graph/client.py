@@ -1,15 +1,21 @@
 import logging
-from dataclasses import asdict
+from dataclasses import asdict, is_dataclass
 from dataclasses import dataclass
 from typing import List
 
 import requests
 from kbc.client_base import HttpClientBase
 from requests.adapters import HTTPAdapter
+from requests.hooks import default_hooks
 from urllib3.util.retry import Retry
 
-from ms_graph import exceptions
+from ms_graph import codec, exceptions
+from ms_graph.auth import TokenManager
+from ms_graph.batch import BatchDispatcher, EncodedBatchRequest, encode_create_item_request, get_request_id, \
+    parse_batch_response, with_request_id
 from ms_graph.dataobjects import SharepointList
+from ms_graph.metrics import RunMetrics
+from ms_graph.throttling import RateController, THROTTLE_STATUSES, parse_retry_after
 
 
 @dataclass
@@ -25,6 +31,8 @@ class Client(HttpClientBase):
     OAUTH_LOGIN_URL = 'https://login.microsoftonline.com/common/oauth2/v2.0/token'
     MAX_RETRIES = 9
     BASE_URL = 'https://graph.microsoft.com/v1.0/'
+    # default number of list items per result page
+    ITEM_PAGE_SIZE = 1000
     SYSTEM_LIST_COLUMNS = ["ComplianceAssetId",
                            "ContentType",
                            # "Modified",
@@ -41,44 +49,66 @@ class Client(HttpClientBase):
                            "AppAuthor",
                            "AppEditor"]
 
-    def __init__(self, refresh_token, client_secret, client_id, scope):
+    def __init__(self, refresh_token, client_secret, client_id, scope, max_concurrency=16):
+        """
+
+        :param max_concurrency: maximum number of concurrent requests, also the size of the connection pool
+        """
+        # throttling responses (429, 503) are handled by the rate controller
         HttpClientBase.__init__(self, base_url=self.BASE_URL, max_retries=self.MAX_RETRIES, backoff_factor=0.3,
-                                status_forcelist=(429, 503, 500, 502, 504, 507))
+                                status_forcelist=(500, 502, 504, 507))
+        self.metrics = RunMetrics()
+        self._rate_controller = RateController(max_concurrency=max_concurrency, metrics=self.metrics)
+        # one long-lived session keeps the connections alive for all requests
+        self._session = self.requests_retry_session(pool_size=max_concurrency)
         # refresh always on init
         self.__refresh_token = refresh_token
         self.__clien_secret = client_secret
         self.__client_id = client_id
         self.__scope = scope
-        access_token = self.refresh_token()
+        self._token_manager = TokenManager(self._fetch_token)
+        # refresh always on init
+        self._token_manager.get_token()
 
-        # set auth header
-        self._auth_header = {"Authorization": 'Bearer ' + access_token,
-                             "Content-Type": "application/json"}
+        # set auth header, the token is set per request
+        self._auth_header = {"Content-Type": "application/json"}
 
     def __response_hook(self, res, *args, **kwargs):
         # refresh token if expired
-        if res.status_code == 401:
-            token = self.refresh_token()
-            # update auth header
-            self._auth_header = {"Authorization": 'Bearer ' + token,
-                                 "Content-Type": "application/json"}
-            # reset header
-            res.request.headers['Authorization'] = 'Bearer ' + token
-            s = requests.Session()
-            # retry request
-            return self.requests_retry_session(session=s).send(res.request)
+        if res.status_code == 401 and res.request.url != self.OAUTH_LOGIN_URL:
+            token = self._token_manager.refresh(stale_token=self._get_request_token(res.request))
+            retry_request = res.request.copy()
+            retry_request.headers['Authorization'] = 'Bearer ' + token
+            # retry request once
+            retry_request.hooks = default_hooks()
+            retry_request.register_hook('response', self.metrics.record_response)
+            return self._session.send(retry_request)
 
     def refresh_token(self):
+        """
+        Forces the access token refresh.
+
+        :return: new access token
+        """
+        return self._token_manager.refresh()
+
+    def _fetch_token(self):
         data = {"client_id": self.__client_id,
                 "client_secret": self.__clien_secret,
                 "refresh_token": self.__refresh_token,
                 "grant_type": "refresh_token",
                 "scope": self.__scope}
-        r = requests.post(url=self.OAUTH_LOGIN_URL, data=data)
+        r = self._session.post(url=self.OAUTH_LOGIN_URL, data=data)
         parsed = self._parse_response(r, 'login')
-        return parsed['access_token']
+        # refresh tokens may be rotated
+        self.__refresh_token = parsed.get('refresh_token') or self.__refresh_token
+        return parsed
+
+    @staticmethod
+    def _get_request_token(request):
+        return request.headers.get('Authorization', '')[len('Bearer '):] or None
 
-    def requests_retry_session(self, session=None):
+    def requests_retry_session(self, session=None, pool_size=10):
         session = session or requests.Session()
         retry = Retry(
             total=self.max_retries,
@@ -86,25 +116,54 @@ class Client(HttpClientBase):
             connect=self.max_retries,
             backoff_factor=self.backoff_factor,
             status_forcelist=self.status_forcelist,
-            method_whitelist=('GET', 'POST', 'PATCH', 'UPDATE', 'DELETE')
+            # POST is not idempotent, a re-sent $batch may create the items twice. The failed batches are
+            # split or retried by the BatchDispatcher instead.
+            method_whitelist=('GET', 'PATCH', 'UPDATE', 'DELETE')
         )
-        adapter = HTTPAdapter(max_retries=retry)
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_size)
         session.mount('http://', adapter)
         session.mount('https://', adapter)
-        # append response hook
+        # append response hooks
+        session.hooks['response'].append(self.metrics.record_response)
         session.hooks['response'].append(self.__response_hook)
         return session
 
     def create_list(self, site_id, lst_object: SharepointList):
+        """
+
+        :param site_id:
+        :param lst_object: SharepointList or the list definition dict
+        :return: created list object
+        """
         endpoint = f'/sites/{site_id}/lists'
         url = self.base_url + endpoint
-        data = asdict(lst_object)
+        data = asdict(lst_object) if is_dataclass(lst_object) else lst_object
         return self._parse_response(self.post_raw(url=url, json=data), 'create list')
 
-    def _get_paged_result_pages(self, endpoint, parameters):
+    def update_list(self, site_id, list_id, properties):
+        """
+
+        :param site_id:
+        :param list_id:
+        :param properties: list properties to update, e.g. {'displayName': 'New name'}
+        :return: updated list object
+        """
+        endpoint = f'/sites/{site_id}/lists/{list_id}'
+        url = self.base_url + endpoint
+        return self._parse_response(self._patch_raw(url=url, json=properties), 'update list')
+
+    def delete_list(self, site_id, list_id):
+        """
+        Deletes the list including all its items.
+        """
+        endpoint = f'/sites/{site_id}/lists/{list_id}'
+        url = self.base_url + endpoint
+        return self._parse_response(self._delete_raw(url), 'delete list')
+
+    def _get_paged_result_pages(self, endpoint, parameters, url=None):
 
         has_more = True
-        next_url = self.base_url + endpoint
+        next_url = url or self.base_url + endpoint
         while has_more:
 
             resp = self.get_raw(next_url, params=parameters)
@@ -113,17 +172,50 @@ class Client(HttpClientBase):
             if req_response.get('@odata.nextLink'):
                 has_more = True
                 next_url = req_response['@odata.nextLink']
+                # next link already contains all query options
+                parameters = None
             else:
                 has_more = False
 
             yield req_response
 
+    def get_raw(self, *args, **kwargs):
+        return self._request_raw('GET', *args, **kwargs)
+
+    def post_raw(self, *args, **kwargs):
+        return self._request_raw('POST', *args, **kwargs)
+
+    def _send_throttled(self, send, *args, **kwargs):
+        """
+        Sends the request once the rate controller allows it, throttled requests are re-sent after the Retry-After
+        period.
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            with self._rate_controller.slot():
+                r = send(*args, **kwargs)
+            if r.status_code not in THROTTLE_STATUSES:
+                self._rate_controller.on_success()
+                return r
+            if attempt < self.MAX_RETRIES:
+                self.metrics.record_retries('throttled_request')
+                self._rate_controller.on_throttled(parse_retry_after(r.headers.get('Retry-After')))
+        return r
+
     def _delete_raw(self, *args, **kwargs):
-        s = requests.Session()
-        headers = kwargs.pop('headers', {})
+        return self._request_raw('DELETE', *args, **kwargs)
+
+    def _patch_raw(self, *args, **kwargs):
+        return self._request_raw('PATCH', *args, **kwargs)
+
+    def _request_raw(self, method, *args, **kwargs):
+        """
+        Sends the request through the shared pooled session. The headers are set per request, so the session
+        is safely shared by the concurrent requests.
+        """
+        headers = kwargs.pop('headers', None) or {}
         headers.update(self._auth_header)
-        s.headers.update(headers)
-        s.auth = self._auth
+        kwargs['headers'] = headers
+        kwargs.setdefault('auth', self._auth)
 
         # set default params
         params = kwargs.pop('params', {})
@@ -140,18 +232,69 @@ class Client(HttpClientBase):
 
             kwargs.update({'params': params})
 
-        r = self.requests_retry_session(session=s).request('DELETE', *args, **kwargs)
-        return r
+        return self._send_throttled(self._send_authorized, method, *args, **kwargs)
 
-    def make_batch_request(self, batch_requests: List[dict], r_type=''):
+    def _send_authorized(self, method, *args, **kwargs):
+        # the token may be refreshed while a throttled request waits, set it on each attempt
+        kwargs['headers']['Authorization'] = 'Bearer ' + self._token_manager.get_token()
+        return self._session.request(method, *args, **kwargs)
+
+    def make_batch_request(self, batch_requests: List[dict], r_type='', all_responses=False):
+        """
+
+        :param batch_requests: list of batch requests
+        :param r_type: request type description used in error messages
+        :param all_responses: return all sub-responses, otherwise only the failed ones are returned
+        :return: list of sub-responses
+        """
         endpoint = '$batch'
         rq_url = self.base_url + endpoint
 
-        data = {"requests": batch_requests}
-
-        resp = self.post_raw(rq_url, json=data)
-        r = self._parse_response(resp, f'batch: {r_type}')
-        return self._get_failed_batch_resp(r)
+        responses = dict()
+        pending = batch_requests
+        auth_retried = False
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.metrics.record_batch(len(pending))
+            resp = self.post_raw(rq_url, data=self._encode_batch(pending))
+            r = self._parse_response(resp, f'batch: {r_type}', decode=parse_batch_response)
+
+            throttled = []
+            unauthorized = []
+            for sub_response in r['responses']:
+                responses[str(sub_response['id'])] = sub_response
+                if sub_response['status'] in THROTTLE_STATUSES:
+                    throttled.append(sub_response)
+                elif sub_response['status'] == 401 and not auth_retried:
+                    unauthorized.append(sub_response)
+            if (not throttled and not unauthorized) or attempt == self.MAX_RETRIES:
+                break
+
+            if unauthorized:
+                # the token expired while the batch was processed, re-send once with a new one
+                auth_retried = True
+                self.metrics.record_retries('unauthorized', len(unauthorized))
+                self._token_manager.refresh(stale_token=self._get_request_token(resp.request))
+            if throttled:
+                self.metrics.record_retries('throttled', len(throttled))
+                # re-send only the throttled sub-requests once the client may continue
+                retry_after = [parse_retry_after(t.get('headers', {}).get('Retry-After')) for t in throttled]
+                retry_after = [ra for ra in retry_after if ra is not None]
+                self._rate_controller.on_throttled(max(retry_after) if retry_after else None,
+                                                   partial=len(throttled) < len(pending))
+            retry_ids = set(str(t['id']) for t in throttled + unauthorized)
+            pending = [rq for rq in pending if get_request_id(rq) in retry_ids]
+
+        if all_responses:
+            return list(responses.values())
+        return self._get_failed_batch_resp({'responses': responses.values()})
+
+    @staticmethod
+    def _encode_batch(batch_requests):
+        """
+        Serializes the batch body, already encoded sub-requests are used as they are.
+        """
+        encoded = [rq.payload if isinstance(rq, EncodedBatchRequest) else codec.dumps(rq) for rq in batch_requests]
+        return b'{"requests":[' + b','.join(encoded) + b']}'
 
     def get_site_by_relative_url(self, hostname, site_path):
         """
@@ -178,13 +321,59 @@ class Client(HttpClientBase):
         :param list_name: unique list name (case sensitive)
         :return: list object
         """
-        lists = self.get_site_lists(site_id)
         # ms removes -
-        list_name = list_name.replace('-', '')
-        res_list = [ls for ls in lists if ls['name'] == list_name]
+        name = list_name.replace('-', '')
+        # the name usually matches the display name, look it up directly first. A list with the exact display name
+        # wins even if its url name differs, e.g. the list swapped in by the staging write keeps the url name it was
+        # created with while the replaced list may still have the url name.
+        try:
+            lists = self.find_site_lists(site_id, f"displayName eq '{self._escape(list_name)}'")
+            filtered = True
+        except (exceptions.BadRequest, exceptions.NotImplemented) as e:
+            logging.warning(f"The lists can't be filtered by the display name, all site lists are read. {e}")
+            lists = self.get_site_lists(site_id)
+            filtered = False
+        displayed = [ls for ls in lists if ls['displayName'] == list_name]
+        res_list = [ls for ls in displayed if ls['name'] == name] or displayed
+        if not res_list:
+            if filtered:
+                lists = self.get_site_lists(site_id)
+            res_list = [ls for ls in lists if ls['name'] == name]
 
         return res_list[0] if res_list else None
 
+    def find_site_lists(self, site_id, filter_expr):
+        """
+        Finds the site lists matching the filter.
+
+        :param site_id:
+        :param filter_expr: OData $filter expression, e.g. displayName eq 'My List'
+        :return: list of list objects
+        """
+        endpoint = f'/sites/{site_id}/lists'
+        lists = []
+        for ls in self._get_paged_result_pages(endpoint, {'$filter': filter_expr}):
+            lists.extend(ls['value'])
+        return lists
+
+    def get_site_list(self, site_id, list_id, select=None, expand=None):
+        """
+
+        :param site_id:
+        :param list_id:
+        :param select: list of properties to fetch, all are fetched if not specified
+        :param expand: relationship to include, e.g. columns
+        :return: list object
+        """
+        endpoint = f'/sites/{site_id}/lists/{list_id}'
+        url = self.base_url + endpoint
+        params = {}
+        if select:
+            params['$select'] = ','.join(select)
+        if expand:
+            params['$expand'] = expand
+        return self._parse_response(self.get_raw(url, params=params or None), 'list')
+
     def get_site_list_columns(self, site_id, list_id, include_system=False,
                               expand_par='columns(select=name, description, displayName)'):
         """
@@ -216,6 +405,73 @@ class Client(HttpClientBase):
         for r in self._get_paged_result_pages(endpoint, params):
             yield [f['fields'] for f in r['value']]
 
+    def get_list_item_properties(self, site_id, list_id, properties=('id',), page_size=ITEM_PAGE_SIZE):
+        """
+        Pages through the list items fetching only the selected item properties, not the item fields.
+        The pages are followed by the `$skiptoken` next links and streamed as they arrive.
+
+        :param site_id:
+        :param list_id:
+        :param properties: item properties to fetch, e.g. id, eTag, lastModifiedDateTime. The id is always fetched.
+        :param page_size: number of items per result page ($top)
+        :return: generator of item property dict lists, one per result page
+        """
+        endpoint = f'/sites/{site_id}/lists/{list_id}/items'
+        select = ['id'] + [p for p in properties if p != 'id']
+        params = {'$select': ','.join(select), '$top': page_size}
+        for r in self._get_paged_result_pages(endpoint, params):
+            yield r['value']
+
+    def get_list_item_ids(self, site_id, list_id, page_size=ITEM_PAGE_SIZE):
+        """
+        Pages through the list items fetching only the item ids.
+
+        :param site_id:
+        :param list_id:
+        :param page_size: number of items per result page ($top)
+        :return: generator of item id lists, one per result page
+        """
+        for page in self.get_list_item_properties(site_id, list_id, page_size=page_size):
+            yield [i['id'] for i in page]
+
+    def get_list_items(self, site_id, list_id, field_names=None, page_size=ITEM_PAGE_SIZE):
+        """
+        Pages through the list items including their fields.
+
+        :param site_id:
+        :param list_id:
+        :param field_names: names of the fields to fetch, all fields are fetched if not specified
+        :param page_size: number of items per result page ($top)
+        :return: generator of item lists, one per result page
+        """
+        endpoint = f'/sites/{site_id}/lists/{list_id}/items'
+        expand = f'fields($select={",".join(field_names)})' if field_names else 'fields'
+        params = {'$select': 'id', '$expand': expand, '$top': page_size}
+        for r in self._get_paged_result_pages(endpoint, params):
+            yield r['value']
+
+    def get_list_items_delta(self, site_id, list_id, field_names=None, delta_link=None):
+        """
+        Pages through the list items changed since the delta link was issued, all items if no link is specified.
+        Deleted items contain only the id and the `deleted` facet.
+
+        :param site_id:
+        :param list_id:
+        :param field_names: names of the fields to fetch, all fields are fetched if not specified. Ignored with
+        the delta link, it keeps the options of the initial request.
+        :param delta_link: `@odata.deltaLink` returned by the previous delta query
+        :return: generator of (item list, delta link) tuples, one per result page. The delta link for the next query
+        is returned with the last page only.
+        """
+        endpoint = f'/sites/{site_id}/lists/{list_id}/items/delta'
+        if delta_link:
+            pages = self._get_paged_result_pages(endpoint, None, url=delta_link)
+        else:
+            expand = f'fields($select={",".join(field_names)})' if field_names else 'fields'
+            pages = self._get_paged_result_pages(endpoint, {'$expand': expand})
+        for r in pages:
+            yield r['value'], r.get('@odata.deltaLink')
+
     def delete_list_item(self, site_id, list_id, item_id):
         endpoint = f'/sites/{site_id}/lists/{list_id}/items/{item_id}'
         url = self.base_url + endpoint
@@ -223,39 +479,27 @@ class Client(HttpClientBase):
         self._parse_response(r, endpoint)
 
     def delete_list_items(self, site_id, list_id, item_ids, batch_limit=20):
+        """
+        Deletes items in batches, transient failures are re-batched and retried.
+
+        :param site_id:
+        :param list_id:
+        :param item_ids:
+        :param batch_limit:
+        :return: list of failed sub-responses, item ids are used as the request ids
+        """
+        batches = [[self.build_delete_list_item_batch_request(str(item_id), site_id, list_id, item_id)
+                    for item_id in item_ids[i:i + batch_limit]] for i in range(0, len(item_ids), batch_limit)]
 
-        batch = []
         failed = []
-        batch_index = 0
-        for ri, item_id in enumerate(item_ids):
-            endpoint = f'/sites/{site_id}/lists/{list_id}/items/{item_id}'
-            batch.append(asdict(BatchRequest(str(ri), endpoint, 'DELETE')))
-            batch_index += 1
-            if batch_index >= batch_limit:
-                batch_index = 0
-                f = self.make_batch_request(batch, 'Delete items')
-                failed.extend(f)
-                batch.clear()
-            # last batch
-        if batch:
-            f = self.make_batch_request(batch, 'Delete items')
-            failed.extend(f)
-
-        # retry failed one by one. Retry strategy applied
-        if failed:
-            logging.info(f'Some requests failed ({failed}), retrying. ')
-
-        failed_idx = []
-
-        for fid, f in enumerate(failed):
-            try:
-                self.delete_list_item(site_id, list_id, item_ids[int(f['id'])])
-            except exceptions.NotFound:
-                logging.warning(f'Item {item_ids[int(f["id"])]} already deleted.')
-
-            failed_idx.append(fid)
-
-        return [f for i, f in enumerate(failed) if i not in failed_idx]
+        dispatcher = BatchDispatcher(self, max_in_flight=1, batch_limit=batch_limit)
+        for batch, f in dispatcher.dispatch(batches, 'Delete items'):
+            for r in f:
+                if r['status'] == 404:
+                    logging.warning(f'Item {r["id"]} already deleted.')
+                else:
+                    failed.append(r)
+        return failed
 
     def create_list_item(self, site_id, list_id, fields):
         """
@@ -272,6 +516,36 @@ class Client(HttpClientBase):
         rs = self.post_raw(url=url, json=data)
         return self._parse_response(rs, 'create list item')
 
+    def update_list_item(self, site_id, list_id, item_id, fields):
+        """
+
+        :param site_id:
+        :param list_id:
+        :param item_id:
+        :param fields: Dictionary with fields to update. {key: value}
+        :return:
+        """
+        endpoint = f'/sites/{site_id}/lists/{list_id}/items/{item_id}/fields'
+
+        url = self.base_url + endpoint
+        rs = self._patch_raw(url=url, json=fields)
+        return self._parse_response(rs, 'update list item')
+
+    def build_update_list_item_batch_request(self, rq_id, site_id, list_id, item_id, fields):
+        """
+
+        :param site_id:
+        :param list_id:
+        :param item_id:
+        :param fields: Dictionary with fields to update. {key: value}
+        :return:
+        """
+        endpoint = f'/sites/{site_id}/lists/{list_id}/items/{item_id}/fields'
+
+        headers = {'Content-Type': 'application/json'}
+
+        return asdict(BatchRequest(rq_id, endpoint, 'PATCH', fields, headers))
+
     def build_create_list_item_batch_request(self, rq_id, site_id, list_id, fields):
         """
 
@@ -287,60 +561,42 @@ class Client(HttpClientBase):
 
         return asdict(BatchRequest(rq_id, endpoint, 'POST', data, headers))
 
-    def _parse_response(self, response, endpoint):
+    def encode_create_list_item_batch_request(self, rq_id, site_id, list_id, fields):
+        """
+        Builds the create item batch sub-request serialized directly into JSON bytes.
+
+        :param rq_id:
+        :param site_id:
+        :param list_id:
+        :param fields: Dictionary with fields. {key: value}
+        :return: EncodedBatchRequest
+        """
+        return with_request_id(rq_id, encode_create_item_request(site_id, list_id, fields))
+
+    def build_delete_list_item_batch_request(self, rq_id, site_id, list_id, item_id):
+        endpoint = f'/sites/{site_id}/lists/{list_id}/items/{item_id}'
+        return asdict(BatchRequest(rq_id, endpoint, 'DELETE'))
+
+    def _parse_response(self, response, endpoint, decode=codec.loads):
+        """
+        :param decode: decoder of the JSON body
+        :return: decoded body of the successful response
+        :raises BaseError: the error matching the response status
+        """
         status_code = response.status_code
-        if 'application/json' in response.headers['Content-Type']:
-            r = response.json()
+        if 'application/json' in response.headers.get('Content-Type', '') and response.content:
+            r = decode(response.content)
         else:
             r = response.text
         if status_code in (200, 201, 202):
             return r
         elif status_code == 204:
             return None
-        elif status_code == 400:
-            raise exceptions.BadRequest(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 401:
-            raise exceptions.Unauthorized(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 403:
-            raise exceptions.Forbidden(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 404:
-            raise exceptions.NotFound(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 405:
-            raise exceptions.MethodNotAllowed(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 406:
-            raise exceptions.NotAcceptable(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 409:
-            raise exceptions.Conflict(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 410:
-            raise exceptions.Gone(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 411:
-            raise exceptions.LengthRequired(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 412:
-            raise exceptions.PreconditionFailed(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 413:
-            raise exceptions.RequestEntityTooLarge(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 415:
-            raise exceptions.UnsupportedMediaType(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 416:
-            raise exceptions.RequestedRangeNotSatisfiable(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 422:
-            raise exceptions.UnprocessableEntity(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 429:
-            raise exceptions.TooManyRequests(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 500:
-            raise exceptions.InternalServerError(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 501:
-            raise exceptions.NotImplemented(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 503:
-            raise exceptions.ServiceUnavailable(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 504:
-            raise exceptions.GatewayTimeout(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 507:
-            raise exceptions.InsufficientStorage(f'Calling endpoint {endpoint} failed', r)
-        elif status_code == 509:
-            raise exceptions.BandwidthLimitExceeded(f'Calling endpoint {endpoint} failed', r)
-        else:
-            raise exceptions.UnknownError(f'Calling endpoint {endpoint} failed', r)
+        if not isinstance(r, dict):
+            # e.g. an HTML error page of a gateway
+            r = {'error': {'code': str(status_code), 'message': response.text}}
+        error = exceptions.STATUS_ERRORS.get(status_code, exceptions.UnknownError)
+        raise error(f'Calling endpoint {endpoint} failed', r)
 
     def _get_failed_batch_resp(self, response):
         failed = []
@@ -349,6 +605,11 @@ class Client(HttpClientBase):
                 failed.append(r)
         return failed
 
+    @staticmethod
+    def _escape(value):
+        # OData string literal
+        return value.replace("'", "''")
+
     def _dedupe_header(self, columns):
         col_keys = dict()
         dup_headers = set()
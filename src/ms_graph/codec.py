@@ -0,0 +1,31 @@
+'''
+JSON serialization of the request and response bodies. Uses orjson when it is installed, the standard json module
+otherwise. Both produce compact UTF-8 JSON without escaping the non-ASCII characters.
+
+'''
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson else 'json'
+
+
+# json.dumps creates a new encoder for each call with non-default options
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def _json_dumps(obj):
+    return _JSON_ENCODER.encode(obj).encode('utf-8')
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+# dumps(obj) -> JSON bytes
+dumps = _orjson_dumps if orjson else _json_dumps
+# loads(JSON bytes or str) -> object
+loads = orjson.loads if orjson else json.loads
@@ -62,3 +62,50 @@ def get_col_def_name(type):
         return 'dateTime'
     else:
         return type
+
+
+# column properties that can be set when the column is created
+WRITABLE_COLUMN_PROPERTIES = ('name', 'displayName', 'description', 'columnGroup', 'enforceUniqueValues', 'hidden',
+                              'indexed', 'required')
+# column type facets, exactly one is set on each column
+COLUMN_TYPES = ('boolean', 'calculated', 'choice', 'currency', 'dateTime', 'geolocation', 'hyperlinkOrPicture',
+                'lookup', 'number', 'personOrGroup', 'term', 'text', 'thumbnail')
+# columns created by the list template
+TEMPLATE_COLUMNS = ('Title',)
+
+
+def get_list_definition(sh_list, system_columns=()):
+    """
+    Builds the definition of a new list with the same settings and columns as the existing list.
+
+    :param sh_list: list object including the columns
+    :param system_columns: names of the columns to skip
+    :return: list definition dict
+    """
+    info = sh_list.get('list') or {}
+    template = info.get('template', 'genericList')
+    if template != 'genericList':
+        raise ValueError(f'Only lists created from the genericList template can be recreated, '
+                         f'the list template is {template}.')
+
+    columns = []
+    for c in sh_list.get('columns', []):
+        name = c['name']
+        # the built-in columns are read only, except for the calculated columns
+        if c.get('readOnly') and 'calculated' not in c:
+            continue
+        if name in TEMPLATE_COLUMNS or name in system_columns or name.startswith('_'):
+            continue
+        types = [t for t in COLUMN_TYPES if c.get(t) is not None]
+        if not types:
+            raise ValueError(f'The type of the column "{name}" is not supported.')
+        col = {k: c[k] for k in WRITABLE_COLUMN_PROPERTIES if k in c}
+        col.update((t, c[t]) for t in types)
+        columns.append(col)
+
+    return {'displayName': sh_list['displayName'],
+            'description': sh_list.get('description', ''),
+            'columns': columns,
+            'list': {'template': template,
+                     'contentTypesEnabled': info.get('contentTypesEnabled', False),
+                     'hidden': info.get('hidden', False)}}
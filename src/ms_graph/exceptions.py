@@ -99,6 +99,10 @@ class NotImplemented(BaseError):
     pass
 
 
+class BadGateway(BaseError):
+    pass
+
+
 class ServiceUnavailable(BaseError):
     pass
 
@@ -113,3 +117,28 @@ class InsufficientStorage(BaseError):
 
 class BandwidthLimitExceeded(BaseError):
     pass
+
+
+# HTTP status -> error raised for the failed request, UnknownError for the other statuses
+STATUS_ERRORS = {400: BadRequest,
+                 401: Unauthorized,
+                 403: Forbidden,
+                 404: NotFound,
+                 405: MethodNotAllowed,
+                 406: NotAcceptable,
+                 409: Conflict,
+                 410: Gone,
+                 411: LengthRequired,
+                 412: PreconditionFailed,
+                 413: RequestEntityTooLarge,
+                 415: UnsupportedMediaType,
+                 416: RequestedRangeNotSatisfiable,
+                 422: UnprocessableEntity,
+                 429: TooManyRequests,
+                 500: InternalServerError,
+                 501: NotImplemented,
+                 502: BadGateway,
+                 503: ServiceUnavailable,
+                 504: GatewayTimeout,
+                 507: InsufficientStorage,
+                 509: BandwidthLimitExceeded}
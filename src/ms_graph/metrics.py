@@ -0,0 +1,201 @@
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+METRICS_PREFIX = 'sharepoint_writer'
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 15, 20)
+
+# path segments followed by an id
+_ID_SEGMENTS = ('sites', 'lists', 'items', 'columns')
+_API_VERSION = re.compile(r'^/(v1\.0|beta)')
+
+
+def get_endpoint_name(url):
+    """
+    Normalizes the request url into the endpoint template, e.g. /sites/{id}/lists/{id}/items.
+    """
+    path = _API_VERSION.sub('', urlsplit(url).path)
+    if path.endswith('/token'):
+        return 'token'
+    segments = [s for s in path.split('/') if s]
+    for i in range(1, len(segments)):
+        if segments[i - 1] in _ID_SEGMENTS:
+            segments[i] = '{id}'
+    return '/' + '/'.join(segments)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        :return: upper bound of the bucket containing the quantile, None when empty or above the last bucket
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return None
+
+    def cumulative_counts(self):
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': round(self.sum, 6),
+                'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99),
+                'buckets': {str(b): c for b, c in self.cumulative_counts()}}
+
+
+class RunMetrics:
+    """
+    Thread-safe collector of the run metrics: phase durations, requests by endpoint and status, latencies,
+    batch sizes, retries, throttling waits and transferred bytes.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.phases = OrderedDict()
+        self.requests = Counter()
+        self.latency = dict()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.retries = Counter()
+        self.throttle_events = 0
+        self.throttle_wait = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measures the duration of a run phase.
+        """
+        start = self._clock()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + self._clock() - start
+
+    def record_request(self, method, url, status, elapsed, sent=0, received=0):
+        endpoint = get_endpoint_name(url)
+        with self._lock:
+            self.requests[(method, endpoint, status)] += 1
+            self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def record_response(self, response, *args, **kwargs):
+        """
+        Records the requests response, usable as the requests response hook.
+        """
+        body = response.request.body
+        sent = len(body) if body else 0
+        length = response.headers.get('Content-Length')
+        received = int(length) if length and length.isdigit() else len(response.content or b'')
+        self.record_request(response.request.method, response.url, response.status_code,
+                            response.elapsed.total_seconds(), sent, received)
+
+    def record_batch(self, size):
+        with self._lock:
+            self.batch_sizes.observe(size)
+
+    def record_retries(self, reason, count=1):
+        with self._lock:
+            self.retries[reason] += count
+
+    def record_throttle(self):
+        with self._lock:
+            self.throttle_events += 1
+
+    def record_throttle_wait(self, seconds):
+        with self._lock:
+            self.throttle_wait += seconds
+
+    def to_dict(self):
+        with self._lock:
+            by_endpoint = dict()
+            for (method, endpoint, status), count in sorted(self.requests.items(), key=str):
+                statuses = by_endpoint.setdefault(f'{method} {endpoint}', {})
+                statuses[str(status)] = count
+            return {'phases': {k: round(v, 3) for k, v in self.phases.items()},
+                    'requests': {'total': sum(self.requests.values()),
+                                 'by_endpoint': by_endpoint},
+                    'latency_seconds': {k: h.to_dict() for k, h in sorted(self.latency.items())},
+                    'batches': {'count': self.batch_sizes.count,
+                                'items': int(self.batch_sizes.sum),
+                                'size': self.batch_sizes.to_dict()},
+                    'retries': dict(self.retries),
+                    'throttling': {'events': self.throttle_events,
+                                   'wait_seconds': round(self.throttle_wait, 3)},
+                    'bytes': {'sent': self.bytes_sent,
+                              'received': self.bytes_received}}
+
+    def to_openmetrics(self):
+        """
+        :return: metrics in the OpenMetrics text format
+        """
+        p = METRICS_PREFIX
+        lines = []
+        with self._lock:
+            lines += [f'# TYPE {p}_phase_duration_seconds gauge']
+            lines += [f'{p}_phase_duration_seconds{{phase="{k}"}} {v:.6f}' for k, v in self.phases.items()]
+
+            lines += [f'# TYPE {p}_requests counter']
+            lines += [f'{p}_requests_total{{method="{m}",endpoint="{e}",status="{s}"}} {c}'
+                      for (m, e, s), c in sorted(self.requests.items(), key=str)]
+
+            lines += [f'# TYPE {p}_request_duration_seconds histogram']
+            for endpoint, hist in sorted(self.latency.items()):
+                lines += self._histogram_lines(f'{p}_request_duration_seconds', hist, f'endpoint="{endpoint}"')
+
+            lines += [f'# TYPE {p}_batch_size histogram']
+            lines += self._histogram_lines(f'{p}_batch_size', self.batch_sizes)
+
+            lines += [f'# TYPE {p}_retries counter']
+            lines += [f'{p}_retries_total{{reason="{k}"}} {v}' for k, v in sorted(self.retries.items())]
+
+            lines += [f'# TYPE {p}_throttle_events counter',
+                      f'{p}_throttle_events_total {self.throttle_events}',
+                      f'# TYPE {p}_throttle_wait_seconds counter',
+                      f'{p}_throttle_wait_seconds_total {self.throttle_wait:.6f}',
+                      f'# TYPE {p}_bytes counter',
+                      f'{p}_bytes_total{{direction="sent"}} {self.bytes_sent}',
+                      f'{p}_bytes_total{{direction="received"}} {self.bytes_received}',
+                      '# EOF']
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _histogram_lines(name, hist, labels=''):
+        sep = ',' if labels else ''
+        lines = [f'{name}_bucket{{{labels}{sep}le="{b}"}} {c}' for b, c in hist.cumulative_counts()]
+        lines.append(f'{name}_count{{{labels}}} {hist.count}' if labels else f'{name}_count {hist.count}')
+        lines.append(f'{name}_sum{{{labels}}} {hist.sum:.6f}' if labels else f'{name}_sum {hist.sum:.6f}')
+        return lines
@@ -0,0 +1,57 @@
+'''
+Background prefetching of the linked result pages.
+
+'''
+import queue
+import threading
+
+# sentinel marking the end of the prefetched pages
+_END = object()
+
+
+def prefetch(iterable, depth=2):
+    """
+    Iterates the iterable in a background thread, keeping at most `depth` items ahead of the consumer.
+
+    The result pages are linked by the next links, so the next page can't be requested before the previous
+    one arrives. Prefetching lets the following requests run while the consumer processes the current page.
+
+    :param iterable: e.g. generator of result pages
+    :param depth: maximum number of items buffered ahead
+    :return: generator of the items in the original order
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((_END, e))
+            return
+        put((_END, None))
+
+    worker = threading.Thread(target=produce, name='prefetch', daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        stopped.set()
+        worker.join()
@@ -0,0 +1,71 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+from ms_graph.batch import BatchDispatcher, get_failure_details
+from ms_graph.paging import prefetch
+
+
+@dataclass
+class PurgeResult:
+    deleted: int = 0
+    elapsed: float = 0.0
+    failed: List[dict] = field(default_factory=list)
+
+    @property
+    def items_per_second(self):
+        return self.deleted / self.elapsed if self.elapsed else 0.0
+
+
+class ListPurger:
+    """
+    Deletes all items of a list. Only item ids are fetched, the next result pages are fetched in background while
+    the DELETE batches of the previous pages are being sent concurrently. Transient failures are re-batched and
+    retried by the dispatcher.
+    """
+
+    def __init__(self, client, max_in_flight=8, batch_limit=20, prefetch_pages=2, page_size=1000):
+        self.client = client
+        self.batch_limit = batch_limit
+        self.page_size = page_size
+        self.prefetch_pages = prefetch_pages
+        self._dispatcher = BatchDispatcher(client, max_in_flight=max_in_flight, batch_limit=batch_limit)
+
+    def purge(self, site_id, list_id) -> PurgeResult:
+        result = PurgeResult()
+        start = time.monotonic()
+
+        pages = self._prefetch(self.client.get_list_item_ids(site_id, list_id, page_size=self.page_size))
+        batches = self._build_delete_batches(site_id, list_id, pages, result)
+        for batch, failed in self._dispatcher.dispatch(batches, 'Delete items'):
+            for f in failed:
+                # item ids are used as the request ids
+                if f['status'] == 404:
+                    logging.warning(f'Item {f["id"]} already deleted.')
+                    continue
+                result.deleted -= 1
+                result.failed.append({'item_id': f['id'], **get_failure_details(f)})
+
+        result.elapsed = time.monotonic() - start
+        logging.info(f'Deleted {result.deleted} items in {result.elapsed:.1f}s '
+                     f'({result.items_per_second:.1f} items/s), {len(result.failed)} items could not be deleted.')
+        return result
+
+    def _build_delete_batches(self, site_id, list_id, pages, result):
+        batch = []
+        for page in pages:
+            for item_id in page:
+                batch.append(self.client.build_delete_list_item_batch_request(str(item_id), site_id, list_id,
+                                                                              item_id))
+                if len(batch) >= self.batch_limit:
+                    result.deleted += len(batch)
+                    yield batch
+                    batch = []
+        # last batch
+        if batch:
+            result.deleted += len(batch)
+            yield batch
+
+    def _prefetch(self, pages):
+        return prefetch(pages, self.prefetch_pages) if self.prefetch_pages else pages
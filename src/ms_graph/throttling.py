@@ -0,0 +1,129 @@
+import email.utils
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value):
+    """
+    Parses the Retry-After header value.
+
+    :param value: number of seconds or HTTP date
+    :return: number of seconds to wait or None if not specified or invalid
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateController:
+    """
+    Adaptive throttling shared by all requests of a client.
+
+    The number of concurrent requests and the request rate are controlled in AIMD fashion: each throttled response
+    halves the concurrency limit and doubles the minimal interval between request starts, each successful response
+    increases the limit by one per limit-worth of responses and shortens the interval by a constant step.
+    A $batch with only some of its sub-requests throttled lowers the concurrency, but not the request rate,
+    as the other sub-requests succeeded. When the API sends Retry-After, no new request is started by any thread
+    until it elapses.
+    """
+    BACKOFF_BASE = 0.5
+    MAX_BACKOFF = 60.0
+    MIN_INTERVAL = 0.01
+    INTERVAL_STEP = 0.005
+
+    def __init__(self, max_concurrency=16, metrics=None):
+        """
+
+        :param max_concurrency:
+        :param metrics: RunMetrics recording the throttling events and waits
+        """
+        if max_concurrency < 1:
+            raise ValueError(f'The number of concurrent requests must be at least 1, got {max_concurrency}.')
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        self._limit = float(max_concurrency)
+        self._interval = 0.0
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._next_start = 0.0
+        self._consecutive_throttles = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return max(1, int(self._limit))
+
+    @contextmanager
+    def slot(self):
+        """
+        Waits until a request may be started.
+        """
+        self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def on_success(self):
+        with self._condition:
+            self._consecutive_throttles = 0
+            if self._limit < self.max_concurrency:
+                self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+            self._interval = max(0.0, self._interval - self.INTERVAL_STEP)
+            self._condition.notify_all()
+
+    def on_throttled(self, retry_after=None, partial=False):
+        """
+        Registers throttled response.
+
+        :param retry_after: number of seconds the API asked to wait, exponential backoff is used if not specified
+        :param partial: only some of the $batch sub-requests were throttled, the request rate is kept
+        :return: number of seconds the new requests are delayed
+        """
+        with self._condition:
+            self._consecutive_throttles += 1
+            if retry_after is None:
+                retry_after = min(self.MAX_BACKOFF, self.BACKOFF_BASE * 2 ** (self._consecutive_throttles - 1))
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self._limit = max(1.0, self._limit / 2)
+            if not partial:
+                self._interval = max(self.MIN_INTERVAL, self._interval * 2)
+            if self.metrics:
+                self.metrics.record_throttle()
+            logging.info(f'Requests are being throttled, waiting {retry_after:.1f}s. '
+                         f'Lowering the number of concurrent requests to {self.limit}.')
+            return retry_after
+
+    def _acquire(self):
+        start = time.monotonic()
+        waited = False
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait_for = max(self._blocked_until, self._next_start) - now
+                if wait_for <= 0 and self._in_flight < self.limit:
+                    break
+                waited = True
+                self._condition.wait(timeout=wait_for if wait_for > 0 else None)
+            self._in_flight += 1
+            self._next_start = now + self._interval
+        if self.metrics and waited:
+            self.metrics.record_throttle_wait(now - start)
+
+    def _release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
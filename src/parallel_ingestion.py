@@ -0,0 +1,91 @@
+'''
+Parsing of the input table and serialization of the create item requests in a process pool.
+
+'''
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from ingestion import RANGE_SIZE
+from ms_graph.batch import encode_create_item_request, with_request_id
+
+# state of the worker process, set by the pool initializer
+_worker = dict()
+
+
+def _init_worker(table, plan, site_id, list_id):
+    _worker.update(table=table, plan=plan, site_id=site_id, list_id=list_id)
+
+
+def _encode_range(byte_range):
+    """
+    :return: list of the create item requests of the rows in the byte range, serialized without the ids
+    """
+    plan, site_id, list_id = _worker['plan'], _worker['site_id'], _worker['list_id']
+    return [encode_create_item_request(site_id, list_id, plan.to_fields(row))
+            for row in _worker['table'].read_range(*byte_range)]
+
+
+class ParallelRequestEncoder:
+    """
+    Builds the create item requests of the table rows in a pool of worker processes. The table files are split
+    into byte ranges of whole records, each worker parses a range and serializes the requests of its rows.
+    The requests are returned in the row order, with the row indexes as the request ids, and at most
+    `prefetch` ranges per worker are held in memory ahead of the consumer.
+    """
+
+    def __init__(self, table, plan, site_id, list_id, workers, range_size=RANGE_SIZE, prefetch=2):
+        """
+
+        :param table: TableReader
+        :param plan: ColumnPlan of the table
+        :param workers: number of worker processes
+        :param range_size: approximate size of a byte range
+        :param prefetch: number of ranges per worker parsed ahead
+        """
+        self.table = table
+        self.plan = plan
+        self.site_id = site_id
+        self.list_id = list_id
+        self.workers = workers
+        self.range_size = range_size
+        self.prefetch = prefetch
+
+    def get_ranges(self):
+        """
+        :return: list of the byte ranges, None if the table is compressed and can't be split
+        """
+        return self.table.byte_ranges(self.range_size)
+
+    def requests(self, ranges, start=0):
+        """
+
+        :param ranges: byte ranges returned by `get_ranges`
+        :param start: index of the first row to return
+        :return: generator of EncodedBatchRequest
+        """
+        logging.info(f'Parsing {len(ranges)} table ranges in {self.workers} processes.')
+        row = 0
+        # the workers are not forked, the dispatcher threads may hold locks at the time
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.table, self.plan, self.site_id, self.list_id)) as pool:
+            pending = deque()
+            ranges = iter(ranges)
+            try:
+                while True:
+                    while len(pending) < self.workers * self.prefetch:
+                        byte_range = next(ranges, None)
+                        if byte_range is None:
+                            break
+                        pending.append(pool.submit(_encode_range, byte_range))
+                    if not pending:
+                        return
+                    for encoded in pending.popleft().result():
+                        if row >= start:
+                            yield with_request_id(str(row), encoded)
+                        row += 1
+            finally:
+                for future in pending:
+                    future.cancel()
@@ -46,6 +46,9 @@ class ListDataResultWriter(ResultWriter):
         # custom user added col
         self.user_value_cols = [LIST_ID]
         self.table_def.columns.append(LIST_ID)
+        # (name, display name) pairs in the output column order, built once for all records
+        # the ID column is returned as id, because MS bullshit
+        self._renames = tuple(('id' if c['name'] == 'ID' else c['name'], c['displayName']) for c in column_mapping)
 
     def write(self, data, file_name=None, user_values=None, object_from_arrays=False, write_header=True):
         # flatten obj
@@ -54,17 +57,8 @@ class ListDataResultWriter(ResultWriter):
 
     def _change_col_names(self, data):
         """
-        replace name with display names inplace
+        Builds the output record keyed by the display names, in the output column order. The input is not modified.
         :param data:
         :return:
         """
-
-        for key in self.column_mapping:
-            if key['name'] == 'ID':
-                # because MS bullshit
-                key['name'] = 'id'
-
-            if data.get(key['name']):
-                data[key['displayName']] = data.pop(key['name'])
-
-        return data
+        return {display_name: data[name] for name, display_name in self._renames if name in data}
@@ -0,0 +1,101 @@
+'''
+Compact encoding of the row map (primary key -> SharePoint item id, content hash) stored in the component state.
+
+'''
+import base64
+import struct
+import sys
+import zlib
+from array import array
+
+STATE_VERSION = 1
+# version, number of rows, length of the compressed ids and keys block
+_HEADER = struct.Struct('<BII')
+HASH_SIZE = 8
+KEY_SEPARATOR = '\0'
+
+
+class RowMap:
+    """
+    Read-only row map decoded from the state. Item ids and hashes are kept in contiguous buffers and materialized
+    only on lookup, so decoding a large map creates just the key index.
+    """
+
+    def __init__(self, keys, ids: array, hashes: bytes):
+        self._index = dict(zip(keys, range(len(keys))))
+        self._ids = ids
+        self._hashes = hashes
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        if i is None:
+            return default
+        return self._entry(i)
+
+    def items(self):
+        for key, i in self._index.items():
+            yield key, self._entry(i)
+
+    def _entry(self, i):
+        return str(self._ids[i]), self._hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE]
+
+
+def encode_row_map(row_map) -> str:
+    """
+    Encodes the row map into a string. Item ids and keys are compressed, hashes are stored as they are
+    because they do not compress.
+
+    :param row_map: dict key -> (item_id, hash), where item_id is numeric string and hash has HASH_SIZE bytes
+    :return: base64 encoded string
+    """
+    keys = []
+    ids = array('I')
+    hashes = bytearray()
+    for key, (item_id, row_hash) in row_map.items():
+        keys.append(key)
+        ids.append(int(item_id))
+        hashes += row_hash
+
+    joined_keys = KEY_SEPARATOR.join(keys)
+    if joined_keys.count(KEY_SEPARATOR) != max(len(keys) - 1, 0):
+        raise ValueError('Primary key values must not contain the NUL character.')
+    if sys.byteorder != 'little':
+        ids.byteswap()
+
+    compressed = zlib.compress(ids.tobytes() + joined_keys.encode('utf-8'), 1)
+    data = b''.join([_HEADER.pack(STATE_VERSION, len(keys), len(compressed)), compressed, hashes])
+    return base64.b64encode(data).decode('ascii')
+
+
+def decode_row_map(encoded: str) -> RowMap:
+    """
+    Decodes the row map encoded with `encode_row_map`.
+
+    :param encoded:
+    :return: RowMap
+    """
+    data = base64.b64decode(encoded)
+    version, count, compressed_size = _HEADER.unpack_from(data)
+    if version != STATE_VERSION:
+        raise ValueError(f'Unsupported row state version {version}.')
+
+    offset = _HEADER.size
+    ids_and_keys = zlib.decompress(data[offset:offset + compressed_size])
+    hashes = data[offset + compressed_size:]
+
+    ids = array('I')
+    ids_size = count * ids.itemsize
+    ids.frombytes(ids_and_keys[:ids_size])
+    if sys.byteorder != 'little':
+        ids.byteswap()
+
+    keys = ids_and_keys[ids_size:].decode('utf-8').split(KEY_SEPARATOR) if count else []
+    if len(keys) != count or len(hashes) != count * HASH_SIZE:
+        raise ValueError('The row state is corrupted.')
+    return RowMap(keys, ids, hashes)
@@ -0,0 +1,258 @@
+'''
+Incremental synchronization of the input table with an existing list.
+
+'''
+import hashlib
+import logging
+from collections import namedtuple
+from dataclasses import dataclass, field
+from typing import List
+
+from column_plan import NORMALIZERS
+from ms_graph.batch import BatchDispatcher, get_failure_details
+
+OP_CREATE = 'POST'
+OP_UPDATE = 'PATCH'
+OP_DELETE = 'DELETE'
+
+SyncOperation = namedtuple('SyncOperation', ['method', 'item_id', 'fields', 'key', 'row_hash'])
+
+
+class RowHasher:
+    """
+    Computes content hash of a record restricted to the given columns, so the same row has the same hash
+    whether it comes from the input table or from the list. The number and date time values are normalized,
+    the list returns them in a different form than they are written.
+    """
+
+    def __init__(self, columns, column_types=None):
+        """
+
+        :param column_types: column name -> list column type, text if not specified
+        """
+        self.columns = sorted(columns)
+        self._normalizers = {c: NORMALIZERS.get(t) for c, t in (column_types or {}).items() if t in NORMALIZERS}
+        self._column_normalizers = [(c, self._normalizers.get(c)) for c in self.columns]
+
+    def normalize(self, column, value) -> str:
+        """
+        :return: the column value as a string comparable with the value read from the list
+        """
+        if value is None or value == '':
+            return ''
+        normalizer = self._normalizers.get(column)
+        return str(normalizer(value) if normalizer else value)
+
+    def hash(self, fields: dict) -> bytes:
+        values = []
+        for c, normalizer in self._column_normalizers:
+            value = fields.get(c)
+            if value is None or value == '':
+                values.append('')
+            else:
+                values.append(str(normalizer(value) if normalizer else value))
+        return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=8).digest()
+
+
+@dataclass
+class SyncResult:
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    failed: List[dict] = field(default_factory=list)
+    # key -> (item_id, hash) of all items in the list after the sync
+    row_map: dict = field(default_factory=dict)
+
+
+class IncrementalSync:
+    """
+    Diffs the input records against the existing list items by the primary key and sends only the create,
+    update and delete requests.
+    """
+
+    def __init__(self, client, site_id, list_id, key_field, columns, max_in_flight=4, batch_limit=20,
+                 column_types=None):
+        """
+
+        :param column_types: column name -> list column type, see RowHasher
+        """
+        self.client = client
+        self.site_id = site_id
+        self.list_id = list_id
+        self.key_field = key_field
+        self.hasher = RowHasher(columns, column_types)
+        self._dispatcher = BatchDispatcher(client, max_in_flight=max_in_flight, batch_limit=batch_limit)
+        self._sent_ops = 0
+
+    def load_existing(self):
+        """
+        Reads the current list items.
+
+        :return: dict key -> (item_id, content hash), list of item ids of duplicate or keyless items
+        """
+        existing = dict()
+        redundant = []
+        select = [self.key_field] + [c for c in self.hasher.columns if c != self.key_field]
+        for page in self.client.get_list_items(self.site_id, self.list_id, field_names=select):
+            for item in page:
+                fields = item.get('fields', {})
+                key = self.hasher.normalize(self.key_field, fields.get(self.key_field))
+                if key == '' or key in existing:
+                    redundant.append(item['id'])
+                    continue
+                existing[key] = (item['id'], self.hasher.hash(fields))
+        return existing, redundant
+
+    def sync(self, records, existing=None) -> SyncResult:
+        """
+
+        :param records: iterable of record fields dictionaries
+        :param existing: known row map (key -> (item_id, hash)) of the list, e.g. from the previous run.
+                         The list items are read if not specified.
+        :return: SyncResult
+        """
+        result = SyncResult()
+        redundant = []
+        if existing is None:
+            existing, redundant = self.load_existing()
+            logging.info(f'Found {len(existing)} existing items.')
+        else:
+            logging.info(f'Using {len(existing)} items known from the previous run.')
+
+        self._apply(self._diff(records, existing, redundant, result), result)
+        logging.info(f'Sync finished: {result.created} created, {result.updated} updated, '
+                     f'{result.deleted} deleted, {result.unchanged} unchanged.')
+        return result
+
+    def _apply(self, operations, result):
+        ops = dict()
+        recreate = []
+        self._send(self._build_requests(operations, ops), ops, result, recreate)
+        if recreate:
+            # the known items were removed from the list in the meantime
+            logging.warning(f'{len(recreate)} updated items no longer exist, creating new ones.')
+            self._send(self._build_requests(recreate, ops), ops, result)
+
+    def _send(self, requests, ops, result, recreate=None):
+        for batch, responses in self._dispatcher.dispatch_requests(requests, 'Sync items', all_responses=True):
+            for r in responses:
+                op = ops.pop(str(r['id']))
+                if r['status'] < 300:
+                    self._commit(op, r.get('body'), result)
+                elif r['status'] == 404 and op.method == OP_DELETE:
+                    logging.warning(f'Item {op.item_id} already deleted.')
+                    self._commit(op, None, result)
+                elif r['status'] == 404 and op.method == OP_UPDATE and recreate is not None:
+                    recreate.append(op._replace(method=OP_CREATE, item_id=None))
+                else:
+                    result.failed.append({'key': op.key, 'operation': op.method, 'item_id': op.item_id,
+                                          **get_failure_details(r)})
+
+    def _diff(self, records, existing, redundant, result):
+        seen = set()
+        for fields in records:
+            key = fields.get(self.key_field)
+            if key is None or key == '':
+                raise ValueError(f'The primary key column "{self.key_field}" contains an empty value.')
+            # converted values, e.g. numbers, are compared as the keys read from the list
+            key = self.hasher.normalize(self.key_field, key)
+            if key in seen:
+                raise ValueError(f'Duplicate primary key value "{key}" found in the source table.')
+            seen.add(key)
+
+            current = existing.get(key)
+            row_hash = self.hasher.hash(fields)
+            if not current:
+                yield SyncOperation(OP_CREATE, None, fields, key, row_hash)
+            elif current[1] != row_hash:
+                yield SyncOperation(OP_UPDATE, current[0], fields, key, row_hash)
+            else:
+                result.unchanged += 1
+                result.row_map[key] = current
+
+        for key, (item_id, _) in existing.items():
+            if key not in seen:
+                yield SyncOperation(OP_DELETE, item_id, None, key, None)
+        for item_id in redundant:
+            yield SyncOperation(OP_DELETE, item_id, None, None, None)
+
+    def _build_requests(self, ops, op_registry):
+        for op in ops:
+            # request ids must be unique within the dispatch
+            rq_id = str(self._sent_ops)
+            self._sent_ops += 1
+            op_registry[rq_id] = op
+            yield self._build_request(rq_id, op)
+
+    def _build_request(self, rq_id, op):
+        if op.method == OP_CREATE:
+            return self.client.build_create_list_item_batch_request(rq_id, self.site_id, self.list_id, op.fields)
+        elif op.method == OP_UPDATE:
+            return self.client.build_update_list_item_batch_request(rq_id, self.site_id, self.list_id, op.item_id,
+                                                                    op.fields)
+        else:
+            return self.client.build_delete_list_item_batch_request(rq_id, self.site_id, self.list_id,
+                                                                    op.item_id)
+
+    def _commit(self, op, body, result):
+        if op.method == OP_CREATE:
+            result.created += 1
+            result.row_map[op.key] = (str(body['id']), op.row_hash)
+        elif op.method == OP_UPDATE:
+            result.updated += 1
+            result.row_map[op.key] = (op.item_id, op.row_hash)
+        else:
+            result.deleted += 1
+
+
+class InPlaceReplace(IncrementalSync):
+    """
+    Replaces all list items by the input records, reusing the existing items. The records are written onto
+    the existing items by updates, only the surplus records are created and only the leftover items deleted.
+    When the table has about as many rows as the list has items, this takes half the requests of removing
+    all items and creating new ones.
+    """
+
+    def __init__(self, client, site_id, list_id, cleared_fields=(), max_in_flight=4, batch_limit=20):
+        """
+
+        :param cleared_fields: list fields the records don't set, cleared on the reused items
+        """
+        super().__init__(client, site_id, list_id, None, [], max_in_flight=max_in_flight, batch_limit=batch_limit)
+        self._cleared = dict.fromkeys(cleared_fields)
+
+    def replace(self, records) -> SyncResult:
+        """
+
+        :param records: iterable of record fields dictionaries
+        :return: SyncResult, the failed records are identified by their index in the `key`
+        """
+        result = SyncResult()
+        item_ids = [i for page in self.client.get_list_item_ids(self.site_id, self.list_id) for i in page]
+        logging.info(f'Found {len(item_ids)} existing items.')
+
+        self._apply(self._pair(records, item_ids), result)
+        logging.info(f'Replace finished: {result.updated} items reused, {result.created} created, '
+                     f'{result.deleted} deleted.')
+        return result
+
+    def _pair(self, records, item_ids):
+        item_ids = iter(item_ids)
+        for ri, fields in enumerate(records):
+            item_id = next(item_ids, None)
+            if item_id is None:
+                yield SyncOperation(OP_CREATE, None, fields, ri, None)
+            else:
+                yield SyncOperation(OP_UPDATE, item_id, {**self._cleared, **fields}, ri, None)
+        for item_id in item_ids:
+            yield SyncOperation(OP_DELETE, item_id, None, None, None)
+
+    def _commit(self, op, body, result):
+        # the row map is not kept, the items are not matched by any key
+        if op.method == OP_CREATE:
+            result.created += 1
+        elif op.method == OP_UPDATE:
+            result.updated += 1
+        else:
+            result.deleted += 1
@@ -0,0 +1,54 @@
+import threading
+import time
+import unittest
+
+from ms_graph.auth import TokenManager
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenManager(unittest.TestCase):
+
+    def setUp(self):
+        self.fetched = 0
+        self.clock = FakeClock()
+
+    def fetch_token(self):
+        time.sleep(0.01)
+        self.fetched += 1
+        return {'access_token': f'token{self.fetched}', 'expires_in': 3600}
+
+    def test_refreshes_before_expiration(self):
+        manager = TokenManager(self.fetch_token, refresh_margin=300, clock=self.clock)
+
+        self.assertEqual('token1', manager.get_token())
+        self.clock.now = 3299
+        self.assertEqual('token1', manager.get_token())
+        self.clock.now = 3300
+        self.assertEqual('token2', manager.get_token())
+
+    def test_concurrent_callers_share_refresh(self):
+        manager = TokenManager(self.fetch_token, clock=self.clock)
+        stale = manager.get_token()
+
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.refresh(stale_token=stale)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(2, self.fetched)
+        self.assertEqual(['token2'] * 8, tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+import heapq
+import json
+import random
+import time
+import unittest
+
+from ms_graph import exceptions
+from ms_graph.batch import BatchDispatcher, BatchPacker, EncodedBatchRequest, RetryPolicy, \
+    encode_create_item_request, get_request_id, parse_batch_response, with_request_id
+
+
+class FakeClient:
+
+    def __init__(self, failing_batches=()):
+        self.failing_batches = failing_batches
+
+    def make_batch_request(self, batch_requests, r_type='', all_responses=False):
+        time.sleep(random.random() / 100)
+        if batch_requests[0]['batch'] in self.failing_batches:
+            return [{'id': batch_requests[0]['id'], 'status': 400}]
+        return []
+
+
+class FlakyClient:
+
+    def __init__(self, failures_per_request, permanent_ids=()):
+        self.failures_per_request = failures_per_request
+        self.permanent_ids = permanent_ids
+        self.attempts = {}
+        self.batches = []
+
+    def make_batch_request(self, batch_requests, r_type='', all_responses=False):
+        self.batches.append(batch_requests)
+        responses = []
+        for rq in batch_requests:
+            self.attempts[rq['id']] = self.attempts.get(rq['id'], 0) + 1
+            if rq['id'] in self.permanent_ids:
+                responses.append({'id': rq['id'], 'status': 400})
+            elif self.attempts[rq['id']] <= self.failures_per_request:
+                responses.append({'id': rq['id'], 'status': 500})
+            elif all_responses:
+                responses.append({'id': rq['id'], 'status': 201})
+        return responses
+
+
+class SizeLimitedClient:
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.batches = []
+
+    def make_batch_request(self, batch_requests, r_type='', all_responses=False):
+        if len(batch_requests) > self.max_items:
+            raise exceptions.RequestEntityTooLarge('Calling endpoint $batch failed',
+                                                   {'error': {'code': 'RequestEntityTooLarge'}})
+        self.batches.append(batch_requests)
+        return [{'id': rq.id, 'status': 201} for rq in batch_requests]
+
+
+def encoded(rq_id, size):
+    return EncodedBatchRequest(rq_id, b'x' * size)
+
+
+class TestBatchPacker(unittest.TestCase):
+
+    def test_limits_items_and_bytes(self):
+        packer = BatchPacker(max_items=3, max_bytes=1000, min_bytes=100)
+        packer.target_bytes = 100
+        requests = [encoded('0', 40), encoded('1', 40), encoded('2', 40), encoded('3', 10), encoded('4', 10),
+                    encoded('5', 10), encoded('6', 10), encoded('7', 500), encoded('8', 10)]
+
+        batches = [[rq.id for rq in b] for b in packer.pack(requests)]
+
+        # oversized request is sent alone
+        self.assertEqual([['0', '1'], ['2', '3', '4'], ['5', '6'], ['7'], ['8']], batches)
+
+    def test_target_follows_throughput_and_rejections(self):
+        packer = BatchPacker(max_bytes=1000, min_bytes=100, target_latency=1.0, smoothing=1.0)
+
+        packer.observe(400, 0.5)
+        self.assertEqual(800, packer.target_bytes)
+        packer.observe(400, 10)
+        self.assertEqual(100, packer.target_bytes)
+        packer.observe(1000, 0.1)
+        self.assertEqual(1000, packer.target_bytes)
+
+        packer.on_too_large(600)
+        self.assertEqual(300, packer.target_bytes)
+        packer.observe(1000, 0.1)
+        self.assertEqual(300, packer.target_bytes)
+
+
+class TestBatchDispatcher(unittest.TestCase):
+
+    def test_results_keep_submission_order(self):
+        batches = [[{'id': str(i), 'batch': i}] for i in range(50)]
+        dispatcher = BatchDispatcher(FakeClient(), max_in_flight=8)
+        result = [b[0]['batch'] for b, f in dispatcher.dispatch(batches)]
+        self.assertEqual(list(range(50)), result)
+
+    def test_failed_responses_are_returned_with_batch(self):
+        batches = [[{'id': str(i), 'batch': i}] for i in range(3)]
+        dispatcher = BatchDispatcher(FakeClient(failing_batches=(1,)), max_in_flight=8)
+        failed = [f for b, f in dispatcher.dispatch(batches)]
+        self.assertEqual([[], [{'id': '1', 'status': 400, 'attempts': 1}], []], failed)
+
+    def test_transient_failures_are_rebatched(self):
+        client = FlakyClient(failures_per_request=1)
+        batches = [[{'id': str(b * 20 + i)} for i in range(20)] for b in range(3)]
+        dispatcher = BatchDispatcher(client, max_in_flight=2, retry_policy=RetryPolicy(backoff_base=0))
+
+        final = [r for b, responses in dispatcher.dispatch(batches, all_responses=True) for r in responses]
+
+        self.assertEqual(60, len(final))
+        self.assertTrue(all(r['status'] == 201 for r in final))
+        # each batch of retried requests is full
+        self.assertTrue(all(len(b) == 20 for b in client.batches))
+
+    def test_permanent_failures_and_attempts_limit(self):
+        client = FlakyClient(failures_per_request=10, permanent_ids=('0',))
+        dispatcher = BatchDispatcher(client, retry_policy=RetryPolicy(max_attempts=3, backoff_base=0.001))
+
+        final = [r for b, responses in dispatcher.dispatch([[{'id': '0'}, {'id': '1'}]]) for r in responses]
+
+        self.assertEqual([('0', 400, 1), ('1', 500, 3)], [(r['id'], r['status'], r['attempts']) for r in final])
+
+    def test_throttled_responses_are_not_retried(self):
+        client = FakeClient()
+        client.make_batch_request = lambda batch_requests, r_type='', all_responses=False: [
+            {'id': rq['id'], 'status': 429} for rq in batch_requests]
+        dispatcher = BatchDispatcher(client, retry_policy=RetryPolicy(backoff_base=0))
+
+        final = [r for b, responses in dispatcher.dispatch([[{'id': '0'}]]) for r in responses]
+
+        # the client re-sends the throttled sub-requests on its own
+        self.assertEqual([('0', 429, 1)], [(r['id'], r['status'], r['attempts']) for r in final])
+
+    def test_failed_batch_resends_only_idempotent_requests(self):
+        client = FakeClient()
+        sent = []
+
+        def make_batch_request(batch_requests, r_type='', all_responses=False):
+            sent.append([get_request_id(rq) for rq in batch_requests])
+            if len(sent) == 1:
+                raise exceptions.InternalServerError('Calling endpoint $batch failed', {'error': {'code': 'failed'}})
+            return [{'id': get_request_id(rq), 'status': 204} for rq in batch_requests]
+
+        client.make_batch_request = make_batch_request
+        batch = [{'id': '0', 'method': 'POST', 'url': '/items'}, encoded('1', 10),
+                 {'id': '2', 'method': 'DELETE', 'url': '/items/2'}]
+        dispatcher = BatchDispatcher(client, retry_policy=RetryPolicy(backoff_base=0))
+
+        final = [r for b, responses in dispatcher.dispatch([batch], all_responses=True) for r in responses]
+
+        self.assertEqual([('0', 500, 'outcomeUnknown'), ('1', 500, 'outcomeUnknown'), ('2', 204, None)],
+                         sorted((r['id'], r['status'], r.get('body', {}).get('error', {}).get('code'))
+                                for r in final))
+        self.assertEqual([['0', '1', '2'], ['2']], sent)
+
+    def test_retries_are_taken_by_backoff_end(self):
+        dispatcher = BatchDispatcher(FakeClient())
+        now = time.monotonic()
+        retry_queue = []
+        heapq.heappush(retry_queue, (now + 60, 0, {'id': 'late'}))
+        heapq.heappush(retry_queue, (now - 1, 1, {'id': 'due'}))
+
+        # the long backoff does not hold up the request already due
+        self.assertEqual([{'id': 'due'}], dispatcher._next_retry_batch(retry_queue, flush=True))
+        self.assertEqual([(now + 60, 0, {'id': 'late'})], retry_queue)
+
+    def test_too_large_batches_are_split(self):
+        client = SizeLimitedClient(max_items=5)
+        dispatcher = BatchDispatcher(client, max_in_flight=2)
+
+        final = [r for b, responses in dispatcher.dispatch_requests((encoded(str(i), 10) for i in range(40)),
+                                                                    all_responses=True) for r in responses]
+
+        self.assertEqual(sorted(str(i) for i in range(40)), sorted(r['id'] for r in final))
+        self.assertTrue(all(len(b) <= 5 for b in client.batches))
+
+    def test_single_too_large_request_fails(self):
+        dispatcher = BatchDispatcher(SizeLimitedClient(max_items=0))
+
+        final = [r for b, responses in dispatcher.dispatch_requests([encoded('0', 10)]) for r in responses]
+
+        self.assertEqual([('0', 413)], [(r['id'], r['status']) for r in final])
+
+    def test_invalid_concurrency(self):
+        with self.assertRaises(ValueError):
+            BatchDispatcher(FakeClient(), max_in_flight=0)
+
+
+class TestBatchEncoding(unittest.TestCase):
+
+    def test_encoded_create_request(self):
+        request = with_request_id('7', encode_create_item_request('site', 'list', {'Title': 'ěšč "x"', 'n': 1}))
+
+        self.assertEqual('7', request.id)
+        self.assertIn('ěšč'.encode('utf-8'), request.payload)
+        self.assertEqual({'id': '7', 'url': '/sites/site/lists/list/items', 'method': 'POST',
+                          'headers': {'Content-Type': 'application/json'},
+                          'body': {'fields': {'Title': 'ěšč "x"', 'n': 1}}}, json.loads(request.payload))
+
+    def test_parse_batch_response_keeps_used_members(self):
+        content = json.dumps({'responses': [
+            {'id': '1', 'status': 201, 'headers': {'Location': 'x'}, 'body': {'id': '15', 'fields': {'Title': 'a'}}},
+            {'id': '2', 'status': 429, 'headers': {'Retry-After': '3'}, 'body': {'error': {'code': 'throttled'}}},
+            {'id': '3', 'status': 204}]}).encode()
+
+        self.assertEqual({'responses': [{'id': '1', 'status': 201, 'body': {'id': '15'}},
+                                        {'id': '2', 'status': 429, 'headers': {'Retry-After': '3'},
+                                         'body': {'error': {'code': 'throttled'}}},
+                                        {'id': '3', 'status': 204}]},
+                         parse_batch_response(content))
+        self.assertEqual({'error': {'code': 'invalidRequest'}},
+                         parse_batch_response(b'{"error":{"code":"invalidRequest"}}'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+from checkpoint import WriteCheckpoint, get_table_fingerprint, merge_ranges
+from ingestion import TableReader
+
+
+class TestWriteCheckpoint(unittest.TestCase):
+
+    def test_offset_of_leading_committed_rows(self):
+        checkpoint = WriteCheckpoint('sig')
+        for row, item_id in ((1, 11), (0, 10), (3, 13), (4, 14)):
+            checkpoint.on_committed(row, item_id)
+
+        # row 2 is missing
+        self.assertEqual(2, checkpoint.offset)
+        self.assertEqual({10, 11}, checkpoint.committed_ids)
+
+        checkpoint.on_committed(2, '20')
+        self.assertEqual(5, checkpoint.offset)
+        self.assertEqual({'signature': 'sig', 'offset': 5, 'committed': [[10, 11], [13, 14], [20, 20]], 'ahead': []},
+                         checkpoint.to_dict())
+
+    def test_from_dict(self):
+        checkpoint = WriteCheckpoint.from_dict({'signature': 'sig', 'offset': 3, 'committed': [[1, 2], [5, 5]]})
+
+        checkpoint.on_committed(3, 6)
+
+        self.assertEqual(4, checkpoint.offset)
+        self.assertEqual({1, 2, 5, 6}, checkpoint.committed_ids)
+        self.assertEqual([[1, 2], [5, 6]], checkpoint.to_dict()['committed'])
+
+    def test_rows_committed_after_offset_are_kept(self):
+        checkpoint = WriteCheckpoint('sig')
+        for row, item_id in ((0, 10), (2, 12), (3, 13), (4, 14), (6, 20)):
+            checkpoint.on_committed(row, item_id)
+
+        data = checkpoint.to_dict()
+        self.assertEqual([[2, 4, 12], [6, 6, 20]], data['ahead'])
+
+        restored = WriteCheckpoint.from_dict(data)
+        self.assertEqual({2: 12, 3: 13, 4: 14, 6: 20}, restored.ahead)
+        restored.discard([6])
+        restored.on_committed(1, 21)
+        self.assertEqual(5, restored.offset)
+        self.assertEqual({10, 21, 12, 13, 14}, restored.committed_ids)
+        self.assertEqual({}, restored.ahead)
+
+    def test_from_dict_without_ahead_rows(self):
+        checkpoint = WriteCheckpoint.from_dict({'signature': 'sig', 'offset': 1, 'committed': [[1, 1]]})
+
+        self.assertEqual({}, checkpoint.ahead)
+
+    def test_merge_ranges(self):
+        self.assertEqual([[1, 5], [7, 7]], merge_ranges([[4, 5], [7, 7], [1, 1], [2, 3], [3, 4]]))
+
+    def test_table_fingerprint(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'test.csv')
+            with open(path, 'w') as f:
+                f.write('id,text\n1,a\n')
+            first = get_table_fingerprint(TableReader({'full_path': path}))
+            with open(path, 'a') as f:
+                f.write('2,b\n')
+
+            self.assertNotEqual(first, get_table_fingerprint(TableReader({'full_path': path})))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from ms_graph import exceptions
+from ms_graph.batch import BatchDispatcher, RetryPolicy
+from ms_graph.client import Client
+
+
+class GraphHandler(BaseHTTPRequestHandler):
+    """
+    Issues tokens and answers $batch requests with the statuses queued on the server, 201 once they run out.
+    The sub-request statuses are queued by the sub-request id, the statuses in `html_errors` are sent with
+    an HTML body.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.endswith('/token'):
+            return self._reply(200, {'access_token': 'token', 'expires_in': 3600})
+        requests = json.loads(body)['requests']
+        self.server.batches.append([rq['id'] for rq in requests])
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        if status in self.server.html_errors:
+            return self._send(status, 'text/html', f'<html><body>{status} Bad Gateway</body></html>'.encode())
+        if status != 200:
+            return self._reply(status, {'error': {'code': 'failed', 'message': f'Status {status}'}})
+        responses = []
+        for rq in requests:
+            item_statuses = self.server.item_statuses.get(rq['id'])
+            item_status = item_statuses.pop(0) if item_statuses else 201
+            responses.append({'id': rq['id'], 'status': item_status, 'headers': {'Retry-After': '0'},
+                              'body': {'id': rq['id']}})
+        self._reply(200, {'responses': responses})
+
+    def _reply(self, status, body):
+        self._send(status, 'application/json', json.dumps(body).encode('utf-8'))
+
+    def _send(self, status, content_type, payload):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), GraphHandler)
+        self.server.batches = []
+        self.server.statuses = []
+        self.server.item_statuses = dict()
+        self.server.html_errors = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{self.server.server_port}'
+
+        class LocalClient(Client):
+            OAUTH_LOGIN_URL = url + '/token'
+            BASE_URL = url + '/'
+
+        self.client = LocalClient('refresh', 'secret', 'client', 'scope')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def dispatch(self, requests):
+        dispatcher = BatchDispatcher(self.client, max_in_flight=1, retry_policy=RetryPolicy(backoff_base=0))
+        return [r for b, responses in dispatcher.dispatch([requests], 'Create items', all_responses=True)
+                for r in responses]
+
+    def test_batch_gateway_timeout_is_not_resent(self):
+        self.server.statuses = [504]
+        requests = [{'id': str(i), 'url': '/items', 'method': 'POST', 'body': {}} for i in range(4)]
+
+        responses = self.dispatch(requests)
+
+        # the timed out batch may have created the items
+        self.assertEqual([(str(i), 504, 'outcomeUnknown') for i in range(4)],
+                         sorted((r['id'], r['status'], r['body']['error']['code']) for r in responses))
+        self.assertEqual([['0', '1', '2', '3']], self.server.batches)
+
+    def test_batch_gateway_error_page_is_not_resent(self):
+        self.server.statuses = [502]
+        self.server.html_errors = {502}
+        requests = [{'id': str(i), 'url': '/items', 'method': 'POST', 'body': {}} for i in range(2)]
+
+        responses = self.dispatch(requests)
+
+        self.assertEqual([('0', 502, 'outcomeUnknown'), ('1', 502, 'outcomeUnknown')],
+                         sorted((r['id'], r['status'], r['body']['error']['code']) for r in responses))
+        self.assertEqual([['0', '1']], self.server.batches)
+
+    def test_batch_server_error_retries_idempotent_requests(self):
+        self.server.statuses = [500]
+        requests = [{'id': str(i), 'url': f'/items/{i}', 'method': 'DELETE'} for i in range(2)]
+
+        responses = self.dispatch(requests)
+
+        self.assertEqual([('0', 201), ('1', 201)], sorted((r['id'], r['status']) for r in responses))
+        self.assertEqual([['0', '1'], ['0', '1']], self.server.batches)
+
+    def test_throttled_sub_requests_are_retried_by_client_only(self):
+        self.client.MAX_RETRIES = 2
+        self.server.item_statuses = {'1': [429, 429], '2': [429, 429, 429]}
+        requests = [{'id': str(i), 'url': '/items', 'method': 'POST', 'body': {}} for i in range(3)]
+
+        responses = self.dispatch(requests)
+
+        self.assertEqual([('0', 201), ('1', 201), ('2', 429)], sorted((r['id'], r['status']) for r in responses))
+        # only the throttled sub-requests are re-sent, the dispatcher does not retry them once more
+        self.assertEqual([['0', '1', '2'], ['1', '2'], ['1', '2']], self.server.batches)
+
+    def test_non_json_error_body_raises_error(self):
+        self.server.statuses = [502]
+        self.server.html_errors = {502}
+        requests = [{'id': '0', 'url': '/items', 'method': 'POST', 'body': {}}]
+
+        with self.assertRaises(exceptions.BadGateway) as ctx:
+            self.client.make_batch_request(requests, 'Create items')
+        self.assertEqual('502', ctx.exception.error_obj['error']['code'])
+        self.assertIn('Bad Gateway', ctx.exception.error_obj['error']['message'])
+
+    def test_list_by_name_prefers_exact_display_name(self):
+        swapped = {'id': '2', 'name': 'Orders_staging_1', 'displayName': 'Orders'}
+        replaced = {'id': '1', 'name': 'Orders', 'displayName': 'Orders_old_1'}
+        lists = [replaced, swapped]
+        self.client.find_site_lists = lambda site_id, filter_expr: [ls for ls in lists
+                                                                     if f"'{ls['displayName']}'" in filter_expr]
+        self.client.get_site_lists = lambda site_id: lists
+
+        self.assertEqual(swapped, self.client.get_site_list_by_name('site', 'Orders'))
+        self.assertEqual(replaced, self.client.get_site_list_by_name('site', 'Orders_old_1'))
+
+    def test_list_by_name_falls_back_to_all_lists_when_filter_is_rejected(self):
+        lists = [{'id': '1', 'name': 'Other', 'displayName': 'Other'},
+                 {'id': '2', 'name': 'Orders', 'displayName': 'Orders'}]
+
+        def find_site_lists(site_id, filter_expr):
+            raise exceptions.BadRequest('Calling endpoint lists failed', {'error': {'code': 'invalidRequest'}})
+
+        self.client.find_site_lists = find_site_lists
+        self.client.get_site_lists = lambda site_id: lists
+
+        self.assertEqual(lists[1], self.client.get_site_list_by_name('site', 'Orders'))
+        self.assertIsNone(self.client.get_site_list_by_name('site', 'Missing'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import json
+import unittest
+
+from ms_graph import codec
+
+VALUES = {'text': 'ěšč "quoted"\n', 'number': 1.5, 'int': 2 ** 40, 'flag': True, 'empty': None, 'list': [1, 'a']}
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_round_trip(self):
+        encoded = codec.dumps(VALUES)
+
+        self.assertIsInstance(encoded, bytes)
+        self.assertIn('ěšč'.encode('utf-8'), encoded)
+        self.assertEqual(VALUES, codec.loads(encoded))
+        self.assertEqual(VALUES, json.loads(encoded))
+
+    @unittest.skipIf(codec.orjson is None, 'orjson is not installed')
+    def test_backends_are_interchangeable(self):
+        self.assertEqual(codec._json_dumps(VALUES), codec._orjson_dumps(VALUES))
+        self.assertEqual(codec._json_dumps({1: 'a'}), codec._orjson_dumps({1: 'a'}))
+
+
+if __name__ == "__main__":
+    unittest.main()
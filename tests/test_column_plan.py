@@ -0,0 +1,52 @@
+import unittest
+
+from column_plan import ColumnPlan, get_cleared_fields
+
+LIST_COLUMNS = [{'name': 'Title', 'text': {}},
+                {'name': 'amount', 'number': {}},
+                {'name': 'active', 'boolean': {}},
+                {'name': 'created', 'dateTime': {'format': 'dateTime'}},
+                {'name': 'note', 'text': {}}]
+
+
+class TestColumnPlan(unittest.TestCase):
+
+    def test_maps_title_and_drops_nonexistent(self):
+        plan = ColumnPlan(['id', 'note', 'extra'], LIST_COLUMNS, ['id', 'extra'], title_col_name='id')
+
+        self.assertEqual(['Title', 'note'], plan.field_names)
+        self.assertEqual('Title', plan.get_field_name('id'))
+        self.assertIsNone(plan.get_field_name('extra'))
+        self.assertEqual({'Title': '1', 'note': 'a'}, plan.to_fields(['1', 'a', 'x']))
+
+    def test_converts_to_column_types(self):
+        plan = ColumnPlan(['amount', 'active', 'created', 'note'], LIST_COLUMNS, [])
+
+        self.assertEqual({'amount': 10, 'active': True, 'created': '2020-01-31T10:00:00', 'note': '5'},
+                         plan.to_fields(['10.0', 'Yes', '2020-01-31 10:00:00', '5']))
+        self.assertEqual({'amount': 1.5, 'active': False, 'created': '2020-01-31', 'note': ''},
+                         plan.to_fields(['1.5', '0', '2020-01-31', '']))
+        self.assertEqual({'amount': None, 'active': None, 'created': None, 'note': ''},
+                         plan.to_fields(['', '', '', '']))
+
+    def test_invalid_value_is_kept(self):
+        plan = ColumnPlan(['amount'], LIST_COLUMNS, [])
+
+        self.assertEqual({'amount': 'n/a'}, plan.to_fields(['n/a']))
+        # non-finite numbers can't be serialized into JSON
+        self.assertEqual([{'amount': 'nan'}, {'amount': '-Infinity'}],
+                         [plan.to_fields(['nan']), plan.to_fields(['-Infinity'])])
+
+    def test_no_written_columns(self):
+        with self.assertRaises(ValueError):
+            ColumnPlan(['extra'], LIST_COLUMNS, ['extra'])
+
+    def test_cleared_fields(self):
+        columns = LIST_COLUMNS + [{'name': 'total', 'calculated': {}, 'readOnly': True},
+                                  {'name': 'owner', 'personOrGroup': {}},
+                                  {'name': 'code', 'text': {}, 'required': True}]
+        self.assertEqual(['active', 'created', 'note'], get_cleared_fields(columns, ['Title', 'amount']))
+
+
+if __name__ == "__main__":
+    unittest.main()
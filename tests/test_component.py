@@ -3,12 +3,210 @@ Created on 12. 11. 2018
 
 @author: esner
 '''
+import copy
+import csv
+import itertools
+import json
+import os
+import shutil
+import tempfile
 import unittest
+
 import mock
-import os
 from freezegun import freeze_time
 
 from component import Component
+from ms_graph import codec
+from ms_graph.batch import EncodedBatchRequest
+from ms_graph.client import Client
+from ms_graph.exceptions import BadRequest, NotFound
+from ms_graph.metrics import RunMetrics
+
+
+class FakeGraph:
+    """
+    In-memory Graph client holding the lists of a single site and their items.
+    """
+    ITEM_PAGE_SIZE = 2
+    SYSTEM_LIST_COLUMNS = Client.SYSTEM_LIST_COLUMNS
+
+    encode_create_list_item_batch_request = Client.encode_create_list_item_batch_request
+    build_create_list_item_batch_request = Client.build_create_list_item_batch_request
+    build_update_list_item_batch_request = Client.build_update_list_item_batch_request
+    build_delete_list_item_batch_request = Client.build_delete_list_item_batch_request
+
+    def __init__(self):
+        self.metrics = RunMetrics()
+        self.site = {'id': 'site'}
+        self.lists = dict()
+        self.items = dict()
+        # method name -> list of errors raised by the next calls, None lets the call pass
+        self.errors = dict()
+        self.calls = []
+        # rows of the create requests failing with 400
+        self.failing_rows = set()
+        self.created_rows = []
+        self.deleted_items = []
+        self._ids = itertools.count(1)
+
+    def add_list(self, name, columns, items=()):
+        list_id = f'list-{next(self._ids)}'
+        self.lists[list_id] = {'id': list_id, 'name': name, 'displayName': name, 'eTag': f'"{list_id},1"',
+                               'list': {'template': 'genericList'},
+                               'columns': [{'name': c, 'displayName': c, 'required': False, 'text': {}}
+                                           for c in columns]}
+        self.items[list_id] = dict()
+        for fields in items:
+            self.add_item(list_id, fields)
+        return list_id
+
+    def get_list_by_name(self, name):
+        return next((ls for ls in self.lists.values() if ls['displayName'] == name), None)
+
+    def _call(self, method, *args):
+        self.calls.append((method, *args))
+        errors = self.errors.get(method)
+        if errors:
+            error = errors.pop(0)
+            if error:
+                raise error
+
+    def add_item(self, list_id, fields):
+        item_id = str(next(self._ids))
+        self.items[list_id][item_id] = dict(fields)
+        return item_id
+
+    def _get_list(self, list_id):
+        if list_id not in self.lists:
+            raise NotFound('Calling endpoint list failed', {'error': {'code': 'itemNotFound'}})
+        return self.lists[list_id]
+
+    def get_site_by_relative_url(self, hostname, site_path):
+        return self.site
+
+    def get_site_list_by_name(self, site_id, list_name):
+        return copy.deepcopy(self.get_list_by_name(list_name))
+
+    def get_site_list(self, site_id, list_id, select=None, expand=None):
+        sh_list = copy.deepcopy(self._get_list(list_id))
+        if expand != 'columns':
+            sh_list.pop('columns')
+        return sh_list
+
+    def get_site_list_columns(self, site_id, list_id, include_system=False, expand_par=None):
+        self._call('get_site_list_columns', list_id)
+        return copy.deepcopy(self._get_list(list_id)['columns'])
+
+    def create_list(self, site_id, definition):
+        self._call('create_list', definition['displayName'])
+        # the generic list template adds the Title column
+        list_id = self.add_list(definition['displayName'], ['Title'])
+        self.lists[list_id]['columns'].extend({'required': False, **c} for c in definition['columns'])
+        return self.get_site_list(site_id, list_id)
+
+    def update_list(self, site_id, list_id, properties):
+        self._call('update_list', list_id, properties.get('displayName'))
+        self._get_list(list_id).update(properties)
+        return self.get_site_list(site_id, list_id)
+
+    def delete_list(self, site_id, list_id):
+        self._call('delete_list', list_id)
+        self._get_list(list_id)
+        del self.lists[list_id]
+
+    def get_list_item_ids(self, site_id, list_id, page_size=ITEM_PAGE_SIZE):
+        ids = list(self.items[list_id])
+        for i in range(0, len(ids), page_size):
+            yield ids[i:i + page_size]
+
+    def get_list_items(self, site_id, list_id, field_names=None, page_size=ITEM_PAGE_SIZE):
+        items = [{'id': item_id, 'fields': {'id': item_id, **fields}}
+                 for item_id, fields in self.items[list_id].items()]
+        for i in range(0, len(items), page_size):
+            yield items[i:i + page_size]
+
+    def get_list_items_delta(self, site_id, list_id, field_names=None, delta_link=None):
+        self._call('get_list_items_delta', delta_link)
+        pages = list(self.get_list_items(site_id, list_id, field_names))
+        for i, page in enumerate(pages):
+            yield page, f'delta-{len(self.calls)}' if i == len(pages) - 1 else None
+
+    def delete_list_items(self, site_id, list_id, item_ids, batch_limit=20):
+        for item_id in item_ids:
+            self.deleted_items.append(item_id)
+            del self.items[list_id][item_id]
+        return []
+
+    def make_batch_request(self, batch_requests, r_type='', all_responses=False):
+        self._call('make_batch_request')
+        responses = []
+        for rq in batch_requests:
+            if isinstance(rq, EncodedBatchRequest):
+                rq = codec.loads(rq.payload)
+            url = rq['url'].split('/')
+            list_id = url[4]
+            if rq['method'] == 'POST' and int(rq['id']) in self.failing_rows:
+                responses.append({'id': rq['id'], 'status': 400,
+                                  'body': {'error': {'code': 'invalidRequest', 'message': 'Invalid value'}}})
+            elif rq['method'] == 'POST':
+                self.created_rows.append(int(rq['id']))
+                item_id = self.add_item(list_id, rq['body']['fields'])
+                responses.append({'id': rq['id'], 'status': 201, 'body': {'id': item_id}})
+            elif rq['method'] == 'DELETE':
+                self.deleted_items.append(url[6])
+                del self.items[list_id][url[6]]
+                responses.append({'id': rq['id'], 'status': 204})
+            else:
+                self.items[list_id][url[6]].update(rq['body'])
+                responses.append({'id': rq['id'], 'status': 200})
+        if all_responses:
+            return responses
+        return [r for r in responses if r['status'] >= 300]
+
+
+class ComponentTestCase(unittest.TestCase):
+    """
+    Runs the component on a temporary data folder with the Graph client replaced by FakeGraph.
+    """
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        for folder in ('in/tables', 'out/tables', 'out/files'):
+            os.makedirs(os.path.join(self.data_dir, folder))
+        self.graph = FakeGraph()
+        self.tables = []
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def add_table(self, name, header, rows):
+        with open(os.path.join(self.data_dir, 'in', 'tables', name), 'w', newline='') as out_file:
+            writer = csv.writer(out_file)
+            writer.writerow(header)
+            writer.writerows(rows)
+        self.tables.append({'source': f'in.c-main.{name[:-4]}', 'destination': name})
+
+    def create_component(self, parameters, state=None):
+        config = {'parameters': {'base_host_name': 'tenant.sharepoint.com', 'site_url_rel_path': 'sites/test',
+                                 'write_concurrency': 1, **parameters},
+                  'storage': {'input': {'tables': self.tables}},
+                  'authorization': {'oauth_api': {'credentials': {'#data': json.dumps({'refresh_token': 'token'}),
+                                                                  'appKey': 'app', '#appSecret': 'secret'}}}}
+        with open(os.path.join(self.data_dir, 'config.json'), 'w') as out_file:
+            json.dump(config, out_file)
+        if state is not None:
+            with open(os.path.join(self.data_dir, 'in', 'state.json'), 'w') as out_file:
+                json.dump(state, out_file)
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': self.data_dir}), \
+                mock.patch('component.Client', return_value=self.graph):
+            return Component()
+
+    def get_out_state(self):
+        with open(os.path.join(self.data_dir, 'out', 'state.json')) as in_file:
+            return json.load(in_file)
+
+    def get_titles(self, list_name):
+        return sorted(f['Title'] for f in self.graph.items[self.graph.get_list_by_name(list_name)['id']].values())
 
 
 class TestComponent(unittest.TestCase):
@@ -23,6 +221,290 @@ class TestComponent(unittest.TestCase):
             comp.run()
 
 
+class TestRecreateList(ComponentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.list_id = self.graph.add_list('Orders', ['Title', 'amount'], [{'Title': 'old', 'amount': '1'}])
+        self.add_table('orders.csv', ['Title', 'amount'], [['a', '1'], ['b', '2']])
+        self.params = {'list_name': 'Orders', 'replace_strategy': 'recreate'}
+
+    @freeze_time("2010-10-10")
+    def test_list_is_replaced_by_checked_new_list(self):
+        self.create_component(self.params).run()
+
+        new_list = self.graph.get_list_by_name('Orders')
+        self.assertNotEqual(self.list_id, new_list['id'])
+        self.assertEqual(['Title', 'amount'], [c['name'] for c in new_list['columns']])
+        self.assertNotIn(self.list_id, self.graph.lists)
+        self.assertEqual(['a', 'b'], self.get_titles('Orders'))
+        methods = [c[0] for c in self.graph.calls if c[0] != 'make_batch_request']
+        self.assertEqual(['create_list', 'get_site_list_columns', 'update_list', 'update_list', 'delete_list'],
+                         methods[methods.index('create_list'):])
+        self.assertEqual(('create_list', 'Orders_recreated_20101010000000'), self.graph.calls[1])
+
+    def test_failed_create_keeps_the_list_and_purges_items(self):
+        self.graph.errors['create_list'] = [BadRequest('Calling endpoint create list failed',
+                                                       {'error': {'code': 'invalidRequest'}})]
+
+        self.create_component(self.params).run()
+
+        self.assertEqual(self.list_id, self.graph.get_list_by_name('Orders')['id'])
+        self.assertEqual(['a', 'b'], self.get_titles('Orders'))
+        self.assertEqual([], [c for c in self.graph.calls if c[0] == 'delete_list'])
+
+    def test_failed_rename_deletes_the_new_list_only(self):
+        self.graph.errors['update_list'] = [None, BadRequest('Calling endpoint update list failed',
+                                                             {'error': {'code': 'invalidRequest'}}), None]
+
+        self.create_component(self.params).run()
+
+        self.assertEqual(self.list_id, self.graph.get_list_by_name('Orders')['id'])
+        self.assertEqual([self.list_id], list(self.graph.lists))
+        self.assertEqual(['a', 'b'], self.get_titles('Orders'))
+
+    def test_new_list_with_missing_columns_is_discarded(self):
+        create_list = self.graph.create_list
+
+        def create_without_columns(site_id, definition):
+            return create_list(site_id, {**definition, 'columns': []})
+
+        self.graph.create_list = create_without_columns
+
+        self.create_component(self.params).run()
+
+        self.assertEqual([self.list_id], list(self.graph.lists))
+        self.assertEqual(['a', 'b'], self.get_titles('Orders'))
+
+
+class TestStagingList(ComponentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.list_id = self.graph.add_list('Orders', ['Title', 'amount'], [{'Title': 'old', 'amount': '0'}])
+        self.add_table('orders.csv', ['Title', 'amount'], [['a', '1'], ['b', '2']])
+        self.params = {'list_name': 'Orders', 'replace_strategy': 'staging'}
+
+    @freeze_time("2010-10-10")
+    def test_staging_list_replaces_the_list(self):
+        self.create_component(self.params).run()
+
+        staging = self.graph.get_list_by_name('Orders')
+        self.assertNotEqual(self.list_id, staging['id'])
+        self.assertEqual('Orders_staging_20101010000000', staging['name'])
+        self.assertEqual(['a', 'b'], self.get_titles('Orders'))
+        self.assertEqual([staging['id']], list(self.graph.lists))
+        self.assertEqual([(self.list_id, 'Orders_old_20101010000000'), (staging['id'], 'Orders')],
+                         [c[1:] for c in self.graph.calls if c[0] == 'update_list'][1:])
+
+    def test_failed_swap_restores_the_list_name(self):
+        error = BadRequest('Calling endpoint update list failed', {'error': {'code': 'invalidRequest'}})
+        self.graph.errors['update_list'] = [None, None, error, None]
+
+        with self.assertRaises(SystemExit):
+            self.create_component(self.params).run()
+
+        self.assertEqual(self.list_id, self.graph.get_list_by_name('Orders')['id'])
+        self.assertEqual(['old'], self.get_titles('Orders'))
+        # the staging list is deleted in background
+        self.assertEqual([self.list_id], list(self.graph.lists))
+        self.assertEqual(1, len([c for c in self.graph.calls if c[0] == 'delete_list']))
+
+    def test_failed_staging_write_keeps_the_list(self):
+        self.graph.failing_rows = {1}
+
+        with self.assertRaises(RuntimeError):
+            self.create_component(self.params).run()
+
+        self.assertEqual(self.list_id, self.graph.get_list_by_name('Orders')['id'])
+        self.assertEqual(['old'], self.get_titles('Orders'))
+        self.assertEqual([self.list_id], list(self.graph.lists))
+        self.assertEqual([], [c for c in self.graph.calls if c[0] == 'update_list' and c[1] == self.list_id])
+
+
+class TestWriteLists(ComponentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_table('orders.csv', ['Title', 'amount'], [['a', '1'], ['b', '2'], ['c', '3']])
+        self.add_table('items.csv', ['Title'], [['x']])
+        self.add_table('customers.csv', ['Title', 'amount'], [['p', '1'], ['q', '2']])
+        for name in ('Orders', 'Items', 'Customers'):
+            self.graph.add_list(name, ['Title', 'amount'], [{'Title': 'old'}])
+
+    def test_mappings_override_the_configuration(self):
+        comp = self.create_component({
+            'list_name': 'Default', 'replace_strategy': 'recreate', 'create_new': [{'title_column': {}}],
+            'tables': [{'table': 'orders.csv', 'list_name': 'Orders', 'replace_strategy': '', 'primary_key': None},
+                       {'table': 'in.c-main.items', 'list_name': 'Items', 'load_type': 'incremental',
+                        'primary_key': 'Title', 'write_concurrency': 4}]})
+
+        jobs = comp._get_write_jobs()
+
+        defaults = {'base_host_name': 'tenant.sharepoint.com', 'site_url_rel_path': 'sites/test',
+                    'write_concurrency': 1, 'replace_strategy': 'recreate'}
+        self.assertEqual([{**defaults, 'table': 'orders.csv', 'list_name': 'Orders'},
+                          {**defaults, 'table': 'in.c-main.items', 'list_name': 'Items', 'load_type': 'incremental',
+                           'primary_key': 'Title', 'write_concurrency': 4}],
+                         [job_params for job_params, table in jobs])
+        self.assertEqual(['orders.csv', 'items.csv'], [os.path.basename(table.path) for job_params, table in jobs])
+
+    def test_unknown_mapping_table_fails(self):
+        comp = self.create_component({'tables': [{'table': 'missing', 'list_name': 'Orders'}]})
+
+        with self.assertRaises(ValueError):
+            comp._get_write_jobs()
+
+    def test_tables_are_written_from_the_smallest(self):
+        comp = self.create_component({'table_concurrency': 1,
+                                      'tables': [{'table': 'orders.csv', 'list_name': 'Orders'},
+                                                 {'table': 'items.csv', 'list_name': 'Items'},
+                                                 {'table': 'customers.csv', 'list_name': 'Customers'}]})
+        written = []
+        comp._write_list = lambda job_params, table, name=None: written.append(name)
+
+        comp._write_lists(comp._get_write_jobs())
+
+        self.assertEqual(['Items', 'Customers', 'Orders'], written)
+
+    def test_failed_table_does_not_stop_the_others(self):
+        self.graph.failing_rows = {1}
+        comp = self.create_component({'tables': [{'table': 'orders.csv', 'list_name': 'Orders'},
+                                                 {'table': 'items.csv', 'list_name': 'Items'},
+                                                 {'table': 'customers.csv', 'list_name': 'Customers'}]})
+
+        with self.assertRaises(RuntimeError) as ctx:
+            comp.run()
+
+        self.assertRegex(str(ctx.exception), r'^2 of 3 tables failed')
+        self.assertNotIn('Items', str(ctx.exception))
+
+        self.assertEqual(['x'], self.get_titles('Items'))
+        self.assertTrue(os.path.isfile(os.path.join(self.data_dir, 'out', 'files', 'failed_records_Orders.json')))
+        self.assertTrue(os.path.isfile(os.path.join(self.data_dir, 'out', 'files', 'failed_records_Customers.json')))
+
+
+class TestResumeCheckpoint(ComponentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.list_id = self.graph.add_list('Orders', ['Title', 'amount'], [{'Title': 'old', 'amount': '0'}])
+        self.rows = [[t, str(i)] for i, t in enumerate('abcde')]
+        self.add_table('orders.csv', ['Title', 'amount'], self.rows)
+        self.params = {'list_name': 'Orders'}
+
+    def run_failed_write(self, failing_rows):
+        self.graph.failing_rows = set(failing_rows)
+        with self.assertRaises(RuntimeError):
+            self.create_component(self.params).run()
+        self.graph.failing_rows = set()
+        self.graph.created_rows = []
+        self.graph.deleted_items = []
+        return self.get_out_state()
+
+    def test_write_resumes_after_partial_run(self):
+        state = self.run_failed_write([3, 4])
+        self.assertEqual(3, state['write_checkpoints'][self.list_id]['offset'])
+        # created by a request whose response was lost
+        stray = self.graph.add_item(self.list_id, {'Title': 'x', 'amount': '3'})
+
+        self.create_component(self.params, state).run()
+
+        self.assertEqual([3, 4], self.graph.created_rows)
+        self.assertEqual([stray], self.graph.deleted_items)
+        self.assertEqual(list('abcde'), self.get_titles('Orders'))
+        self.assertEqual({}, self.get_out_state()['write_checkpoints'])
+
+    def test_changed_table_discards_checkpoint(self):
+        state = self.run_failed_write([3, 4])
+        with open(os.path.join(self.data_dir, 'in', 'tables', 'orders.csv'), 'a', newline='') as out_file:
+            csv.writer(out_file).writerow(['f', '5'])
+
+        self.create_component(self.params, state).run()
+
+        self.assertEqual([0, 1, 2, 3, 4, 5], self.graph.created_rows)
+        self.assertEqual(3, len(self.graph.deleted_items))
+        self.assertEqual(list('abcdef'), self.get_titles('Orders'))
+
+    def test_rows_committed_out_of_order_are_kept(self):
+        state = self.run_failed_write([1])
+        checkpoint = state['write_checkpoints'][self.list_id]
+        self.assertEqual(1, checkpoint['offset'])
+        kept = [item_id for item_id, fields in self.graph.items[self.list_id].items() if fields['Title'] in 'cde']
+        stray = self.graph.add_item(self.list_id, {'Title': 'x', 'amount': '1'})
+
+        self.create_component(self.params, state).run()
+
+        self.assertEqual([1], self.graph.created_rows)
+        self.assertEqual([stray], self.graph.deleted_items)
+        self.assertTrue(set(kept) <= set(self.graph.items[self.list_id]))
+        self.assertEqual(list('abcde'), self.get_titles('Orders'))
+
+    def test_missing_item_of_row_committed_out_of_order_is_written_again(self):
+        state = self.run_failed_write([1])
+        missing = next(item_id for item_id, fields in self.graph.items[self.list_id].items() if fields['Title'] == 'd')
+        del self.graph.items[self.list_id][missing]
+
+        self.create_component(self.params, state).run()
+
+        self.assertEqual([1, 3], self.graph.created_rows)
+        self.assertEqual([], self.graph.deleted_items)
+        self.assertEqual(list('abcde'), self.get_titles('Orders'))
+
+
+class TestExtract(ComponentTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.list_id = self.graph.add_list('Orders', ['Title', 'amount'],
+                                           [{'Title': 'a', 'amount': '1'}, {'Title': 'b', 'amount': '2'}])
+        self.params = {'list_name': 'Orders', 'mode': 'extract'}
+
+    def read_output(self, name):
+        path = os.path.join(self.data_dir, 'out', 'tables', name)
+        with open(path, newline='') as in_file:
+            rows = list(csv.reader(in_file))
+        with open(path + '.manifest') as in_file:
+            return rows, json.load(in_file)
+
+    def test_extract_writes_table_and_manifest(self):
+        self.create_component(self.params).run()
+
+        rows, manifest = self.read_output('Orders_data.csv')
+        self.assertEqual([['id', 'Title', 'amount', 'list_id'], ['2', 'a', '1', self.list_id],
+                          ['3', 'b', '2', self.list_id]], rows)
+        self.assertEqual(['id', 'list_id'], manifest['primary_key'])
+        self.assertFalse(manifest['incremental'])
+        self.assertNotIn('delta', self.get_out_state())
+
+    def test_delta_link_is_stored_and_used_by_next_run(self):
+        params = {**self.params, 'delta_extract': True}
+        self.create_component(params).run()
+        state = self.get_out_state()
+        delta_link = state['delta']['delta_link']
+        self.assertIsNotNone(delta_link)
+
+        self.create_component(params, state).run()
+
+        self.assertEqual([None, delta_link], [c[1] for c in self.graph.calls if c[0] == 'get_list_items_delta'])
+        rows, manifest = self.read_output('Orders_data.csv')
+        self.assertTrue(manifest['incremental'])
+        self.assertNotEqual(delta_link, self.get_out_state()['delta']['delta_link'])
+
+    def test_delta_link_is_dropped_when_columns_change(self):
+        params = {**self.params, 'delta_extract': True}
+        self.create_component(params).run()
+        state = self.get_out_state()
+
+        self.create_component({**params, 'extract_columns': ['Title']}, state).run()
+
+        self.assertEqual([None, None], [c[1] for c in self.graph.calls if c[0] == 'get_list_items_delta'])
+        rows, manifest = self.read_output('Orders_data.csv')
+        self.assertEqual(['id', 'Title', 'is_deleted', 'list_id'], rows[0])
+        self.assertFalse(manifest['incremental'])
+        self.assertEqual(['id', 'Title', 'is_deleted'], self.get_out_state()['delta']['signature']['columns'])
+
+
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
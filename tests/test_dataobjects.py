@@ -0,0 +1,38 @@
+import unittest
+
+from ms_graph.dataobjects import get_list_definition
+
+
+class TestListDefinition(unittest.TestCase):
+
+    def test_list_definition(self):
+        sh_list = {'id': 'list-1', 'displayName': 'Orders', 'description': 'All orders', 'eTag': '"1"',
+                   'list': {'template': 'genericList', 'contentTypesEnabled': False, 'hidden': False},
+                   'columns': [{'id': '1', 'name': 'Title', 'displayName': 'Order', 'required': True, 'text': {}},
+                               {'id': '2', 'name': 'ID', 'displayName': 'ID', 'readOnly': True, 'number': {}},
+                               {'id': '3', 'name': 'Amount', 'displayName': 'Amount', 'readOnly': False,
+                                'indexed': True, 'number': {'decimalPlaces': 'two'}, 'text': None},
+                               {'id': '4', 'name': 'Total', 'displayName': 'Total', 'readOnly': True,
+                                'calculated': {'formula': '=[Amount]*2'}},
+                               {'id': '5', 'name': 'Attachments', 'displayName': 'Attachments', 'boolean': {}},
+                               {'id': '6', 'name': '_Hidden', 'displayName': 'Hidden', 'text': {}}]}
+
+        definition = get_list_definition(sh_list, system_columns=['Attachments'])
+
+        self.assertEqual({'displayName': 'Orders', 'description': 'All orders',
+                          'columns': [{'name': 'Amount', 'displayName': 'Amount', 'indexed': True,
+                                       'number': {'decimalPlaces': 'two'}},
+                                      {'name': 'Total', 'displayName': 'Total',
+                                       'calculated': {'formula': '=[Amount]*2'}}],
+                          'list': {'template': 'genericList', 'contentTypesEnabled': False, 'hidden': False}},
+                         definition)
+
+    def test_unsupported_list(self):
+        with self.assertRaises(ValueError):
+            get_list_definition({'displayName': 'Docs', 'list': {'template': 'documentLibrary'}, 'columns': []})
+        with self.assertRaises(ValueError):
+            get_list_definition({'displayName': 'Orders', 'columns': [{'name': 'Other', 'displayName': 'Other'}]})
+
+
+if __name__ == "__main__":
+    unittest.main()
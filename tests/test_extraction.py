@@ -0,0 +1,91 @@
+import unittest
+
+from extraction import ListExtractor, get_column_mapping
+from ms_graph.exceptions import Gone
+
+
+class FakeClient:
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def get_list_items(self, site_id, list_id, field_names=None, page_size=1000):
+        self.calls.append((site_id, list_id, field_names, page_size))
+        yield from self.pages
+
+    def get_list_items_delta(self, site_id, list_id, field_names=None, delta_link=None):
+        self.calls.append(('delta', field_names, delta_link))
+        if delta_link == 'expired':
+            raise Gone('Delta link expired', {'error': {'code': 'resyncRequired'}})
+        for i, page in enumerate(self.pages):
+            yield page, 'next-link' if i == len(self.pages) - 1 else None
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, data, user_values=None):
+        self.rows.append({**data, **user_values})
+
+
+LIST_COLUMNS = [{'name': 'Title', 'displayName': 'Title'},
+                {'name': 'field_1', 'displayName': 'Amount'},
+                {'name': 'field_2', 'displayName': 'Note'}]
+
+
+class TestExtraction(unittest.TestCase):
+
+    def test_column_mapping(self):
+        self.assertEqual([{'name': 'id', 'displayName': 'id'}] + LIST_COLUMNS, get_column_mapping(LIST_COLUMNS))
+        self.assertEqual([{'name': 'id', 'displayName': 'id'}, {'name': 'field_1', 'displayName': 'Amount'},
+                          {'name': 'Title', 'displayName': 'Title'}],
+                         get_column_mapping(LIST_COLUMNS, ['Amount', 'Title']))
+        with self.assertRaises(ValueError):
+            get_column_mapping(LIST_COLUMNS, ['Missing'])
+
+    def test_extract_selects_mapped_fields(self):
+        pages = [[{'id': '1', 'fields': {'@odata.etag': 'x', 'Title': 'a', 'field_1': 0}}],
+                 [{'id': '2', 'fields': {'Title': 'b'}}]]
+        client = FakeClient(pages)
+        writer = FakeWriter()
+        extractor = ListExtractor(client, 'site', 'list', get_column_mapping(LIST_COLUMNS, ['Title', 'Amount']),
+                                  page_size=10)
+
+        count = extractor.extract(writer, user_values={'list_id': 'list'})
+
+        self.assertEqual(2, count)
+        self.assertEqual([('site', 'list', ['Title', 'field_1'], 10)], client.calls)
+        self.assertEqual([{'Title': 'a', 'field_1': 0, 'id': '1', 'list_id': 'list'},
+                          {'Title': 'b', 'id': '2', 'list_id': 'list'}], writer.rows)
+
+    def test_delta_flags_deleted_items(self):
+        client = FakeClient([[{'id': '1', 'fields': {'Title': 'a'}}], [{'id': '2', 'deleted': {'state': 'deleted'}}]])
+        writer = FakeWriter()
+        mapping = get_column_mapping(LIST_COLUMNS, ['Title'], deleted_flag=True)
+        extractor = ListExtractor(client, 'site', 'list', mapping, delta=True, delta_link='previous-link')
+
+        extractor.extract(writer, user_values={'list_id': 'list'})
+
+        self.assertEqual([('delta', ['Title'], 'previous-link')], client.calls)
+        self.assertEqual([{'Title': 'a', 'id': '1', 'is_deleted': 0, 'list_id': 'list'},
+                          {'id': '2', 'is_deleted': 1, 'list_id': 'list'}], writer.rows)
+        self.assertTrue(extractor.incremental)
+        self.assertEqual('next-link', extractor.delta_link)
+
+    def test_delta_expired_link_reads_all(self):
+        client = FakeClient([[{'id': '1', 'fields': {'Title': 'a'}}]])
+        writer = FakeWriter()
+        mapping = get_column_mapping(LIST_COLUMNS, ['Title'], deleted_flag=True)
+        extractor = ListExtractor(client, 'site', 'list', mapping, delta=True, delta_link='expired')
+
+        self.assertEqual(1, extractor.extract(writer, user_values={}))
+        self.assertEqual([('delta', ['Title'], 'expired'), ('delta', ['Title'], None)], client.calls)
+        self.assertFalse(extractor.incremental)
+        self.assertEqual('next-link', extractor.delta_link)
+
+
+if __name__ == "__main__":
+    unittest.main()
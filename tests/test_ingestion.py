@@ -0,0 +1,87 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from ingestion import TableReader, split_records
+
+
+class TestTableReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_plain_table(self):
+        path = os.path.join(self.tmp_dir.name, 'test.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write('id,text\n1,"multi\nline"\n2,ěšč\n')
+
+        reader = TableReader({'full_path': path})
+
+        self.assertEqual(['id', 'text'], reader.header)
+        self.assertEqual([['1', 'multi\nline'], ['2', 'ěšč']], list(reader.rows()))
+
+    def test_blank_lines_and_short_rows(self):
+        path = os.path.join(self.tmp_dir.name, 'test.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write('a,b\n1,2\n\n3\n4,5\n')
+
+        reader = TableReader({'full_path': path})
+        expected = [['1', '2'], ['3', ''], ['4', '5']]
+
+        self.assertEqual(expected, list(reader.rows()))
+        self.assertEqual(expected, [row for r in reader.byte_ranges(range_size=4) for row in reader.read_range(*r)])
+
+    def test_split_records_keeps_enclosed_line_breaks(self):
+        data = b'1,"a\n""b\n"\n2,c\n3,"\n"\n'
+        # every range size splits between the whole records only
+        for range_size in range(1, len(data) + 1):
+            ranges = split_records(data, 0, range_size, b'"')
+            self.assertTrue(set(e for _, e in ranges) <= {11, 15, 21}, range_size)
+            self.assertEqual(len(data), ranges[-1][1])
+
+    def test_byte_ranges_match_rows(self):
+        path = os.path.join(self.tmp_dir.name, 'test.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write('id,text\n' + ''.join(f'{i},"multi\nline ""{i}"""\n' for i in range(50)))
+
+        reader = TableReader({'full_path': path})
+        ranges = reader.byte_ranges(range_size=64)
+
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(list(reader.rows()), [row for r in ranges for row in reader.read_range(*r)])
+
+    def test_gzip_table(self):
+        path = os.path.join(self.tmp_dir.name, 'test.csv.gz')
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+            f.write('id,text\n1,a\n')
+
+        reader = TableReader({'full_path': path})
+
+        self.assertEqual(['id', 'text'], reader.header)
+        self.assertEqual([['1', 'a']], list(reader.rows()))
+        self.assertIsNone(reader.byte_ranges())
+
+    def test_sliced_table(self):
+        path = os.path.join(self.tmp_dir.name, 'test.csv')
+        os.mkdir(path)
+        with open(os.path.join(path, 'part0'), 'w', encoding='utf-8') as f:
+            f.write('1,a\n')
+        with gzip.open(os.path.join(path, 'part1.gz'), 'wt', encoding='utf-8') as f:
+            f.write('2,b\n')
+        with open(path + '.manifest', 'w') as f:
+            json.dump({'columns': ['id', 'text']}, f)
+
+        reader = TableReader({'full_path': path})
+
+        self.assertEqual(['id', 'text'], reader.header)
+        self.assertEqual([['1', 'a'], ['2', 'b']], list(reader.rows()))
+        self.assertEqual(sum(os.path.getsize(f) for f in reader.files), reader.size)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from metadata_cache import MetadataCache
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = MetadataCache(ttl=60, clock=self.clock)
+        self.key = MetadataCache.build_key('tenant.sharepoint.com', '/sites/Team/', 'My List')
+        self.cache.put(self.key, {'id': 'site', 'name': 'Team'}, {'id': 'list', 'name': 'MyList', 'eTag': '"1"'},
+                       [{'name': 'Title'}])
+
+    def test_fresh_entry(self):
+        self.assertEqual('tenant.sharepoint.com/sites/Team/My List', self.key)
+        entry = self.cache.get(self.key)
+        self.assertEqual({'id': 'site'}, entry['site'])
+        self.assertEqual('list', entry['list']['id'])
+        self.assertIsNone(self.cache.get_expired(self.key))
+
+    def test_expired_entry_is_revalidated(self):
+        self.clock.now += 60
+        self.assertIsNone(self.cache.get(self.key))
+        self.assertIsNotNone(self.cache.get_expired(self.key))
+
+        self.cache.touch(self.key, '"2"')
+
+        self.assertEqual('"2"', self.cache.get(self.key)['list']['eTag'])
+
+    def test_state_round_trip(self):
+        restored = MetadataCache(self.cache.to_dict(), ttl=60, clock=self.clock)
+        self.assertEqual(self.cache.get(self.key), restored.get(self.key))
+
+        self.cache.invalidate(self.key)
+        self.assertEqual({}, self.cache.to_dict())
+
+    def test_disabled(self):
+        cache = MetadataCache(ttl=0, clock=self.clock)
+        cache.put(self.key, {'id': 'site'}, {'id': 'list'}, [])
+        self.assertIsNone(cache.get(self.key))
+        self.assertEqual({}, cache.to_dict())
+
+
+if __name__ == "__main__":
+    unittest.main()
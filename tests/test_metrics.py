@@ -0,0 +1,65 @@
+import unittest
+
+from ms_graph.metrics import Histogram, RunMetrics, get_endpoint_name
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRunMetrics(unittest.TestCase):
+
+    def test_endpoint_name(self):
+        self.assertEqual('/$batch', get_endpoint_name('https://graph.microsoft.com/v1.0/$batch'))
+        self.assertEqual('/sites/{id}/lists/{id}/items',
+                         get_endpoint_name('https://graph.microsoft.com/v1.0/sites/a,b,c/lists/l1/items?$top=10'))
+        self.assertEqual('/sites/{id}/lists/{id}/items/{id}/fields',
+                         get_endpoint_name('/sites/s/lists/l1/items/5/fields'))
+        self.assertEqual('token', get_endpoint_name('https://login.microsoftonline.com/common/oauth2/v2.0/token'))
+
+    def test_histogram_quantiles(self):
+        hist = Histogram((1, 2, 5))
+        for v in (0.5, 0.5, 1.5, 4, 10):
+            hist.observe(v)
+
+        self.assertEqual(1, hist.quantile(0.4))
+        self.assertEqual(5, hist.quantile(0.8))
+        self.assertIsNone(hist.quantile(0.99))
+        self.assertEqual([(1, 2), (2, 3), (5, 4), ('+Inf', 5)], list(hist.cumulative_counts()))
+
+    def test_summary(self):
+        clock = FakeClock()
+        metrics = RunMetrics(clock=clock)
+        with metrics.phase('write'):
+            clock.now = 2.5
+        metrics.record_request('POST', 'https://graph.microsoft.com/v1.0/$batch', 200, 0.2, sent=100, received=50)
+        metrics.record_request('POST', 'https://graph.microsoft.com/v1.0/$batch', 429, 0.01)
+        metrics.record_batch(20)
+        metrics.record_retries('throttled', 3)
+        metrics.record_throttle()
+        metrics.record_throttle_wait(1.5)
+
+        summary = metrics.to_dict()
+
+        self.assertEqual({'write': 2.5}, summary['phases'])
+        self.assertEqual({'total': 2, 'by_endpoint': {'POST /$batch': {'200': 1, '429': 1}}}, summary['requests'])
+        self.assertEqual(2, summary['latency_seconds']['/$batch']['count'])
+        self.assertEqual({'count': 1, 'items': 20}, {k: summary['batches'][k] for k in ('count', 'items')})
+        self.assertEqual({'throttled': 3}, summary['retries'])
+        self.assertEqual({'events': 1, 'wait_seconds': 1.5}, summary['throttling'])
+        self.assertEqual({'sent': 100, 'received': 50}, summary['bytes'])
+
+        text = metrics.to_openmetrics()
+        self.assertIn('sharepoint_writer_requests_total{method="POST",endpoint="/$batch",status="429"} 1', text)
+        self.assertIn('sharepoint_writer_request_duration_seconds_bucket{endpoint="/$batch",le="+Inf"} 2', text)
+        self.assertIn('sharepoint_writer_batch_size_count 1', text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+
+if __name__ == "__main__":
+    unittest.main()
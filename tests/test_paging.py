@@ -0,0 +1,37 @@
+import unittest
+
+from ms_graph.paging import prefetch
+
+
+class TestPaging(unittest.TestCase):
+
+    def test_prefetch_keeps_order(self):
+        self.assertEqual(list(range(100)), list(prefetch(iter(range(100)), depth=3)))
+
+    def test_prefetch_raises_producer_error(self):
+        def pages():
+            yield 1
+            raise ValueError('failed')
+
+        result = prefetch(pages())
+        self.assertEqual(1, next(result))
+        with self.assertRaises(ValueError):
+            next(result)
+
+    def test_prefetch_stops_when_consumer_stops(self):
+        fetched = []
+
+        def pages():
+            for i in range(100):
+                fetched.append(i)
+                yield i
+
+        result = prefetch(pages(), depth=2)
+        self.assertEqual(0, next(result))
+        result.close()
+        # the producer does not run ahead after the consumer stopped
+        self.assertLessEqual(len(fetched), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+
+from column_plan import ColumnPlan
+from ingestion import TableReader
+from ms_graph.batch import encode_create_item_request, with_request_id
+from parallel_ingestion import ParallelRequestEncoder
+
+LIST_COLUMNS = [{'name': 'Title', 'text': {}}, {'name': 'amount', 'number': {}}]
+
+
+class TestParallelRequestEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp_dir.name, 'test.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            # blank lines and short rows are handled the same way as by the serial reader
+            f.write('name,amount\n' + ''.join(f'"row\n{i}",{i}\n' if i % 7 else f'\n"row {i}"\n' for i in range(200)))
+        self.table = TableReader({'full_path': path})
+        self.plan = ColumnPlan(self.table.header, LIST_COLUMNS, [], 'name')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_requests_in_row_order(self):
+        encoder = ParallelRequestEncoder(self.table, self.plan, 'site', 'list', workers=2, range_size=256)
+        ranges = encoder.get_ranges()
+
+        requests = list(encoder.requests(ranges, start=150))
+
+        expected = [with_request_id(str(i), encode_create_item_request('site', 'list', self.plan.to_fields(row)))
+                    for i, row in enumerate(self.table.rows())][150:]
+        self.assertGreater(len(ranges), 2)
+        self.assertEqual(expected, requests)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from ms_graph.purge import ListPurger
+
+
+class FakeClient:
+
+    def __init__(self, item_ids, page_size, failing=()):
+        self.items = set(item_ids)
+        self.pages = [item_ids[i:i + page_size] for i in range(0, len(item_ids), page_size)]
+        self.failing = failing
+
+    def get_list_item_ids(self, site_id, list_id, page_size=None):
+        yield from self.pages
+
+    def build_delete_list_item_batch_request(self, rq_id, site_id, list_id, item_id):
+        return {'id': rq_id, 'url': f'/sites/{site_id}/lists/{list_id}/items/{item_id}', 'method': 'DELETE'}
+
+    def make_batch_request(self, batch_requests, r_type='', all_responses=False):
+        failed = []
+        for rq in batch_requests:
+            item_id = rq['url'].rsplit('/', 1)[-1]
+            if item_id in self.failing:
+                failed.append({'id': rq['id'], 'status': 403,
+                               'body': {'error': {'code': 'accessDenied', 'message': 'Access denied'}}})
+            else:
+                self.items.discard(item_id)
+        return failed
+
+
+class TestListPurger(unittest.TestCase):
+
+    def test_purge_deletes_all_pages(self):
+        client = FakeClient([str(i) for i in range(95)], page_size=30)
+        result = ListPurger(client, max_in_flight=4).purge('site', 'list')
+        self.assertEqual(95, result.deleted)
+        self.assertEqual([], result.failed)
+        self.assertEqual(set(), client.items)
+
+    def test_purge_reports_items_not_deleted(self):
+        client = FakeClient([str(i) for i in range(45)], page_size=10, failing=('7', '33'))
+        result = ListPurger(client, max_in_flight=4).purge('site', 'list')
+        self.assertEqual(43, result.deleted)
+        self.assertEqual(['7', '33'], [f['item_id'] for f in result.failed])
+        self.assertEqual('accessDenied', result.failed[0]['code'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import tempfile
+import unittest
+
+from result import ListDataResultWriter
+
+
+class TestListDataResultWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.out_dir = tempfile.TemporaryDirectory()
+        self.mapping = [{'name': 'ID', 'displayName': 'ID'},
+                        {'name': 'field_1', 'displayName': 'Amount'},
+                        {'name': 'Title', 'displayName': 'Title'}]
+        self.writer = ListDataResultWriter(self.out_dir.name, self.mapping, 'items')
+
+    def tearDown(self):
+        self.writer.close()
+        self.out_dir.cleanup()
+
+    def test_change_col_names(self):
+        data = {'id': '1', 'Title': '', 'field_1': 0, '@odata.etag': 'x'}
+
+        res = self.writer._change_col_names(data)
+
+        self.assertEqual({'ID': '1', 'Amount': 0, 'Title': ''}, res)
+        self.assertEqual(['ID', 'Amount', 'Title'], list(res))
+        # neither the record nor the mapping is modified
+        self.assertEqual({'id': '1', 'Title': '', 'field_1': 0, '@odata.etag': 'x'}, data)
+        self.assertEqual('ID', self.mapping[0]['name'])
+
+    def test_change_col_names_missing_fields(self):
+        self.assertEqual({'ID': '2'}, self.writer._change_col_names({'id': '2'}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+from row_state import decode_row_map, encode_row_map
+
+
+class TestRowState(unittest.TestCase):
+
+    def test_encode_decode_roundtrip(self):
+        row_map = {f'key-{i}': (str(i + 1), bytes([i % 256]) * 8) for i in range(1000)}
+        row_map['ěščř'] = ('4294967295', b'\xff' * 8)
+
+        decoded = decode_row_map(encode_row_map(row_map))
+
+        self.assertEqual(len(row_map), len(decoded))
+        self.assertEqual(row_map['key-10'], decoded.get('key-10'))
+        self.assertEqual(row_map, dict(decoded.items()))
+
+    def test_empty_map(self):
+        self.assertEqual(0, len(decode_row_map(encode_row_map({}))))
+
+    def test_invalid_key_fails(self):
+        with self.assertRaises(ValueError):
+            encode_row_map({'a\0b': ('1', b'\0' * 8)})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+
+from sync import IncrementalSync, InPlaceReplace, RowHasher
+
+
+class FakeClient:
+
+    def __init__(self, items):
+        self.items = items
+        self.requests = []
+
+    def get_list_items(self, site_id, list_id, field_names=None):
+        yield self.items
+
+    def get_list_item_ids(self, site_id, list_id):
+        yield [i['id'] for i in self.items]
+
+    def build_create_list_item_batch_request(self, rq_id, site_id, list_id, fields):
+        return {'id': rq_id, 'method': 'POST', 'body': {'fields': fields}}
+
+    def build_update_list_item_batch_request(self, rq_id, site_id, list_id, item_id, fields):
+        return {'id': rq_id, 'method': 'PATCH', 'item_id': item_id, 'body': fields}
+
+    def build_delete_list_item_batch_request(self, rq_id, site_id, list_id, item_id):
+        return {'id': rq_id, 'method': 'DELETE', 'item_id': item_id}
+
+    def make_batch_request(self, batch_requests, r_type='', all_responses=False):
+        self.requests.extend(batch_requests)
+        return [{'id': rq['id'], 'status': 201, 'body': {'id': str(100 + len(self.requests))}}
+                for rq in batch_requests]
+
+
+class TestIncrementalSync(unittest.TestCase):
+
+    def test_row_hash_ignores_column_order_and_types(self):
+        hasher = RowHasher(['b', 'a'])
+        self.assertEqual(hasher.hash({'a': '1', 'b': None}), hasher.hash({'b': '', 'a': 1, 'c': 'x'}))
+        self.assertNotEqual(hasher.hash({'a': '1', 'b': ''}), hasher.hash({'a': '2', 'b': ''}))
+
+    def test_sync_sends_only_changes(self):
+        client = FakeClient([{'id': '1', 'fields': {'Title': 'a', 'val': 'x'}},
+                             {'id': '2', 'fields': {'Title': 'b', 'val': 'y'}},
+                             {'id': '3', 'fields': {'Title': 'c', 'val': 'z'}},
+                             {'id': '4', 'fields': {'Title': 'c', 'val': 'z'}}])
+        records = [{'Title': 'a', 'val': 'x'}, {'Title': 'b', 'val': 'changed'}, {'Title': 'd', 'val': 'new'}]
+
+        result = IncrementalSync(client, 'site', 'list', 'Title', ['Title', 'val']).sync(records)
+
+        self.assertEqual((1, 1, 2, 1), (result.created, result.updated, result.deleted, result.unchanged))
+        self.assertEqual([('PATCH', '2'), ('POST', None), ('DELETE', '3'), ('DELETE', '4')],
+                         [(r['method'], r.get('item_id')) for r in client.requests])
+        self.assertEqual({'a': '1', 'b': '2', 'd': '104'}, {k: v[0] for k, v in result.row_map.items()})
+
+    def test_sync_with_known_rows_skips_list_read(self):
+        client = FakeClient(None)
+        hasher = RowHasher(['Title', 'val'])
+        existing = {'a': ('1', hasher.hash({'Title': 'a', 'val': 'x'}))}
+
+        result = IncrementalSync(client, 'site', 'list', 'Title', ['Title', 'val']).sync(
+            [{'Title': 'a', 'val': 'x'}], existing=existing)
+
+        self.assertEqual(1, result.unchanged)
+        self.assertEqual([], client.requests)
+
+    def test_sync_normalizes_dates_and_numbers(self):
+        client = FakeClient([{'id': '1', 'fields': {'Title': 'a', 'when': '2020-01-31T10:00:00Z', 'n': 1.0}},
+                             {'id': '2', 'fields': {'Title': 'b', 'when': '2020-01-31T00:00:00Z', 'n': 2.5}},
+                             {'id': '3', 'fields': {'Title': 'c', 'when': '2020-01-31T08:00:00Z', 'n': 3}}])
+        records = [{'Title': 'a', 'when': '2020-01-31T10:00:00', 'n': 1},
+                   {'Title': 'b', 'when': '2020-01-31', 'n': 2.5},
+                   {'Title': 'c', 'when': '2020-01-31T10:00:00+02:00', 'n': 4}]
+
+        result = IncrementalSync(client, 'site', 'list', 'Title', ['Title', 'when', 'n'],
+                                 column_types={'when': 'dateTime', 'n': 'number'}).sync(records)
+
+        self.assertEqual((0, 1, 0, 2), (result.created, result.updated, result.deleted, result.unchanged))
+        self.assertEqual([('PATCH', '3')], [(r['method'], r.get('item_id')) for r in client.requests])
+
+    def test_number_keys_match_list_values(self):
+        client = FakeClient([{'id': '1', 'fields': {'code': 10.0}}])
+
+        result = IncrementalSync(client, 'site', 'list', 'code', ['code'],
+                                 column_types={'code': 'number'}).sync([{'code': 10}])
+
+        self.assertEqual(1, result.unchanged)
+        self.assertEqual([], client.requests)
+
+    def test_duplicate_key_fails(self):
+        sync = IncrementalSync(FakeClient([]), 'site', 'list', 'Title', ['Title'])
+        with self.assertRaises(ValueError):
+            sync.sync([{'Title': 'a'}, {'Title': 'a'}])
+
+
+class TestInPlaceReplace(unittest.TestCase):
+
+    def test_reuses_items_and_creates_surplus(self):
+        client = FakeClient([{'id': '1'}, {'id': '2'}])
+        records = [{'Title': 'a'}, {'Title': 'b'}, {'Title': 'c'}]
+
+        result = InPlaceReplace(client, 'site', 'list', cleared_fields=['note']).replace(records)
+
+        self.assertEqual((2, 1, 0), (result.updated, result.created, result.deleted))
+        self.assertEqual([('PATCH', '1'), ('PATCH', '2'), ('POST', None)],
+                         [(r['method'], r.get('item_id')) for r in client.requests])
+        self.assertEqual({'note': None, 'Title': 'a'}, client.requests[0]['body'])
+        self.assertEqual({'Title': 'c'}, client.requests[2]['body']['fields'])
+
+    def test_deletes_leftover_items(self):
+        client = FakeClient([{'id': '1'}, {'id': '2'}, {'id': '3'}])
+
+        result = InPlaceReplace(client, 'site', 'list').replace([{'Title': 'a'}])
+
+        self.assertEqual((1, 0, 2), (result.updated, result.created, result.deleted))
+        self.assertEqual([('PATCH', '1'), ('DELETE', '2'), ('DELETE', '3')],
+                         [(r['method'], r.get('item_id')) for r in client.requests])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import threading
+import time
+import unittest
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+from ms_graph.throttling import RateController, parse_retry_after
+
+
+class TestThrottling(unittest.TestCase):
+
+    def test_parse_retry_after(self):
+        self.assertEqual(10.0, parse_retry_after('10'))
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('invalid'))
+        retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+        self.assertAlmostEqual(30, parse_retry_after(retry_at), delta=2)
+
+    def test_throttled_response_delays_all_requests(self):
+        controller = RateController(max_concurrency=4)
+        controller.on_throttled(0.2)
+        self.assertEqual(2, controller.limit)
+
+        start = time.monotonic()
+        started = []
+
+        def request():
+            with controller.slot():
+                started.append(time.monotonic() - start)
+
+        threads = [threading.Thread(target=request) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertTrue(all(s >= 0.19 for s in started))
+
+    def test_limit_recovers_additively(self):
+        controller = RateController(max_concurrency=8)
+        controller.on_throttled(0)
+        controller.on_throttled(0)
+        self.assertEqual(2, controller.limit)
+        for _ in range(3):
+            controller.on_success()
+        self.assertEqual(3, controller.limit)
+
+    def test_partially_throttled_batch_keeps_request_rate(self):
+        controller = RateController(max_concurrency=8)
+        controller.on_throttled(0, partial=True)
+        self.assertEqual(4, controller.limit)
+        self.assertEqual(0.0, controller._interval)
+        controller.on_throttled(0)
+        self.assertEqual(2, controller.limit)
+        self.assertEqual(RateController.MIN_INTERVAL, controller._interval)
+
+
+if __name__ == "__main__":
+    unittest.main()